@@ -1,70 +1,313 @@
+import contextvars
+import functools
 import logging
-from fastapi import HTTPException, Query
+from contextlib import contextmanager
+from fastapi import HTTPException
 import mysql.connector
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
+import io
 import json
-import qrcode
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-# Logging configuration
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def hash_password(password: str):
-    return pwd_context.hash(password)
+import re
+import zipfile
+from functools import lru_cache
+
+import data_versions
+import ledger
+import rollups
+import streaks
+from db_router import on_primary, read_context, read_only, router
+from friend_graph import friend_graph
+from global_leaderboard import global_leaderboard
+from leaderboard_cache import leaderboard_cache
+from metrics import instrument_db, timed_checkout
+from pagination import DEFAULT_PAGE_SIZE, decode_cursor, paginate
+from password_hashing import hash_password, verify_and_update_password
+from step_buffer import StepBuffer
+from user_search import SEARCH_DEFAULT_LIMIT, user_search_index
+
+# Handlers are configured by log_config.setup_logging in main.py
+logger = logging.getLogger("fitness.db")
+
+# Set inside shared_connection(): DB functions reuse that connection instead of checking one out
+_shared_connection = contextvars.ContextVar("shared_connection", default=None)
+
+class _SharedConnection:
+    # Lent to several DB functions in a row; their close() must not return it to the pool
+    def __init__(self, connection, read_context):
+        self._connection = connection
+        self.read_context = read_context   # routing it was checked out under (db_router)
+
+    def close(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+@contextmanager
+def shared_connection():
+    """Run several DB_Interface functions on one checked-out connection."""
+    connection = timed_checkout(router.connect)
+    token = _shared_connection.set(_SharedConnection(connection, read_context()))
+    try:
+        yield
+    finally:
+        _shared_connection.reset(token)
+        connection.close()
 
 def get_db_connection():
-    return mysql.connector.connect(
-        host="localhost",
-        username="root",
-        password="Akash003!",
-        database="fitness"
-    )
+    # Checked out from the primary, or a replica inside @read_only functions (see db_router);
+    # connection.close() returns it to its pool.
+    # Checkout, execute and fetch times are recorded under the calling @instrument_db function.
+    shared = _shared_connection.get()
+    # Not from inside @on_primary, e.g. a buffered-steps flush in the middle of a
+    # dashboard read: the shared connection may be a replica's
+    if shared is not None and shared.read_context == read_context():
+        return shared
+    return timed_checkout(router.connect)
+
+def get_pool_stats():
+    return router.primary.stats()
+
+def get_router_stats():
+    return router.stats()
+
+def get_search_index_stats():
+    return user_search_index.stats()
+
+def get_friend_graph_stats():
+    return friend_graph.stats()
+
+@instrument_db
+def check_friend_graph(reload: bool = False):
+    """Compare the friendship graph with the table; optionally reload it afterwards."""
+    try:
+        report = friend_graph.check_consistency()
+        if reload:
+            friend_graph.load()
+    except mysql.connector.Error as err:
+        logger.error("Database error: %s", err)
+        raise HTTPException(status_code=400, detail=f"Database error: {err}")
+    report["consistent"] = not (report["missing"] or report["extra"] or report["different"])
+    report["reloaded"] = reload
+    return report
+
+def get_cache_stats():
+    return {"leaderboard": leaderboard_cache.stats()}
 
+@instrument_db
 def update_steps(step_data: dict):
     connection = get_db_connection()
     cursor = connection.cursor()
 
     try:
-        logging.info("[INSIDE UPDATE steps DB FUNC] Updated step data: %s", step_data)  # Debugging
-        logging.info("[INSIDE UPDATE steps DB FUNC] Midnight step data: %s", step_data["midnight_step_count"])  # Debugging
-        # Insert into users table with diet included
-        query = """
-        INSERT INTO steps (user_id, date, daily_step_count, midnight_step_count)
-        VALUES (%s, %s, %s, %s)
-        ON DUPLICATE KEY UPDATE 
-            daily_step_count = VALUES(daily_step_count), 
-            midnight_step_count = VALUES(midnight_step_count), 
-            updated_at = CURRENT_TIMESTAMP;
-        """
-        cursor.execute(query, (
-            step_data['user_id'], 
-            step_data['date'], 
-            step_data['steps'], 
-            step_data['midnight_step_count'] # Check this properly
-        ))
-        connection.commit()
+        row = _step_row(step_data)
+
+        def write():
+            global_leaderboard.commit_steps(connection, _write_step_rows(cursor, [row]))
+
+        _retry_deadlocks(connection, write)
+        router.note_write(row[0])
+        _invalidate_leaderboards([(row[0], row[1])])
+
+    except (KeyError, TypeError, ValueError) as err:
+        raise HTTPException(status_code=400, detail=f"Invalid step data: {err}")
 
     except mysql.connector.Error as err:
         connection.rollback()
-        print("Database error:", err)  # Debugging
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=400, detail=f"Database error: {err}")
     
     finally:
         cursor.close()
         connection.close()
 
-def register_user(user_data: dict):
+def _invalidate_leaderboards(written: list):
+    # Leaderboards only show past days, so only prior-day writes can change them
+    today = datetime.now().date()
+    for user_id, day in written:
+        try:
+            if not isinstance(day, type(today)):
+                day = datetime.strptime(str(day), "%Y-%m-%d").date()
+            if day >= today:
+                continue
+        except ValueError:
+            pass
+        leaderboard_cache.invalidate(int(user_id))
+
+# Upper bound on rows per multi-row INSERT in update_steps_batch
+STEP_BATCH_CHUNK_SIZE = 500
+
+# MySQL error for a transaction InnoDB rolled back to break a deadlock
+ER_LOCK_DEADLOCK = 1213
+# Tries of a step write transaction that keeps deadlocking
+STEP_WRITE_ATTEMPTS = 3
+
+def _is_deadlock(err):
+    return getattr(err, "errno", None) == ER_LOCK_DEADLOCK
+
+def _retry_deadlocks(connection, write):
+    # Concurrent first writes of the same (user_id, date) can deadlock on the gap
+    # locks rollups.lock_current_steps takes for missing rows. InnoDB then rolls
+    # back the whole transaction, so write() is run again from the start.
+    for attempt in range(1, STEP_WRITE_ATTEMPTS + 1):
+        try:
+            return write()
+        except mysql.connector.Error as err:
+            if not _is_deadlock(err) or attempt == STEP_WRITE_ATTEMPTS:
+                raise
+            connection.rollback()
+            logger.warning("Step write deadlocked, retrying (attempt %s of %s)", attempt + 1, STEP_WRITE_ATTEMPTS)
+
+def _step_row(record: dict):
+    # Validate one step record and turn it into an INSERT parameter tuple
+    user_id = int(record['user_id'])
+    day = datetime.strptime(str(record['date']), "%Y-%m-%d").date()
+    steps = int(record['steps'])
+    midnight_step_count = record['midnight_step_count']
+    if midnight_step_count is not None:
+        midnight_step_count = int(midnight_step_count)
+    if steps < 0:
+        raise ValueError("steps must not be negative")
+    return (user_id, day, steps, midnight_step_count)
+
+@instrument_db
+def update_steps_batch(records: list):
+    """
+    Upsert many (user_id, date) step records in one transaction.
+
+    Rows are written with multi-row INSERT ... ON DUPLICATE KEY UPDATE in chunks.
+    If a chunk fails, it is rolled back to its savepoint and retried row by row
+    so only the offending records are reported as failed.
+    """
+    # Older buffered values for these users must not land on top of this batch
+    user_ids = set()
+    for record in records:
+        try:
+            user_ids.add(int(record['user_id']))
+        except (KeyError, TypeError, ValueError):
+            pass
+    _flush_buffered_steps(user_ids)
+    return _write_step_records(records)
+
+@instrument_db
+@on_primary
+def flush_buffered_steps(records: list):
+    # Writer of the write-behind buffer (step_buffer)
+    return _write_step_records(records)
+
+def _write_step_records(records: list):
+    results = [None] * len(records)
+    rows = []
+    for index, record in enumerate(records):
+        try:
+            rows.append((index, _step_row(record)))
+        except (KeyError, TypeError, ValueError) as err:
+            results[index] = {"index": index, "status": "error", "detail": f"Invalid record: {err}"}
+
     connection = get_db_connection()
     cursor = connection.cursor()
 
-    # Hash the password before storing it
+    def write():
+        deltas = []   # step changes of the chunks / rows that were written
+        for start in range(0, len(rows), STEP_BATCH_CHUNK_SIZE):
+            chunk = rows[start:start + STEP_BATCH_CHUNK_SIZE]
+            cursor.execute("SAVEPOINT step_batch")
+            try:
+                deltas.append(_write_step_rows(cursor, [row for _, row in chunk]))
+                for index, _ in chunk:
+                    results[index] = {"index": index, "status": "ok"}
+            except mysql.connector.Error as err:
+                if _is_deadlock(err):
+                    raise   # the savepoints went with the transaction
+                cursor.execute("ROLLBACK TO SAVEPOINT step_batch")
+                for index, row in chunk:
+                    cursor.execute("SAVEPOINT step_row")
+                    try:
+                        deltas.append(_write_step_rows(cursor, [row]))
+                        results[index] = {"index": index, "status": "ok"}
+                    except mysql.connector.Error as err:
+                        if _is_deadlock(err):
+                            raise
+                        cursor.execute("ROLLBACK TO SAVEPOINT step_row")
+                        results[index] = {"index": index, "status": "error", "detail": f"Database error: {err}"}
+        global_leaderboard.commit_steps(connection, *deltas)
+
+    try:
+        _retry_deadlocks(connection, write)
+
+    except mysql.connector.Error as err:
+        connection.rollback()
+        logger.error("Database error: %s", err)
+        raise HTTPException(status_code=400, detail=f"Database error: {err}")
+
+    finally:
+        cursor.close()
+        connection.close()
+
+    written = {(row[0], row[1]) for index, row in rows if results[index]["status"] == "ok"}
+    router.note_write(*{user_id for user_id, _ in written})
+    _invalidate_leaderboards(written)
+    return results
+
+# Write-behind buffer for /update-steps; started by main.py when STEP_WRITE_BEHIND=1
+step_buffer = StepBuffer(flush_buffered_steps)
+
+def buffer_steps(step_data: dict):
+    """Validate a step record and queue it in the write-behind buffer."""
+    try:
+        user_id, day, _, _ = _step_row(step_data)
+    except (KeyError, TypeError, ValueError) as err:
+        raise HTTPException(status_code=400, detail=f"Invalid step data: {err}")
+    step_buffer.add(user_id, day, step_data)
+
+def get_step_buffer_stats():
+    return step_buffer.stats()
+
+def _flush_buffered_steps(user_ids):
+    # Cheap no-op unless write-behind mode has something pending for these users
+    if step_buffer.has_pending(user_ids):
+        step_buffer.flush_quietly(user_ids)
+
+def reads_buffered_steps(func):
+    """Write the user's buffered step records before reading their steps."""
+    @functools.wraps(func)
+    def wrapper(user_id, *args, **kwargs):
+        _flush_buffered_steps([user_id])
+        return func(user_id, *args, **kwargs)
+    return wrapper
+
+def _write_step_rows(cursor, rows: list):
+    # Upsert step rows and keep the rollup, streak and version tables in step, in the caller's transaction.
+    # Returns the step deltas, for the global leaderboard once the transaction is committed.
+    previous = rollups.lock_current_steps(cursor, rows)
+    _upsert_step_rows(cursor, rows)
+    deltas = rollups.step_deltas(rows, previous)
+    rollups.apply_step_deltas(cursor, deltas)
+    streaks.apply_step_changes(cursor, rows, previous)
+    data_versions.bump(cursor, "steps", [row[0] for row in rows])
+    return deltas
+
+def _upsert_step_rows(cursor, rows: list):
+    placeholders = ", ".join(["(%s, %s, %s, %s)"] * len(rows))
+    query = f"""
+    INSERT INTO steps (user_id, date, daily_step_count, midnight_step_count)
+    VALUES {placeholders}
+    ON DUPLICATE KEY UPDATE 
+        daily_step_count = VALUES(daily_step_count), 
+        midnight_step_count = VALUES(midnight_step_count), 
+        updated_at = CURRENT_TIMESTAMP;
+    """
+    cursor.execute(query, [value for row in rows for value in row])
+
+@instrument_db
+def register_user(user_data: dict):
+    # Hash the password before storing it (runs in the hashing process pool,
+    # before a connection is checked out so none is held during bcrypt)
     hashed_password = hash_password(user_data['password'])
 
+    connection = get_db_connection()
+    cursor = connection.cursor()
+
     try:
         # Insert into users table with diet included
         query_users = """INSERT INTO users (username, phone_number, email, DOB, height, weight, blood_group, gender, experience, stepgoal, caloriegoal, password) 
@@ -84,16 +327,19 @@ def register_user(user_data: dict):
             hashed_password
         ))
         connection.commit()
+        router.note_write(cursor.lastrowid)
+        user_search_index.add(cursor.lastrowid, user_data['username'])
     
     except mysql.connector.Error as err:
         connection.rollback()
-        print("Database error:", err)  # Debugging
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=400, detail=f"Database error: {err}")
     
     finally:
         cursor.close()
         connection.close()
 
+@instrument_db
 def login_user(user_data: dict):
     connection = get_db_connection()
     cursor = connection.cursor(dictionary=True)  # Fetch results as dictionary
@@ -108,54 +354,76 @@ def login_user(user_data: dict):
         cursor.execute(query, (user_data['phone_number'],))
         db_user_profiles = cursor.fetchall()
 
-        # Check if user exists
-        if not db_user_profiles:
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-
-        db_user = db_user_profiles[0]  # There should be one matching user
-
-        # Check if the password matches
-        if not verify_password(user_data['password'], db_user['password']):
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-
-        # Return user details without the password
-        return {
-            "user_id": db_user['user_id'],
-            "username": db_user['username'],
-            "phone_number": db_user['phone_number'],
-            "height": db_user['height'],
-            "weight": db_user['weight'],
-            "email": db_user['email'],
-            "gender": db_user['gender'],
-            "experience": db_user['experience'],
-            "stepgoal": db_user['stepgoal'],
-            "blood_group": db_user['blood_group'],
-            "DOB": db_user['DOB'],
-            "caloriegoal": db_user['caloriegoal']
-        }
-
     except mysql.connector.Error as err:
         raise HTTPException(status_code=500, detail=f"Error: {err}")
     
+    finally:
+        # Released before bcrypt runs, so a login never holds a connection for the hash time
+        cursor.close()
+        connection.close()
+
+    # Check if user exists
+    if not db_user_profiles:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    db_user = db_user_profiles[0]  # There should be one matching user
+
+    # Check if the password matches
+    valid, new_hash = verify_and_update_password(user_data['password'], db_user['password'])
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    # Transparently upgrade hashes made with an outdated cost factor
+    if new_hash:
+        _rehash_password(db_user['user_id'], new_hash)
+
+    # Return user details without the password
+    return {
+        "user_id": db_user['user_id'],
+        "username": db_user['username'],
+        "phone_number": db_user['phone_number'],
+        "height": db_user['height'],
+        "weight": db_user['weight'],
+        "email": db_user['email'],
+        "gender": db_user['gender'],
+        "experience": db_user['experience'],
+        "stepgoal": db_user['stepgoal'],
+        "blood_group": db_user['blood_group'],
+        "DOB": db_user['DOB'],
+        "caloriegoal": db_user['caloriegoal']
+    }
+
+def _rehash_password(user_id, new_hash):
+    connection = get_db_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.execute("UPDATE users SET password = %s WHERE user_id = %s", (new_hash, user_id))
+        connection.commit()
+    except mysql.connector.Error as err:
+        connection.rollback()
+        logger.warning("Password rehash failed for user %s: %s", user_id, err)
     finally:
         cursor.close()
         connection.close()
 
+@instrument_db
+@reads_buffered_steps
+@read_only
 def get_weekly_statistics(user_id: int):
     connection = get_db_connection()
     cursor = connection.cursor(dictionary=True)
     try:
         cursor.execute("""
             SELECT 
-                DATE(date) AS day,
+                date AS day,
                 SUM(daily_step_count) AS total_steps
             FROM steps
             WHERE 
                 user_id = %s AND 
-                date >= DATE_SUB(CURDATE(), INTERVAL 7 DAY)
-            GROUP BY day
-            ORDER BY day ASC;
-        """, (user_id,))
+                date >= %s
+            GROUP BY date
+            ORDER BY date ASC;
+        """, (user_id, datetime.now().date() - timedelta(days=7)))
         weekly_data = cursor.fetchall()
 
         # Format data for the frontend
@@ -172,6 +440,7 @@ def get_weekly_statistics(user_id: int):
         cursor.close()
         connection.close()
 
+@instrument_db
 def insert_activity_data(activity_data: dict):
     connection = get_db_connection()  # Replace with your DB connection function
     cursor = connection.cursor()
@@ -189,38 +458,53 @@ def insert_activity_data(activity_data: dict):
         ))
         
         connection.commit()
+        router.note_write(activity_data['user_id'])
 
     except mysql.connector.Error as err:
         connection.rollback()
-        print("Database error:", err)  # Debugging
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=400, detail=f"Database error: {err}")
 
     finally:
         cursor.close()
         connection.close()
 
-def fetch_activities(user_id: int):
+@instrument_db
+@read_only
+def fetch_activities(user_id: int, limit: int = DEFAULT_PAGE_SIZE, page_cursor: str = None):
+    """
+    One page of a user's activities, newest first. Returns (activities, next_cursor).
+    """
+    after = decode_cursor(page_cursor, (datetime, int))
     connection = get_db_connection()  # Replace with your DB connection function
     cursor = connection.cursor(dictionary=True)
 
     try:
-        # Fetch activities for a specific user_id
+        # Keyset pagination on (activity_date, activity_id), both descending
         query = """SELECT activity_id, activity, duration, activity_date
                    FROM activities 
                    WHERE user_id = %s"""
-        cursor.execute(query, (user_id,))
+        params = [user_id]
+        if after:
+            query += """ AND (activity_date < %s OR (activity_date = %s AND activity_id < %s))"""
+            params += [after[0], after[0], after[1]]
+        query += """ ORDER BY activity_date DESC, activity_id DESC LIMIT %s"""
+        params.append(limit + 1)
+
+        cursor.execute(query, params)
         activities = cursor.fetchall()
 
-        return activities
+        return paginate(activities, limit, lambda row: (row['activity_date'], row['activity_id']))
 
     except mysql.connector.Error as err:
-        print("Database error:", err)  # Debugging
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=400, detail=f"Database error: {err}")
 
     finally:
         cursor.close()
         connection.close()
 
+@instrument_db
 def update_user(user_data: dict):
     connection = get_db_connection()
     cursor = connection.cursor()
@@ -247,59 +531,64 @@ def update_user(user_data: dict):
         ))
 
         connection.commit()
+        router.note_write(user_data['user_id'])
         return {"message": "Updated the user data successfully"}
     
     except mysql.connector.Error as err:
         connection.rollback()
-        print("Database error:", err)  # Debugging
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=400, detail=f"Database error: {err}")
     
     finally:
         cursor.close()
         connection.close()
 
+def _fresh_friend_graph():
+    try:
+        friend_graph.ensure_fresh()
+    except mysql.connector.Error as err:
+        logger.error("Database error: %s", err)
+        raise HTTPException(status_code=400, detail=f"Database error: {err}")
+    return friend_graph
+
+def _usernames(user_ids):
+    # Usernames come from the search index; refresh once if someone is missing
+    user_search_index.ensure_fresh()
+    if any(user_search_index.username(uid) is None for uid in user_ids):
+        user_search_index.refresh()
+    return {uid: user_search_index.username(uid) for uid in user_ids}
+
+@instrument_db
 def send_friend_request(requester_id: int, recipient_id: int):
+    graph = _fresh_friend_graph()
+
+    # Duplicate and reciprocal checks are lookups in the friendship graph
+    reciprocal = graph.edge(recipient_id, requester_id)
+    if reciprocal:
+        reciprocal_status = reciprocal[1]
+        if reciprocal_status == "pending":
+            raise HTTPException(status_code=400, detail="This user has already sent you a friend request.")
+
+    if recipient_id in graph.friends_of(requester_id):
+        raise HTTPException(status_code=400, detail="You are already friends.")
+
+    existing = graph.edge(requester_id, recipient_id)
+    if existing and existing[1] == "pending":
+        raise HTTPException(status_code=400, detail="Friend request already sent.")
+
     connection = get_db_connection()
     cursor = connection.cursor()
 
     try:
-        # Check if a reciprocal friend request exists
-        query_check_reciprocal = """
-        SELECT status FROM friendships 
-        WHERE requester_id = %s AND recipient_id = %s
-        """
-        cursor.execute(query_check_reciprocal, (recipient_id, requester_id))
-        reciprocal_result = cursor.fetchone()
-
-        if reciprocal_result:
-            reciprocal_status = reciprocal_result[0]
-            if reciprocal_status == "pending":
-                raise HTTPException(status_code=400, detail="This user has already sent you a friend request.")
-
-        # Check if a friend request already exists
-        query_check = """
-        SELECT status FROM friendships 
-        WHERE requester_id = %s AND recipient_id = %s
-        """
-        cursor.execute(query_check, (requester_id, recipient_id))
-        result = cursor.fetchone()
-
-        if result:
-            status = result[0]
-            if status == "pending":
-                raise HTTPException(status_code=400, detail="Friend request already sent.")
-            elif status == "accepted":
-                raise HTTPException(status_code=400, detail="You are already friends.")
-            elif status == "rejected":
-                # Update the status to pending
-                query_update = """
-                UPDATE friendships 
-                SET status = 'pending'
-                WHERE requester_id = %s AND recipient_id = %s
-                """
-                cursor.execute(query_update, (requester_id, recipient_id))
-                connection.commit()
-                return {"message": "Friend request sent successfully!"}
+        if existing:
+            # A rejected request: set it back to pending
+            friend_id = existing[0]
+            query_update = """
+            UPDATE friendships 
+            SET status = 'pending'
+            WHERE friend_id = %s
+            """
+            cursor.execute(query_update, (friend_id,))
         else:
             # Insert a new friend request
             query_insert = """
@@ -307,25 +596,50 @@ def send_friend_request(requester_id: int, recipient_id: int):
             VALUES (%s, %s, 'pending')
             """
             cursor.execute(query_insert, (requester_id, recipient_id))
-            connection.commit()
-            return {"message": "Friend request sent successfully!"}
-    
+            friend_id = cursor.lastrowid
+        connection.commit()
+        router.note_write(requester_id, recipient_id)
+
+        graph.apply(friend_id, requester_id, recipient_id, "pending")
+        return {"message": "Friend request sent successfully!"}
+
+    except mysql.connector.IntegrityError:
+        # Another worker created this request after our graph was loaded
+        connection.rollback()
+        graph.load()
+        raise HTTPException(status_code=400, detail="Friend request already sent.")
+
     except mysql.connector.Error as err:
         connection.rollback()
-        print("Database error:", err)
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=400, detail=f"Database error: {err}")
     
     finally:
         cursor.close()
         connection.close()
 
-def respond_friend_request(friendship_id: int, status: str):
+@instrument_db
+def respond_friend_request(friendship_id: int, status: str, user_id: int = None):
+    # user_id is the caller (from their session token); only the recipient may answer
+    if status not in ["accepted", "rejected"]:
+        raise HTTPException(status_code=400, detail="Invalid status.")
+
     connection = get_db_connection()
     cursor = connection.cursor()
 
     try:
-        if status not in ["accepted", "rejected"]:
-            raise HTTPException(status_code=400, detail="Invalid status.")
+        endpoints = friend_graph.endpoints(friendship_id)
+        if endpoints is None:
+            cursor.execute(
+                "SELECT requester_id, recipient_id FROM friendships WHERE friend_id = %s",
+                (friendship_id,)
+            )
+            endpoints = cursor.fetchone()
+        if user_id is not None:
+            if endpoints is None:
+                raise HTTPException(status_code=404, detail="Friend request not found.")
+            if int(endpoints[1]) != int(user_id):
+                raise HTTPException(status_code=403, detail="Only the recipient can respond to this friend request.")
 
         # Update the friendship status
         query_update = """
@@ -334,100 +648,159 @@ def respond_friend_request(friendship_id: int, status: str):
         WHERE friend_id = %s
         """
         cursor.execute(query_update, (status, friendship_id))
+        changed = cursor.rowcount
         connection.commit()
 
+        if changed and endpoints:
+            router.note_write(*endpoints)
+            friend_graph.apply(friendship_id, endpoints[0], endpoints[1], status)
+            # Both users' leaderboards gain or lose the other one
+            leaderboard_cache.change_friends(*endpoints)
+
         return {"message": f"Friend request {status} successfully!"}
     
     except mysql.connector.Error as err:
         connection.rollback()
-        print("Database error:", err)
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=400, detail=f"Database error: {err}")
     
     finally:
         cursor.close()
         connection.close()
 
+@instrument_db
 def list_friends(user_id: int):
-    connection = get_db_connection()
-    cursor = connection.cursor(dictionary=True)
+    friends = _fresh_friend_graph().friends_of(user_id)
 
     try:
-        # Fetch friends for the given user ID
-        query = """
-        SELECT users.user_id, users.username, friend_id
-        FROM friendships
-        JOIN users ON 
-            (users.user_id = friendships.requester_id AND friendships.recipient_id = %s) OR
-            (users.user_id = friendships.recipient_id AND friendships.requester_id = %s)
-        WHERE friendships.status = 'accepted'
-        """
-        
-        cursor.execute(query, (user_id, user_id))
-        friends = cursor.fetchall()
-
-        print (friends)
-        
-        return friends
-    
+        usernames = _usernames(list(friends))
     except mysql.connector.Error as err:
-        print("Database error:", err)
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=400, detail=f"Database error: {err}")
-    
-    finally:
-        cursor.close()
-        connection.close()
 
+    return [
+        {"user_id": friend_user_id, "username": usernames[friend_user_id], "friend_id": friend_id}
+        for friend_user_id, friend_id in friends.items()
+    ]
+
+@instrument_db
 def leaderboard_data(user_id: int):
+    # The board shows yesterday's steps, so it is cached per (user, day) and
+    # invalidated by update_steps / respond_friend_request.
+    # Not @read_only: a replica could still miss a friend's write whose generation
+    # bump is already visible, and the stale board would be cached under it.
+    day = (datetime.now() - timedelta(days=1)).date().isoformat()
+    if step_buffer.has_pending():
+        # A buffered late sync of yesterday's count invalidates the board when flushed
+        _flush_buffered_steps(list(_fresh_friend_graph().friends_of(user_id)) + [user_id])
+    cached = leaderboard_cache.get(user_id, day)
+    if cached is not None:
+        return [dict(entry) for entry in cached]
+
     connection = get_db_connection()
-    cursor = connection.cursor(dictionary=True)
+    cursor = connection.cursor()
 
     try:
-        # Fetch friends and their step count for the previous day
-        query = """
-        SELECT 
-            users.user_id, 
-            users.username, 
-            COALESCE(steps.daily_step_count, 0) AS step_count
-        FROM friendships
-        JOIN users 
-            ON (users.user_id = friendships.requester_id AND friendships.recipient_id = %s) 
-            OR (users.user_id = friendships.recipient_id AND friendships.requester_id = %s)
-        LEFT JOIN steps 
-            ON steps.user_id = users.user_id 
-            AND steps.date = CURDATE() - INTERVAL 1 DAY
-        WHERE friendships.status = 'accepted'
-
-        UNION ALL
+        # Members come from the table rather than this worker's friendship graph,
+        # which can lag a request accepted on another worker. The friendship
+        # version and generations are read before the queries, so no write can
+        # slip in between and be cached as current.
+        friends_version = leaderboard_cache.friends_version(user_id)
+        cursor.execute(
+            """
+            SELECT friend_id, recipient_id FROM friendships WHERE requester_id = %s AND status = 'accepted'
+            UNION ALL
+            SELECT friend_id, requester_id FROM friendships WHERE recipient_id = %s AND status = 'accepted'
+            """,
+            (user_id, user_id)
+        )
+        members = [friend for _, friend in sorted(cursor.fetchall())] + [user_id]
+        generations = leaderboard_cache.generations(members)
 
-        SELECT 
-            %s AS user_id, 
-            users.username, 
-            COALESCE(steps.daily_step_count, 0) AS step_count
-        FROM users
-        LEFT JOIN steps
-            ON steps.user_id = users.user_id 
-            AND steps.date = CURDATE() - INTERVAL 1 DAY
-        WHERE users.user_id = %s
+        # Primary key lookups of the previous day's steps for every member
+        query = f"""
+        SELECT user_id, daily_step_count
+        FROM steps
+        WHERE date = %s
+          AND user_id IN ({', '.join(['%s'] * len(members))})
         """
-        
-        cursor.execute(query, (user_id, user_id, user_id, user_id))
-        leaderboard = cursor.fetchall()
+        cursor.execute(query, [day] + members)
+        step_counts = dict(cursor.fetchall())
+        usernames = _usernames(members)
 
-        # Update the username for the current user
-        for entry in leaderboard:
-            if entry['user_id'] == user_id:
-                entry['username'] = 'You'
+        leaderboard = [
+            {
+                "user_id": member,
+                # Update the username for the current user
+                "username": 'You' if member == user_id else usernames[member],
+                "step_count": step_counts.get(member) or 0,
+            }
+            for member in members
+        ]
 
+        leaderboard_cache.put(user_id, day, [dict(entry) for entry in leaderboard], generations, friends_version)
         return leaderboard
     
     except mysql.connector.Error as err:
-        print("Database error:", err)
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=400, detail=f"Database error: {err}")
     
     finally:
         cursor.close()
         connection.close()
 
+def _global_entries(entries):
+    usernames = _usernames([user_id for _, user_id, _ in entries])
+    return [
+        {"position": position, "user_id": user_id, "username": usernames[user_id], "step_count": steps}
+        for position, user_id, steps in entries
+    ]
+
+@instrument_db
+def get_global_leaderboard(period: str = "weekly", limit: int = 10, offset: int = 0):
+    """Top of the global board for the current day / week / month or all time."""
+    try:
+        start, total, entries = global_leaderboard.top(period, limit, offset)
+        return {
+            "period": period,
+            "period_start": start,
+            "total_users": total,
+            "entries": _global_entries(entries),
+        }
+    except ValueError as err:
+        raise HTTPException(status_code=400, detail=str(err))
+    except mysql.connector.Error as err:
+        logger.error("Database error: %s", err)
+        raise HTTPException(status_code=400, detail=f"Database error: {err}")
+
+@instrument_db
+@reads_buffered_steps
+def get_global_rank(user_id: int, period: str = "weekly", neighbours: int = 5):
+    """The user's rank and percentile on a global board, with the users ranked around them."""
+    try:
+        start, total, rank, entries = global_leaderboard.around(period, user_id, neighbours)
+        return {
+            "period": period,
+            "period_start": start,
+            "total_users": total,
+            "user_id": user_id,
+            # All None when the user has no steps in the period
+            "rank": rank["rank"] if rank else None,
+            "step_count": rank["steps"] if rank else None,
+            "percentile": rank["percentile"] if rank else None,
+            "neighbours": _global_entries(entries),
+        }
+    except ValueError as err:
+        raise HTTPException(status_code=400, detail=str(err))
+    except mysql.connector.Error as err:
+        logger.error("Database error: %s", err)
+        raise HTTPException(status_code=400, detail=f"Database error: {err}")
+
+def get_global_leaderboard_stats():
+    return global_leaderboard.stats()
+
+@instrument_db
+@read_only
 def get_pending_friend_requests(user_id: int):
     connection = get_db_connection()
     cursor = connection.cursor(dictionary=True)
@@ -449,38 +822,36 @@ def get_pending_friend_requests(user_id: int):
         return pending_requests
 
     except mysql.connector.Error as err:
-        print("Database error:", err)
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=400, detail=f"Database error: {err}")
 
     finally:
         cursor.close()
         connection.close()
 
-def search_users_by_name(name: str):
-    connection = get_db_connection()
-    cursor = connection.cursor(dictionary=True)
+@instrument_db
+def search_users_by_name(name: str, user_id: int = None, limit: int = SEARCH_DEFAULT_LIMIT):
+    """
+    Ranked username search from the in-process index. When user_id is given,
+    that user and their existing friends are left out of the results.
+    """
+    exclude = set()
+    if user_id is not None:
+        exclude = set(_fresh_friend_graph().friends_of(user_id))
+        exclude.add(user_id)
 
     try:
-        # Query to search for users whose names match the search query
-        query = """
-        SELECT user_id, username
-        FROM users
-        WHERE username LIKE %s
-        """
-        
-        cursor.execute(query, (f"%{name}%",))  # Perform case-insensitive search using LIKE
-        users = cursor.fetchall()
-
-        return users
-    
+        user_search_index.ensure_fresh()
     except mysql.connector.Error as err:
-        print("Database error:", err)
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=400, detail=f"Database error: {err}")
-    
-    finally:
-        cursor.close()
-        connection.close()
 
+    return [
+        {"user_id": match_id, "username": username}
+        for match_id, username in user_search_index.search(name, limit, exclude)
+    ]
+
+@instrument_db
 def check_account(user_data: dict):
     connection = get_db_connection()
     cursor = connection.cursor(dictionary=True)
@@ -505,13 +876,16 @@ def check_account(user_data: dict):
         return {"message": "No account exists with the provided phone number or email."}
     
     except mysql.connector.Error as err:
-        print("Database error:", err)  # Debugging
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=400, detail=f"Database error: {err}")
     
     finally:
         cursor.close()
         connection.close()
 
+@instrument_db
+@reads_buffered_steps
+@read_only
 def get_user_monthly_steps(user_id: int):
     """
     Fetch all steps for a specific user_id grouped by date for the current month.
@@ -521,22 +895,24 @@ def get_user_monthly_steps(user_id: int):
 
     try:
         # Query to fetch steps for the current month grouped by date
+        first_day = rollups.month_start(datetime.now().date())
+        next_month = rollups.month_start(first_day + timedelta(days=31))
         query = """
         SELECT 
-            DATE(date) AS step_date, 
+            date AS step_date, 
             SUM(daily_step_count) AS total_steps
         FROM 
             steps
         WHERE 
             user_id = %s
-            AND MONTH(date) = MONTH(CURRENT_DATE())
-            AND YEAR(date) = YEAR(CURRENT_DATE())
+            AND date >= %s
+            AND date < %s
         GROUP BY 
-            DATE(date)
+            date
         ORDER BY 
-            step_date;
+            date;
         """
-        cursor.execute(query, (user_id,))
+        cursor.execute(query, (user_id, first_day, next_month))
         steps_data = cursor.fetchall()
 
         # Convert Decimal to int and format the step_date
@@ -551,67 +927,73 @@ def get_user_monthly_steps(user_id: int):
         return formatted_data
 
     except mysql.connector.Error as err:
-        print("Database error:", err)  # Debugging
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=400, detail=f"Database error: {err}")
     
     finally:
         cursor.close()
         connection.close()
 
+@instrument_db
+@reads_buffered_steps
+@read_only
 def get_longest_streak(user_id: int):
     """
-    Calculate the longest streak of steps greater than 1000 for a specific user_id.
+    Longest and current streak of days with more than 1000 steps for a specific user_id,
+    read from the streak state that update_steps maintains.
     """
-    connection = get_db_connection()  # Assuming this function is defined to get DB connection
+    connection = get_db_connection()
     cursor = connection.cursor(dictionary=True)  # Use dictionary cursor for easy result handling
 
     try:
-        # SQL query to calculate the longest streak of steps greater than 1000
         query = """
-        WITH streaks AS (
-            SELECT
-                date,
-                daily_step_count,
-                ROW_NUMBER() OVER (ORDER BY date) -
-                ROW_NUMBER() OVER (PARTITION BY (daily_step_count > 1000) ORDER BY date) AS streak_group
-            FROM steps
-            WHERE daily_step_count > 1000
-              AND user_id = %s
-        )
         SELECT
-            MAX(streak_length) AS longest_streak
-        FROM (
-            SELECT
-                streak_group,
-                COUNT(*) AS streak_length
-            FROM streaks
-            GROUP BY streak_group
-        ) AS streak_lengths;
+            (SELECT longest_streak FROM user_streaks WHERE user_id = %s) AS longest_streak,
+            latest.start_date,
+            latest.end_date
+        FROM (SELECT 1) AS one
+        LEFT JOIN (
+            SELECT start_date, end_date
+            FROM streak_runs
+            WHERE user_id = %s
+            ORDER BY end_date DESC
+            LIMIT 1
+        ) AS latest ON TRUE
         """
-        
-        cursor.execute(query, (user_id,))
+        cursor.execute(query, (user_id, user_id))
         result = cursor.fetchone()
 
-        # Return the longest streak or 0 if no result
-        return result["longest_streak"] if result["longest_streak"] is not None else 0
+        # The latest run is still the current streak if it reaches yesterday or today
+        current_streak = 0
+        yesterday = (datetime.now() - timedelta(days=1)).date()
+        if result["end_date"] is not None and result["end_date"] >= yesterday:
+            current_streak = (result["end_date"] - result["start_date"]).days + 1
+
+        return {
+            "longest_streak": result["longest_streak"] or 0,
+            "current_streak": current_streak,
+        }
 
     except mysql.connector.Error as err:
-        print("Database error:", err)  # Debugging
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=400, detail=f"Database error: {err}")
     
     finally:
         cursor.close()
         connection.close()
 
+@instrument_db
+@reads_buffered_steps
+@read_only
 def get_total_steps_for_user(user_id: int):
     connection = get_db_connection()
     cursor = connection.cursor()
 
     try:
-        # Query to select the total sum of steps for the specific user_id
+        # Lifetime total is maintained in step_totals by update_steps
         query = """
-        SELECT SUM(daily_step_count) AS total_steps
-        FROM steps
+        SELECT total_steps
+        FROM step_totals
         WHERE user_id = %s;
         """
         cursor.execute(query, (user_id,))
@@ -623,13 +1005,55 @@ def get_total_steps_for_user(user_id: int):
         return {"total_steps": result[0]}  # Access the value by index
 
     except mysql.connector.Error as err:
-        print("Database error:", err)  # Debugging
+        logger.error("Database error: %s", err)
+        raise HTTPException(status_code=400, detail=f"Database error: {err}")
+    
+    finally:
+        cursor.close()
+        connection.close()
+
+@instrument_db
+@reads_buffered_steps
+@read_only
+def get_step_rollups(user_id: int):
+    """
+    Current week, current month and lifetime step totals from the rollup tables.
+    """
+    connection = get_db_connection()
+    cursor = connection.cursor()
+
+    try:
+        today = datetime.now().date()
+        query = """
+        SELECT
+            (SELECT total_steps FROM step_rollups_weekly WHERE user_id = %s AND week_start = %s),
+            (SELECT total_steps FROM step_rollups_monthly WHERE user_id = %s AND month_start = %s),
+            (SELECT total_steps FROM step_totals WHERE user_id = %s)
+        """
+        cursor.execute(query, (
+            user_id, rollups.week_start(today),
+            user_id, rollups.month_start(today),
+            user_id
+        ))
+        week_total, month_total, lifetime_total = cursor.fetchone()
+
+        return {
+            "week_total": int(week_total or 0),
+            "month_total": int(month_total or 0),
+            "lifetime_total": int(lifetime_total or 0),
+        }
+
+    except mysql.connector.Error as err:
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=400, detail=f"Database error: {err}")
     
     finally:
         cursor.close()
         connection.close()
 
+@instrument_db
+@reads_buffered_steps
+@read_only
 def get_total_steps_previous_day(user_id: int):
     connection = get_db_connection()
     cursor = connection.cursor()
@@ -637,7 +1061,6 @@ def get_total_steps_previous_day(user_id: int):
     try:
         # Calculate the previous day's date
         previous_day = (datetime.now() - timedelta(days=1)).date()
-        print("Previous Day: ", previous_day)
 
         # Query to fetch the total_steps for the previous day
         query = """
@@ -648,8 +1071,6 @@ def get_total_steps_previous_day(user_id: int):
         cursor.execute(query, (user_id, previous_day))
         result = cursor.fetchone()  # Fetch the single result
 
-        print("Result: ", result)
-
         if result is None:
             raise HTTPException(status_code=404, detail="No step data found for the previous day")
         if result[0] is None:
@@ -658,19 +1079,19 @@ def get_total_steps_previous_day(user_id: int):
         return {"total_steps": result[0]}  # Return the value
 
     except mysql.connector.Error as err:
-        print("Database error:", err)  # Debugging
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=400, detail=f"Database error: {err}")
     
     finally:
         cursor.close()
         connection.close()
 
+@instrument_db
 def post_feedback_to_db(feedback):
     connection = get_db_connection()
     cursor = connection.cursor()
 
     try:
-        logging.info("[INSIDE UPDATE FEEDBACK DB FUNC] Updated step data: %s", feedback)  # Debugging
         # Insert into users table with diet included
         query = """
         INSERT INTO feedback (user_id, description)
@@ -684,66 +1105,100 @@ def post_feedback_to_db(feedback):
 
     except mysql.connector.Error as err:
         connection.rollback()
-        print("Database error:", err)  # Debugging
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=400, detail=f"Database error: {err}")
     
     finally:
         cursor.close()
         connection.close()
 
+@instrument_db
 def insert_transaction_data(transaction_data: dict):
     connection = get_db_connection()
     cursor = connection.cursor()
 
     try:
-        query = """
-            INSERT INTO transactions (
-                user_id, transaction_type, activity_type, amount
-            ) VALUES (%s, %s, %s, %s)
-        """
-        cursor.execute(query, (
+        # Appends the ledger row and moves users.credit_balance atomically
+        balance = ledger.post_transaction(
+            cursor,
             transaction_data['user_id'],
             transaction_data['transaction_type'],
             transaction_data['activity_type'],
             transaction_data['amount']
-        ))
+        )
 
         connection.commit()
+        router.note_write(transaction_data['user_id'])
+        return float(balance)
+
+    except HTTPException:
+        connection.rollback()
+        raise
 
     except mysql.connector.Error as err:
         connection.rollback()
-        print("Database error:", err)
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=400, detail=f"Database error: {err}")
 
     finally:
         cursor.close()
         connection.close()
 
-def fetch_transactions(user_id: int):
+@instrument_db
+@read_only
+def fetch_transactions(user_id: int, limit: int = DEFAULT_PAGE_SIZE, page_cursor: str = None):
+    """
+    One page of a user's transactions, newest first. Returns (transactions, next_cursor).
+    """
+    after = decode_cursor(page_cursor, (datetime, int))
     connection = get_db_connection()
     cursor = connection.cursor(dictionary=True)
 
     try:
+        # Keyset pagination on (created_at, transaction_id), both descending
         query = """
             SELECT transaction_id, transaction_type, activity_type, amount, created_at
             FROM transactions
             WHERE user_id = %s
-            ORDER BY created_at DESC
         """
-        cursor.execute(query, (user_id,))
+        params = [user_id]
+        if after:
+            query += """ AND (created_at < %s OR (created_at = %s AND transaction_id < %s))"""
+            params += [after[0], after[0], after[1]]
+        query += """ ORDER BY created_at DESC, transaction_id DESC LIMIT %s"""
+        params.append(limit + 1)
+
+        cursor.execute(query, params)
         transactions = cursor.fetchall()
 
-        print(transactions)  # Debugging output
-        return transactions
+        return paginate(transactions, limit, lambda row: (row['created_at'], row['transaction_id']))
 
     except mysql.connector.Error as err:
-        print("Database error:", err)
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=400, detail=f"Database error: {err}")
 
     finally:
         cursor.close()
         connection.close()
 
+@instrument_db
+@reads_buffered_steps
+@read_only
+def get_data_versions(user_id: int):
+    """{"steps": n, "balance": n} for the user; see data_versions."""
+    connection = get_db_connection()
+    cursor = connection.cursor()
+    try:
+        return data_versions.read(cursor, user_id)
+    except mysql.connector.Error as err:
+        logger.error("Database error: %s", err)
+        raise HTTPException(status_code=400, detail=f"Database error: {err}")
+    finally:
+        cursor.close()
+        connection.close()
+
+@instrument_db
+@read_only
 def get_user_credit_balance(user_id: int):
     connection = get_db_connection()
     cursor = connection.cursor(dictionary=True)  # So we get column names in result
@@ -764,7 +1219,7 @@ def get_user_credit_balance(user_id: int):
         return float(user['credit_balance'])
 
     except mysql.connector.Error as err:
-        print("Database error:", err)
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=400, detail=f"Database error: {err}")
 
     finally:
@@ -772,7 +1227,43 @@ def get_user_credit_balance(user_id: int):
         connection.close()
 
 # Admin functionalities
-def get_all_users():
+# Home screen parts served by get_dashboard, keyed by their field name in the payload
+DASHBOARD_PARTS = {
+    "weekly_steps": get_weekly_statistics,
+    "monthly_steps": get_user_monthly_steps,
+    "total_steps": get_total_steps_for_user,
+    "streaks": get_longest_streak,
+    "sensor_steps": get_total_steps_previous_day,
+    "balance": get_user_credit_balance,
+}
+
+@instrument_db
+@reads_buffered_steps
+@read_only
+def get_dashboard(user_id: int, fields=None):
+    """
+    The selected home screen parts (all by default) read on a single
+    connection. A part with no data yet (404) is returned as None instead of
+    failing the whole payload.
+    """
+    dashboard = {}
+    with shared_connection():
+        for field in fields or DASHBOARD_PARTS:
+            try:
+                dashboard[field] = DASHBOARD_PARTS[field](user_id)
+            except HTTPException as err:
+                if err.status_code != 404:
+                    raise
+                dashboard[field] = None
+    return dashboard
+
+@instrument_db
+@read_only
+def get_all_users(limit: int = DEFAULT_PAGE_SIZE, page_cursor: str = None):
+    """
+    One page of users ordered by user_id. Returns (users, next_cursor).
+    """
+    after = decode_cursor(page_cursor, (int,))
     connection = get_db_connection()
     cursor = connection.cursor(dictionary=True)
 
@@ -790,55 +1281,100 @@ def get_all_users():
                 blood_group,
                 credit_balance
             FROM users
+            WHERE user_id > %s
+            ORDER BY user_id
+            LIMIT %s
             """
-        cursor.execute(query)
+        cursor.execute(query, (after[0] if after else 0, limit + 1))
         users = cursor.fetchall()
-        print(users)
-        return users
+        return paginate(users, limit, lambda row: (row['user_id'],))
     except mysql.connector.Error as err:
-        print("Database error:", err)
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=400, detail=f"Database error: {err}")
     finally:
         cursor.close()
         connection.close()
 
-def search_users(query: str = Query(..., min_length=1)):
+# Columns returned by the admin user listing and export
+ADMIN_USER_COLUMNS = [
+    "user_id", "username", "phone_number", "email", "DOB",
+    "height", "weight", "gender", "blood_group", "credit_balance",
+]
+
+def iter_all_users(chunk_size: int = 1000):
+    """
+    Yield every user as lists of at most chunk_size rows. Uses an unbuffered
+    cursor, so rows are read from the server as they are consumed and memory
+    stays flat however large the table is. The connection is held until the
+    generator is exhausted or closed.
+    """
+    connection = get_db_connection()
+    cursor = connection.cursor(dictionary=True, buffered=False)
+
+    try:
+        cursor.execute(f"SELECT {', '.join(ADMIN_USER_COLUMNS)} FROM users ORDER BY user_id")
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    except mysql.connector.Error as err:
+        logger.error("Database error: %s", err)
+        raise HTTPException(status_code=400, detail=f"Database error: {err}")
+    finally:
+        try:
+            cursor.close()
+        except mysql.connector.Error:
+            pass  # rows left unread after an early close; the pool discards the connection
+        connection.close()
+
+@instrument_db
+@read_only
+def search_users(query: str, limit: int = 50):
+    """
+    Admin search: ranked matches from the username index, with full user rows.
+    """
+    try:
+        user_search_index.ensure_fresh()
+    except mysql.connector.Error as err:
+        logger.error("Database error: %s", err)
+        raise HTTPException(status_code=500, detail=f"Database error: {err}")
+
+    matches = [match_id for match_id, _ in user_search_index.search(query, limit)]
+    if not matches:
+        return []
+
     connection = get_db_connection()
     cursor = connection.cursor(dictionary=True)
 
     try:
-        sql_query = """
-            SELECT 
-                user_id,
-                username,
-                phone_number,
-                email,
-                DOB,
-                height,
-                weight,
-                gender,
-                blood_group,
-                credit_balance
+        sql_query = f"""
+            SELECT {', '.join(ADMIN_USER_COLUMNS)}
             FROM users
-            WHERE username LIKE %s
+            WHERE user_id IN ({', '.join(['%s'] * len(matches))})
         """
-        like_pattern = f"%{query}%"
-        cursor.execute(sql_query, (like_pattern,))
-        users = cursor.fetchall()
-        print(users)  # Debugging output
-        return users
+        cursor.execute(sql_query, matches)
+        users = {user['user_id']: user for user in cursor.fetchall()}
+        return [users[match_id] for match_id in matches if match_id in users]
 
     except mysql.connector.Error as err:
-        print("Database error:", err)
+        logger.error("Database error: %s", err)
         raise HTTPException(status_code=500, detail=f"Database error: {err}")
 
     finally:
         cursor.close()
         connection.close()
 
-def generate_qr(Name, amount, filename):
+# Rendered voucher PNGs kept in memory, keyed by (name, amount)
+QR_CACHE_SIZE = 1024
+
+@lru_cache(maxsize=QR_CACHE_SIZE, typed=True)
+def render_qr(Name, amount):
+    """
+    Render the redeem voucher QR code for (Name, amount) and return the PNG bytes.
+    """
     # Validate inputs (optional)
-    if not isinstance(amount, (int, float)):
+    if not isinstance(amount, (int, float)) or isinstance(amount, bool):
         raise ValueError("Amount must be a number")
 
     # Create a dictionary of data
@@ -852,7 +1388,8 @@ def generate_qr(Name, amount, filename):
     # Convert dictionary to JSON string
     json_string = json.dumps(qr_data)
 
-    # Generate QR code
+    # Generate QR code; qrcode pulls in PIL, so it is only imported by this admin path
+    import qrcode
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_M,
@@ -863,5 +1400,70 @@ def generate_qr(Name, amount, filename):
     qr.make(fit=True)
 
     img = qr.make_image(fill_color="black", back_color="white")
-    img.save(filename)
-    print(f"QR code saved as {filename}")
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def prewarm_qr():
+    import qrcode  # noqa: F401
+
+def generate_qr(Name, amount, filename=None):
+    png = render_qr(Name, amount)
+    if filename:
+        with open(filename, "wb") as f:
+            f.write(png)
+    return png
+
+def get_qr_cache_stats():
+    info = render_qr.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize}
+
+class _ZipChunks(io.RawIOBase):
+    # Unseekable sink for zipfile: collects what was written since the last drain
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def check_voucher(name, amount):
+    """Raise ValueError unless render_qr can take (name, amount); names must be hashable scalars."""
+    if not isinstance(name, (str, int, float)) or isinstance(name, bool) or name == "":
+        raise ValueError("'name' must be a non-empty string or number.")
+    if not isinstance(amount, (int, float)) or isinstance(amount, bool):
+        raise ValueError("'amount' must be a number.")
+
+def voucher_filename(name, count=0):
+    """File name of a voucher PNG: unsafe characters replaced, "_<count>" for repeated names."""
+    base = re.sub(r"[^A-Za-z0-9_.-]+", "_", str(name)) or "voucher"
+    return f"{base}.png" if not count else f"{base}_{count}.png"
+
+def iter_qr_zip(vouchers: list):
+    """
+    Yield a ZIP archive with one PNG per (name, amount) voucher, piece by piece
+    as each image is rendered. Check the vouchers with check_voucher first: an
+    error here ends the response halfway through the archive.
+    """
+    sink = _ZipChunks()
+    used_names = set()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        for name, amount in vouchers:
+            # Count up until the name is free: "a", "a", "a_1" must not emit a_1.png twice
+            count = 0
+            while voucher_filename(name, count) in used_names:
+                count += 1
+            filename = voucher_filename(name, count)
+            used_names.add(filename)
+
+            archive.writestr(filename, render_qr(name, amount))
+            yield sink.drain()
+    yield sink.drain()
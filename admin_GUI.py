@@ -1,8 +1,12 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
+import json
+import os
 import requests
 
 API_BASE_URL = "http://172.16.0.60:8002"  # Change if your FastAPI server runs elsewhere
+# Same value as the server's ADMIN_API_KEY; the admin endpoints need it once that is set
+ADMIN_HEADERS = {"X-Admin-Key": os.getenv("ADMIN_API_KEY")} if os.getenv("ADMIN_API_KEY") else {}
 
 class AdminDashboard(tk.Tk):
     def __init__(self):
@@ -27,11 +31,25 @@ class AdminDashboard(tk.Tk):
         for widget in self.container.winfo_children():
             widget.destroy()
 
+    def get_pages(self, path, params=None):
+        # Follow the X-Next-Cursor header until the last page
+        params = dict(params or {}, limit=200)
+        rows = []
+        while True:
+            res = requests.get(f"{API_BASE_URL}{path}", params=params, headers=ADMIN_HEADERS)
+            res.raise_for_status()
+            rows.extend(res.json())
+            next_cursor = res.headers.get("X-Next-Cursor")
+            if not next_cursor:
+                return rows
+            params["cursor"] = next_cursor
+
     def get_all_users(self):
         try:
-            res = requests.get(f"{API_BASE_URL}/admin/get-users")
-            res.raise_for_status()
-            self.full_user_list = res.json()
+            # NDJSON stream: one user per line, parsed as it arrives
+            with requests.get(f"{API_BASE_URL}/admin/export-users", params={"format": "ndjson"}, headers=ADMIN_HEADERS, stream=True) as res:
+                res.raise_for_status()
+                self.full_user_list = [json.loads(line) for line in res.iter_lines() if line]
             return self.full_user_list
         except Exception as e:
             messagebox.showerror("Error", f"Failed to fetch users: {e}")
@@ -45,16 +63,14 @@ class AdminDashboard(tk.Tk):
 
     def get_transactions(self, user_id):
         try:
-            res = requests.get(f"{API_BASE_URL}/get-transaction", params={"id": user_id})
-            res.raise_for_status()
-            return res.json()
+            return self.get_pages("/get-transaction", {"id": user_id})
         except Exception as e:
             messagebox.showerror("Error", f"Failed to fetch transactions: {e}")
             return []
 
     def generate_qr(self, name, amount, filename):
         try:
-            res = requests.post(f"{API_BASE_URL}/generate-qr", json={"name": name, "amount": amount}, stream=True)
+            res = requests.post(f"{API_BASE_URL}/generate-qr", json={"name": name, "amount": amount}, headers=ADMIN_HEADERS, stream=True)
             res.raise_for_status()
             with open(filename, "wb") as f:
                 f.write(res.content)
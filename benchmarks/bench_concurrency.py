@@ -0,0 +1,119 @@
+"""
+Concurrency scaling benchmark for the DB execution model.
+
+Boots a small FastAPI app in-process with two endpoints that run the same
+blocking "query" (a sleep standing in for MySQL latency):
+
+    /inline    - the old pattern, a blocking call inside an async handler
+    /executor  - the current pattern, awaited through db_executor.run_db
+
+and drives each with N simultaneous clients. With the inline handler the
+throughput stays flat as N grows; with the executor it scales until the
+executor runs out of workers.
+
+    python benchmarks/bench_concurrency.py --clients 1 2 4 8 16 32
+
+To measure a real endpoint on a running server instead:
+
+    python benchmarks/bench_concurrency.py --url "http://localhost:8000/get-leaderboard?id=1"
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import uvicorn
+from fastapi import FastAPI
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from db_executor import run_db  # noqa: E402
+
+
+def build_app(query_latency):
+    app = FastAPI()
+
+    def fake_query():
+        time.sleep(query_latency)
+        return {"ok": True}
+
+    @app.get("/inline")
+    async def inline():
+        return fake_query()
+
+    @app.get("/executor")
+    async def executor():
+        return await run_db(fake_query)
+
+    return app
+
+
+def start_server(app, port):
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+def drive(url, clients, requests_per_client):
+    def client():
+        latencies = []
+        with requests.Session() as session:
+            for _ in range(requests_per_client):
+                started = time.perf_counter()
+                session.get(url).raise_for_status()
+                latencies.append(time.perf_counter() - started)
+        return latencies
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(lambda _: client(), range(clients)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(l for r in results for l in r)
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--requests", type=int, default=20, help="requests per client")
+    parser.add_argument("--latency", type=float, default=0.02, help="simulated query latency in seconds")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--url", help="benchmark this URL on a running server instead")
+    args = parser.parse_args()
+
+    results = {}
+    if args.url:
+        targets = {"url": args.url}
+    else:
+        start_server(build_app(args.latency), args.port)
+        base = f"http://127.0.0.1:{args.port}"
+        targets = {"inline": f"{base}/inline", "executor": f"{base}/executor"}
+
+    for name, url in targets.items():
+        results[name] = []
+        for clients in args.clients:
+            row = drive(url, clients, args.requests)
+            results[name].append(row)
+            print(f"{name:>9}  clients={clients:<4} rps={row['rps']:<8} p50={row['p50_ms']}ms p95={row['p95_ms']}ms")
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""
+End-to-end load benchmark for the main.py endpoints.
+
+Seeds a scratch MySQL database (DB_NAME, default fitness_bench) with synthetic
+users, boots main.app in-process with uvicorn and drives it with a weighted
+mix of requests from N client threads:
+
+    step_sync      - phones pushing step counts, plus the weekly chart
+    dashboard      - the home screen reads
+    dashboard_combined - the home screen as one /dashboard call
+    friend_search  - user search, friend lists and pending requests
+    login_burst    - everyone logging in at once (bcrypt bound)
+    mixed          - all of the above
+
+Per route it reports count, errors, requests per second and p50/p95/p99
+latency, and writes everything to a JSON file so runs can be compared
+between commits:
+
+    python benchmarks/load_test.py --scenario dashboard --clients 16 --duration 30
+    python benchmarks/load_test.py --scenario mixed --output results/before.json
+
+With DB_BACKEND=memory (or sqlite) no MySQL server is needed, which also
+shows how much of the latency is Python-side overhead rather than the database.
+
+To drive an already running server (seeded by an earlier run with the same
+DB_NAME) pass --url http://localhost:8000 --no-seed.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("DB_NAME", "fitness_bench")
+
+from bench_concurrency import start_server  # noqa: E402
+
+
+def _user(ctx):
+    return random.choice(ctx["user_ids"])
+
+
+def _today():
+    return date.today().isoformat()
+
+
+# Each request factory returns (method, route label, path, json body or None)
+def step_update(ctx):
+    body = {"user_id": _user(ctx), "date": _today(), "steps": random.randint(0, 20000),
+            "midnight_step_count": random.randint(0, 20000)}
+    return "POST", "/update-steps", "/update-steps", body
+
+
+def step_batch(ctx):
+    user_id = _user(ctx)
+    records = [
+        {"user_id": user_id, "date": (date.today() - timedelta(days=d)).isoformat(),
+         "steps": random.randint(0, 20000), "midnight_step_count": 0}
+        for d in range(7)
+    ]
+    return "POST", "/update-steps/batch", "/update-steps/batch", {"records": records}
+
+
+def get(route):
+    def request(ctx):
+        return "GET", route, f"{route}?id={_user(ctx)}", None
+    return request
+
+
+def user_search(ctx):
+    name = f"user{random.randint(0, len(ctx['user_ids']) - 1)}"[:random.randint(3, 6)]
+    return "GET", "/users/search/", f"/users/search/?name={name}&id={_user(ctx)}", None
+
+
+def login(ctx):
+    index = random.randint(0, len(ctx["user_ids"]) - 1)
+    body = {"phone_number": ctx["phone_number"](index), "password": ctx["password"]}
+    return "POST", "/login", "/login", body
+
+
+def store_activity(ctx):
+    body = {"activity": "walk", "duration": 30, "user_id": _user(ctx),
+            "activity_date": datetime.now().isoformat(timespec="seconds")}
+    return "POST", "/store-activity", "/store-activity", body
+
+
+DASHBOARD = [
+    (3, get("/weekly-steps")),
+    (2, get("/monthly-steps")),
+    (2, get("/get-total-steps")),
+    (2, get("/get-streaks")),
+    (1, get("/get-total-sensor-steps")),
+    (2, get("/get-balance")),
+    (1, get("/get-leaderboard")),
+    (1, get("/fetch-activities")),
+    (1, get("/get-transaction")),
+]
+
+SCENARIOS = {
+    "step_sync": [(14, step_update), (2, step_batch), (3, get("/weekly-steps")), (1, store_activity)],
+    "dashboard": DASHBOARD,
+    "friend_search": [(5, user_search), (3, get("/get-friends")), (2, get("/get-pending-requests")),
+                      (1, get("/get-leaderboard"))],
+    "login_burst": [(1, login)],
+    # The same home screen as one /dashboard call
+    "dashboard_combined": [(1, get("/dashboard"))],
+}
+SCENARIOS["mixed"] = (
+    [(weight * 4, factory) for weight, factory in SCENARIOS["step_sync"]]
+    + [(weight * 2, factory) for weight, factory in DASHBOARD]
+    + SCENARIOS["friend_search"]
+    + [(2, login)]
+)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(base_url, mix, ctx, clients, duration, warmup):
+    weights = [weight for weight, _ in mix]
+    factories = [factory for _, factory in mix]
+    samples = defaultdict(list)   # route -> [(latency, ok)]
+    lock = threading.Lock()
+    measure_from = time.perf_counter() + warmup
+    stop_at = measure_from + duration
+
+    def client(seed):
+        rng = random.Random(seed)
+        local = defaultdict(list)
+        with requests.Session() as session:
+            while True:
+                now = time.perf_counter()
+                if now >= stop_at:
+                    break
+                factory = rng.choices(factories, weights)[0]
+                method, route, path, body = factory(ctx)
+                started = time.perf_counter()
+                try:
+                    ok = session.request(method, base_url + path, json=body, timeout=30).status_code < 400
+                except requests.RequestException:
+                    ok = False
+                if started >= measure_from:
+                    local[f"{method} {route}"].append((time.perf_counter() - started, ok))
+        with lock:
+            for route, values in local.items():
+                samples[route].extend(values)
+
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(client, range(clients)))
+
+    return summarize(samples, duration)
+
+
+def summarize(samples, duration):
+    def row(values):
+        latencies = sorted(latency for latency, _ in values)
+        return {
+            "requests": len(values),
+            "errors": sum(1 for _, ok in values if not ok),
+            "rps": round(len(values) / duration, 1),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        }
+
+    routes = {route: row(values) for route, values in sorted(samples.items()) if values}
+    everything = [value for values in samples.values() for value in values]
+    return {"total": row(everything) if everything else None, "routes": routes}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(name, result):
+    print(f"\n{name}")
+    print(f"  {'route':<34}{'reqs':>7}{'err':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    rows = list(result["routes"].items()) + ([("TOTAL", result["total"])] if result["total"] else [])
+    for route, row in rows:
+        print(f"  {route:<34}{row['requests']:>7}{row['errors']:>6}{row['rps']:>9}"
+              f"{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", nargs="+", choices=sorted(SCENARIOS), default=["mixed"])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=3, help="unmeasured seconds before each scenario")
+    parser.add_argument("--users", type=int, default=2000, help="synthetic users to seed")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--url", help="benchmark a running server instead of booting main.app")
+    parser.add_argument("--no-seed", action="store_true", help="skip migrations and seeding")
+    parser.add_argument("--output", help="JSON results file (default benchmarks/results/load-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    from seed_data import SEED_PASSWORD, create_database, seed, seed_phone_number
+
+    if args.no_seed:
+        import db_pool
+        connection = db_pool.pool.connect()
+        cursor = connection.cursor()
+        cursor.execute("SELECT MIN(user_id) FROM users")
+        first = cursor.fetchone()[0]
+        cursor.close()
+        connection.close()
+        user_ids = list(range(first, first + args.users))
+    else:
+        import migrations
+        create_database()
+        migrations.upgrade()
+        user_ids = seed(args.users)
+
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        import main as app_module
+        start_server(app_module.app, args.port)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    ctx = {"user_ids": user_ids, "phone_number": seed_phone_number, "password": SEED_PASSWORD}
+    results = {
+        "commit": git_commit(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "clients": args.clients,
+        "duration": args.duration,
+        "users": args.users,
+        "scenarios": {},
+    }
+    for name in args.scenario:
+        result = run_scenario(base_url, SCENARIOS[name], ctx, args.clients, args.duration, args.warmup)
+        results["scenarios"][name] = result
+        print_report(name, result)
+
+    output = args.output or os.path.join(
+        os.path.dirname(__file__), "results",
+        f"load-{results['commit'] or 'unknown'}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
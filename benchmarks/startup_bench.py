@@ -0,0 +1,178 @@
+"""
+Cold start benchmark for main.py.
+
+Import time: runs `python -X importtime -c "import main"` in fresh interpreters
+and reports, per module, the median self and cumulative import time. This
+covers the app's own modules and the heaviest third-party packages.
+
+Time to first response: boots `uvicorn main:app` in a subprocess, once per
+STARTUP_PREWARM setting, and measures:
+    boot       - process start until the first answered request
+    per route  - the first (cold) request to each route vs. the second one,
+                 which shows what is still loaded lazily on first use
+
+    python benchmarks/startup_bench.py
+    python benchmarks/startup_bench.py --prewarm "" "search_index,friend_graph,pool,hashing,qr"
+
+The server gets the current environment. DB_NAME defaults to fitness_bench
+as in load_test.py, so run that first to seed it. With DB_BACKEND=memory no
+database is needed, but every route answers from an empty database.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from load_test import git_commit  # noqa: E402
+from seed_data import SEED_PASSWORD, seed_phone_number  # noqa: E402
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+# (method, path, json body) requested in order once the server answers
+ROUTES = [
+    ("GET", "/weekly-steps?id=1", None),
+    ("GET", "/dashboard?id=1", None),
+    ("GET", "/users/search/?name=user&id=1", None),
+    ("GET", "/get-leaderboard?id=1", None),
+    ("POST", "/login", {"phone_number": seed_phone_number(0), "password": SEED_PASSWORD}),
+    ("POST", "/generate-qr", {"name": "startup", "amount": 5}),
+]
+
+
+def first_party_modules():
+    return {name[:-3] for name in os.listdir(ROOT) if name.endswith(".py")}
+
+
+def import_times(module, runs):
+    """{module: {self_ms, cumulative_ms, depth}}, medians over `runs` fresh interpreters."""
+    samples = {}
+    for _ in range(runs):
+        stderr = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stderr
+        for line in stderr.splitlines():
+            match = IMPORT_LINE.match(line)
+            if match:
+                own, cumulative, indent, name = match.groups()
+                entry = samples.setdefault(name, {"self": [], "cumulative": [], "depth": len(indent) // 2})
+                entry["self"].append(int(own) / 1000)
+                entry["cumulative"].append(int(cumulative) / 1000)
+    return {
+        name: {
+            "self_ms": round(statistics.median(entry["self"]), 2),
+            "cumulative_ms": round(statistics.median(entry["cumulative"]), 2),
+            "depth": entry["depth"],
+        }
+        for name, entry in samples.items()
+    }
+
+
+def time_to_first_response(port, prewarm, timeout):
+    env = dict(os.environ, STARTUP_PREWARM=prewarm)
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with code {server.returncode} during startup")
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError(f"No response within {timeout}s")
+            try:
+                requests.get(base_url + "/test", timeout=1)
+                break
+            except requests.RequestException:
+                time.sleep(0.01)
+        result = {"prewarm": prewarm, "boot_ms": round((time.perf_counter() - started) * 1000, 1), "routes": {}}
+
+        with requests.Session() as session:
+            if os.getenv("ADMIN_API_KEY"):
+                # For /generate-qr
+                session.headers["X-Admin-Key"] = os.getenv("ADMIN_API_KEY")
+            for method, path, body in ROUTES:
+                timings = []
+                for _ in range(2):
+                    request_started = time.perf_counter()
+                    status = session.request(method, base_url + path, json=body, timeout=60).status_code
+                    timings.append(round((time.perf_counter() - request_started) * 1000, 1))
+                result["routes"][f"{method} {path.split('?')[0]}"] = {
+                    "status": status, "first_ms": timings[0], "second_ms": timings[1],
+                }
+        return result
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def print_report(imports, modules, top, ttfr):
+    main_ms = imports.get("main", {}).get("cumulative_ms")
+    print(f"\nimport main: {main_ms} ms")
+    print(f"  {'module':<40}{'self':>10}{'cumul.':>10}")
+    own = sorted((name for name in imports if name in modules), key=lambda n: -imports[n]["cumulative_ms"])
+    for name in own:
+        print(f"  {name:<40}{imports[name]['self_ms']:>10}{imports[name]['cumulative_ms']:>10}")
+    third_party = sorted(
+        (name for name, entry in imports.items()
+         if "." not in name and name not in modules and not name.startswith("_")),
+        key=lambda n: -imports[n]["cumulative_ms"],
+    )[:top]
+    print("\n  heaviest third-party / stdlib packages")
+    for name in third_party:
+        print(f"  {name:<40}{imports[name]['self_ms']:>10}{imports[name]['cumulative_ms']:>10}")
+
+    for result in ttfr:
+        print(f"\nSTARTUP_PREWARM={result['prewarm']!r}: first response after {result['boot_ms']} ms")
+        print(f"  {'route':<34}{'status':>8}{'first':>10}{'second':>10}")
+        for route, row in result["routes"].items():
+            print(f"  {route:<34}{row['status']:>8}{row['first_ms']:>10}{row['second_ms']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per import measurement")
+    parser.add_argument("--top", type=int, default=10, help="third-party packages to list")
+    parser.add_argument("--prewarm", nargs="*", default=["", "search_index,friend_graph"],
+                        help="STARTUP_PREWARM values to boot the server with")
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for the first response")
+    parser.add_argument("--output", help="JSON results file (default benchmarks/results/startup-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    modules = first_party_modules()
+    imports = import_times("main", args.runs)
+    ttfr = [time_to_first_response(args.port, prewarm, args.timeout) for prewarm in args.prewarm]
+    print_report(imports, modules, args.top, ttfr)
+
+    results = {
+        "commit": git_commit(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "import_main_ms": imports.get("main", {}).get("cumulative_ms"),
+        "imports": {name: entry for name, entry in imports.items() if name in modules or entry["depth"] <= 1},
+        "time_to_first_response": ttfr,
+    }
+    output = args.output or os.path.join(
+        os.path.dirname(__file__), "results",
+        f"startup-{results['commit'] or 'unknown'}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
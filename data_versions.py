@@ -0,0 +1,59 @@
+"""
+Per-user data version counters for conditional GETs.
+
+user_data_versions holds one row per user with a counter per kind of data:
+steps_version moves with every steps write (and so with the weekly, monthly,
+total and streak numbers derived from it), balance_version with every
+credit balance change. Writers bump the counter in the same transaction as
+the change, so a version read is always consistent with the data, on every
+worker. main.py turns the versions into ETags.
+"""
+VERSION_KINDS = ("steps", "balance")
+
+VERSION_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS user_data_versions (
+        user_id INT NOT NULL PRIMARY KEY,
+        steps_version BIGINT NOT NULL DEFAULT 0,
+        balance_version BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+]
+
+
+def bump(cursor, kind, user_ids):
+    """Increment the `kind` version of every user in user_ids, in the caller's transaction."""
+    if kind not in VERSION_KINDS:
+        raise ValueError(f"Unknown version kind {kind!r}")
+    user_ids = sorted(set(user_ids))  # fixed order, so concurrent bumps lock rows the same way
+    if not user_ids:
+        return
+    column = f"{kind}_version"
+    cursor.execute(f"""
+        INSERT INTO user_data_versions (user_id, {column})
+        VALUES {", ".join(["(%s, 1)"] * len(user_ids))}
+        ON DUPLICATE KEY UPDATE {column} = {column} + 1
+    """, user_ids)
+
+
+def bump_all(cursor, kind, user_id=None):
+    """Increment the `kind` version of one user, or of everyone (after a bulk rebuild)."""
+    if kind not in VERSION_KINDS:
+        raise ValueError(f"Unknown version kind {kind!r}")
+    if user_id is not None:
+        bump(cursor, kind, [user_id])
+        return
+    column = f"{kind}_version"
+    # Users without a row are still on version 0, which their clients may hold an ETag for
+    cursor.execute("INSERT IGNORE INTO user_data_versions (user_id) SELECT user_id FROM users")
+    cursor.execute(f"UPDATE user_data_versions SET {column} = {column} + 1")
+
+
+def read(cursor, user_id):
+    """{kind: version} for a user; 0 for users that never had a write recorded."""
+    cursor.execute(
+        "SELECT steps_version, balance_version FROM user_data_versions WHERE user_id = %s",
+        (user_id,)
+    )
+    row = cursor.fetchone()
+    return dict(zip(VERSION_KINDS, row if row else (0, 0)))
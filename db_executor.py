@@ -0,0 +1,25 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from db_pool import pool
+
+
+# One worker per connection the pool can hand out, so threads never queue on checkout
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", str(pool.pool_size + pool.max_overflow)))
+
+executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    Run a blocking DB_Interface function on the DB executor and await it, so a
+    slow query only ties up a worker thread instead of the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+def shutdown_executor():
+    executor.shutdown(wait=True)
@@ -0,0 +1,238 @@
+import os
+import queue
+import threading
+import time
+
+import mysql.connector
+from mysql.connector.errors import PoolError
+
+
+# Pool configuration, overridable through the environment
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "username": os.getenv("DB_USER", "root"),
+    "password": os.getenv("DB_PASSWORD", "Akash003!"),
+    "database": os.getenv("DB_NAME", "fitness"),
+}
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+POOL_RECYCLE = float(os.getenv("DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+# mysql, or sqlite / memory for local runs without a server (see sqlite_backend)
+DB_BACKEND = os.getenv("DB_BACKEND", "mysql")
+# Read replicas as "host[:port],host[:port]"; same credentials and database as the primary
+DB_REPLICA_HOSTS = [host.strip() for host in os.getenv("DB_REPLICA_HOSTS", "").split(",") if host.strip()]
+REPLICA_POOL_SIZE = int(os.getenv("DB_REPLICA_POOL_SIZE", str(POOL_SIZE)))
+
+
+class PoolTimeout(PoolError):
+    """Raised when no connection could be checked out within the timeout."""
+
+
+class PooledConnection:
+    """
+    Thin proxy around a mysql.connector connection. Everything is forwarded to
+    the real connection except close(), which hands it back to the pool.
+    """
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._returned = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        if self._returned:
+            return
+        self._returned = True
+        self._pool._release(self._raw, self._created_at)
+
+    def __del__(self):
+        # Safety net for code paths that forget to close
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """
+    Bounded MySQL connection pool.
+
+    Keeps up to `pool_size` idle connections around and allows `max_overflow`
+    extra connections during peaks; those are closed instead of being returned.
+    Checkouts wait up to `timeout` seconds for a free slot. Connections older
+    than `recycle` seconds are replaced, and with `pre_ping` every idle
+    connection is pinged before it is handed out.
+    """
+
+    dialect = "mysql"
+
+    def __init__(self, db_config, pool_size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW,
+                 timeout=POOL_TIMEOUT, recycle=POOL_RECYCLE, pre_ping=POOL_PRE_PING):
+        self.db_config = db_config
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(pool_size + max_overflow)
+        self._open = 0
+        self._stats = {
+            "checkouts": 0,
+            "checkout_timeouts": 0,
+            "connections_created": 0,
+            "connections_recycled": 0,
+            "connections_discarded": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+        }
+
+    def _connect(self):
+        raw = mysql.connector.connect(**self.db_config)
+        with self._lock:
+            self._open += 1
+            self._stats["connections_created"] += 1
+        return raw, time.monotonic()
+
+    def _discard(self, raw, stat="connections_discarded"):
+        try:
+            raw.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._open -= 1
+            self._stats[stat] += 1
+
+    def connect(self):
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats["checkout_timeouts"] += 1
+            raise PoolTimeout(f"Timed out after {self.timeout}s waiting for a database connection")
+
+        try:
+            raw, created_at = self._checkout_idle()
+            if raw is None:
+                raw, created_at = self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+        waited = time.monotonic() - started
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["total_wait_seconds"] += waited
+            self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], waited)
+        return PooledConnection(self, raw, created_at)
+
+    def _checkout_idle(self):
+        # Returns (None, None) when there is no usable idle connection
+        while True:
+            try:
+                raw, created_at = self._idle.get_nowait()
+            except queue.Empty:
+                return None, None
+
+            if self.recycle and time.monotonic() - created_at > self.recycle:
+                self._discard(raw, "connections_recycled")
+                continue
+
+            if self.pre_ping:
+                try:
+                    raw.ping(reconnect=False)
+                except mysql.connector.Error:
+                    self._discard(raw, "connections_recycled")
+                    continue
+
+            return raw, created_at
+
+    def _release(self, raw, created_at):
+        try:
+            # Never hand out a connection with a half-finished transaction or unread rows
+            if raw.unread_result:
+                keep = False
+            else:
+                if raw.in_transaction:
+                    raw.rollback()
+                keep = self._idle.qsize() < self.pool_size
+        except mysql.connector.Error:
+            keep = False
+
+        if keep:
+            self._idle.put((raw, created_at))
+        else:
+            self._discard(raw)
+        self._slots.release()
+
+    def prewarm(self, count=None):
+        """Open up to `count` (default pool_size) idle connections ahead of the first requests."""
+        count = min(self.pool_size, self.pool_size if count is None else count)
+        connections = [self.connect() for _ in range(max(0, count - self._idle.qsize()))]
+        for connection in connections:
+            connection.close()
+
+    def dispose(self):
+        """Close every idle connection, e.g. on shutdown."""
+        while True:
+            try:
+                raw, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(raw)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            open_connections = self._open
+        idle = self._idle.qsize()
+        stats.update({
+            "pool_size": self.pool_size,
+            "max_overflow": self.max_overflow,
+            "timeout": self.timeout,
+            "recycle": self.recycle,
+            "pre_ping": self.pre_ping,
+            "open": open_connections,
+            "idle": idle,
+            "in_use": open_connections - idle,
+            "overflow": max(0, open_connections - self.pool_size),
+        })
+        if stats["checkouts"]:
+            stats["avg_wait_seconds"] = stats["total_wait_seconds"] / stats["checkouts"]
+        else:
+            stats["avg_wait_seconds"] = 0.0
+        return stats
+
+
+def create_pool(backend=DB_BACKEND):
+    if backend == "mysql":
+        return ConnectionPool(DB_CONFIG)
+    if backend in ("sqlite", "memory"):
+        from sqlite_backend import SQLITE_PATH, SQLiteBackend
+        return SQLiteBackend(":memory:" if backend == "memory" else SQLITE_PATH)
+    raise ValueError(f"Unknown DB_BACKEND {backend!r}; expected mysql, sqlite or memory")
+
+
+def create_replica_pools(hosts=DB_REPLICA_HOSTS, backend=DB_BACKEND):
+    """One ConnectionPool per replica host; none for the SQLite backends."""
+    if backend != "mysql":
+        return []
+    replicas = []
+    for host in hosts:
+        config = dict(DB_CONFIG)
+        name, _, port = host.partition(":")
+        config["host"] = name
+        if port:
+            config["port"] = int(port)
+        replicas.append(ConnectionPool(config, pool_size=REPLICA_POOL_SIZE))
+    return replicas
+
+
+pool = create_pool()
@@ -0,0 +1,164 @@
+"""
+Routes DB_Interface connections between the primary and read replicas.
+
+Functions decorated with @read_only are pure reads and may run on a replica
+(DB_REPLICA_HOSTS); everything else, and every connection outside such a
+function, goes to the primary. A user's reads are pinned to one replica
+(chosen by user_id), so they never go backwards in time between two calls,
+e.g. an ETag version read and the data read after it.
+
+Replicas lag behind the primary. For DB_READ_YOUR_WRITES_SECONDS after a
+user's write (note_write), that user's reads go to the primary so they see
+their own change on the next screen. The window is tracked per process;
+set it above the usual replication lag. 0 turns it off.
+
+If a replica cannot hand out a connection, the read falls back to the primary.
+"""
+import contextvars
+import functools
+import inspect
+import itertools
+import logging
+import os
+import threading
+import time
+
+import mysql.connector
+
+from db_pool import create_replica_pools, pool
+
+
+READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "5"))
+
+logger = logging.getLogger("fitness.db")
+
+# Set for the duration of a @read_only function: (user_id or None,)
+_read_context = contextvars.ContextVar("read_context", default=None)
+
+
+def read_context():
+    """(user_id,) inside a @read_only function, None where connections go to the primary."""
+    return _read_context.get()
+
+
+def read_only(func):
+    """Mark a DB_Interface function as a pure read that may run on a replica."""
+    try:
+        user_index = list(inspect.signature(func).parameters).index("user_id")
+    except ValueError:
+        user_index = None
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        user_id = kwargs.get("user_id")
+        if user_id is None and user_index is not None and user_index < len(args):
+            user_id = args[user_index]
+        token = _read_context.set((user_id,))
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _read_context.reset(token)
+    return wrapper
+
+
+def on_primary(func):
+    """Run a function on the primary even when called from inside a @read_only one."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _read_context.set(None)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _read_context.reset(token)
+    return wrapper
+
+
+class ReadRouter:
+    def __init__(self, primary, replicas, read_your_writes=READ_YOUR_WRITES_SECONDS):
+        self.primary = primary
+        self.replicas = replicas
+        self.read_your_writes = read_your_writes
+        self._recent_writes = {}   # user_id -> monotonic time until which reads go to the primary
+        self._lock = threading.Lock()
+        self._round_robin = itertools.count()
+        self._stats = {"replica_checkouts": 0, "read_your_writes_checkouts": 0, "replica_fallbacks": 0}
+
+    def note_write(self, *user_ids):
+        """Send these users' reads to the primary for the read-your-writes window."""
+        if not self.replicas or self.read_your_writes <= 0:
+            return
+        now = time.monotonic()
+        until = now + self.read_your_writes
+        with self._lock:
+            for user_id in user_ids:
+                try:
+                    self._recent_writes[int(user_id)] = until
+                except (TypeError, ValueError):
+                    pass
+            if len(self._recent_writes) > 10000:
+                self._recent_writes = {uid: t for uid, t in self._recent_writes.items() if t > now}
+
+    def _wrote_recently(self, user_id):
+        with self._lock:
+            until = self._recent_writes.get(user_id)
+            if until is None:
+                return False
+            if until > time.monotonic():
+                return True
+            del self._recent_writes[user_id]
+            return False
+
+    def _replica_for(self, user_id):
+        if user_id is None:
+            return self.replicas[next(self._round_robin) % len(self.replicas)]
+        return self.replicas[user_id % len(self.replicas)]
+
+    def connect(self):
+        context = _read_context.get()
+        if context is None or not self.replicas:
+            return self.primary.connect()
+
+        user_id = context[0]
+        try:
+            user_id = int(user_id) if user_id is not None else None
+        except (TypeError, ValueError):
+            user_id = None
+        if user_id is not None and self._wrote_recently(user_id):
+            with self._lock:
+                self._stats["read_your_writes_checkouts"] += 1
+            return self.primary.connect()
+
+        replica = self._replica_for(user_id)
+        try:
+            connection = replica.connect()
+        except mysql.connector.Error as err:
+            logger.warning("Replica %s unavailable, reading from the primary: %s", replica.db_config["host"], err)
+            with self._lock:
+                self._stats["replica_fallbacks"] += 1
+            return self.primary.connect()
+        with self._lock:
+            self._stats["replica_checkouts"] += 1
+        return connection
+
+    def prewarm(self):
+        self.primary.prewarm()
+        for replica in self.replicas:
+            try:
+                replica.prewarm()
+            except mysql.connector.Error as err:
+                logger.warning("Replica %s not prewarmed: %s", replica.db_config["host"], err)
+
+    def dispose(self):
+        self.primary.dispose()
+        for replica in self.replicas:
+            replica.dispose()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["read_your_writes_users"] = len(self._recent_writes)
+        stats["replicas"] = len(self.replicas)
+        return stats
+
+
+router = ReadRouter(pool, create_replica_pools())
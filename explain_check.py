@@ -0,0 +1,195 @@
+"""
+EXPLAIN regression check for every DB_Interface query.
+
+Creates (or reuses) a scratch database, applies the migrations, seeds it with
+synthetic data, then calls every DB_Interface function while recording the
+SQL it sends. Each recorded statement is run again under EXPLAIN, and the
+check fails if any of them reads a table with a full scan (type ALL).
+
+    DB_NAME=fitness_explain python explain_check.py [--users 2000]
+
+Never point it at the production database: it writes seed data.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+from datetime import date, timedelta
+
+os.environ.setdefault("DB_NAME", "fitness_explain")
+
+import db_pool  # noqa: E402
+from seed_data import create_database, seed  # noqa: E402
+
+
+# Statements that read a whole table on purpose: (pattern, reason)
+FULL_SCAN_ALLOWED = [
+    (r"SELECT friend_id, requester_id, recipient_id, status FROM friendships$", "friend graph load"),
+    (r"SELECT user_id, total_steps FROM step_totals WHERE total_steps > 0$", "all-time global leaderboard load"),
+]
+
+
+class RecordingCursor:
+    def __init__(self, cursor, log):
+        self._cursor = cursor
+        self._log = log
+
+    def execute(self, operation, params=()):
+        self._log.append((operation, params))
+        return self._cursor.execute(operation, params)
+
+    def executemany(self, operation, seq_params):
+        seq_params = list(seq_params)
+        if seq_params:
+            self._log.append((operation, seq_params[0]))
+        return self._cursor.executemany(operation, seq_params)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class RecordingConnection:
+    def __init__(self, connection, log):
+        self._connection = connection
+        self._log = log
+
+    def cursor(self, *args, **kwargs):
+        return RecordingCursor(self._connection.cursor(*args, **kwargs), self._log)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+def normalize(sql):
+    return re.sub(r"\s+", " ", sql).strip().rstrip(";")
+
+
+def exercise():
+    """Call every DB_Interface function once (twice for paginated ones)."""
+    import DB_Interface as db
+    from friend_graph import friend_graph
+    from user_search import user_search_index
+
+    friend_graph.load()
+    user_search_index.load()
+
+    connection = db_pool.pool.connect()
+    cursor = connection.cursor()
+    cursor.execute("SELECT MIN(user_id) FROM users")
+    user_id = cursor.fetchone()[0]
+    cursor.execute("SELECT friend_id FROM friendships WHERE recipient_id = %s LIMIT 1", (user_id + 1,))
+    row = cursor.fetchone()
+    cursor.close()
+    connection.close()
+
+    today = date.today().isoformat()
+    phone = f"8{random.randint(0, 10**9):09d}"
+    db.register_user({
+        "username": "explain", "phone_number": phone, "email": f"{phone}@example.com", "DOB": "1990-01-01",
+        "height": 170, "weight": 70, "blood": "A+", "gender": "female", "experience": "beginner",
+        "stepgoal": 8000, "caloriegoal": 2000, "password": "secret",
+    })
+    db.login_user({"phone_number": phone, "password": "secret"})
+    db.update_steps({"user_id": user_id, "date": today, "steps": 4321, "midnight_step_count": 100})
+    db.update_steps_batch([
+        {"user_id": user_id, "date": (date.today() - timedelta(days=d)).isoformat(), "steps": 2000 + d, "midnight_step_count": 0}
+        for d in range(3)
+    ])
+    db.get_weekly_statistics(user_id)
+    db.insert_activity_data({"activity": "run", "duration": 20, "user_id": user_id, "activity_date": today})
+    _, next_cursor = db.fetch_activities(user_id, 2)
+    db.fetch_activities(user_id, 2, next_cursor)
+    db.update_user({"height": 171, "weight": 71, "blood": "A+", "experience": "pro", "stepgoal": 9000, "user_id": user_id})
+    try:
+        db.send_friend_request(user_id, user_id + 7)
+    except Exception:
+        pass  # already related in the seed data
+    if row:
+        db.respond_friend_request(row[0], "accepted")
+    db.list_friends(user_id)
+    db.leaderboard_data(user_id)
+    db.get_pending_friend_requests(user_id)
+    db.search_users_by_name("user1", user_id)
+    db.check_account({"phone_number": phone, "email": "nobody@example.com"})
+    db.get_user_monthly_steps(user_id)
+    db.get_longest_streak(user_id)
+    db.get_total_steps_for_user(user_id)
+    db.get_step_rollups(user_id)
+    try:
+        db.get_total_steps_previous_day(user_id)
+    except Exception:
+        pass
+    db.post_feedback_to_db({"user_id": user_id, "description": "explain check"})
+    db.insert_transaction_data({"user_id": user_id, "transaction_type": "spend", "activity_type": "redeem", "amount": 1})
+    _, next_cursor = db.fetch_transactions(user_id, 2)
+    db.fetch_transactions(user_id, 2, next_cursor)
+    db.get_user_credit_balance(user_id)
+    _, next_cursor = db.get_all_users(2)
+    db.get_all_users(2, next_cursor)
+    db.get_global_leaderboard("weekly", 10)
+    db.get_global_rank(user_id, "monthly", 3)
+    for _ in db.iter_all_users():
+        pass
+    db.search_users("user2")
+
+
+def explain(statements):
+    failures = []
+    connection = db_pool.pool.connect()
+    cursor = connection.cursor(dictionary=True)
+    try:
+        for sql, params in statements:
+            cursor.execute("EXPLAIN " + sql, params)
+            for plan in cursor.fetchall():
+                table = plan.get("table") or ""
+                if plan.get("type") == "ALL" and not table.startswith("<"):
+                    failures.append((sql, table, plan.get("rows")))
+        connection.rollback()
+    finally:
+        cursor.close()
+        connection.close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000, help="users to seed")
+    args = parser.parse_args()
+
+    import migrations
+
+    if db_pool.pool.dialect != "mysql":
+        sys.exit("The EXPLAIN check needs DB_BACKEND=mysql.")
+    create_database()
+    migrations.upgrade()
+    seed(args.users)
+
+    log = []
+    connect = db_pool.pool.connect
+    db_pool.pool.connect = lambda: RecordingConnection(connect(), log)
+    try:
+        exercise()
+    finally:
+        db_pool.pool.connect = connect
+
+    statements = {}
+    for sql, params in log:
+        text = normalize(sql)
+        if re.match(r"(SELECT|WITH|INSERT|UPDATE|DELETE)\b", text, re.IGNORECASE):
+            statements.setdefault(text, (sql, params))
+    allowed = [
+        text for text in statements
+        if any(re.search(pattern, text) for pattern, _ in FULL_SCAN_ALLOWED)
+    ]
+    checked = [statements[text] for text in statements if text not in allowed]
+
+    failures = explain(checked)
+    print(f"Checked {len(checked)} statements ({len(allowed)} allowed full scans skipped)")
+    for sql, table, rows in failures:
+        print(f"\nFULL SCAN on {table} (~{rows} rows):\n  {normalize(sql)}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
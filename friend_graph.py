@@ -0,0 +1,177 @@
+"""
+In-memory friendship graph.
+
+Holds every row of `friendships` as an edge (requester -> recipient, status)
+plus an adjacency map of accepted friends per user, so friend listings,
+leaderboard membership and duplicate / reciprocal request checks are
+dictionary lookups. send_friend_request and respond_friend_request update it
+after they commit; a full reload every FRIEND_GRAPH_RELOAD_INTERVAL seconds
+picks up writes made by other workers. That reload runs in a background
+thread while requests keep using the old graph; only the first load makes
+requests wait, for a single reload. Changes applied while a reload reads the
+table are recorded and replayed onto the new graph before it is swapped in,
+so a request accepted mid-reload is not lost with the old graph.
+"""
+import logging
+import os
+import threading
+import time
+
+from db_pool import pool
+
+
+FRIEND_GRAPH_RELOAD_INTERVAL = float(os.getenv("FRIEND_GRAPH_RELOAD_INTERVAL", "60"))
+
+logger = logging.getLogger("fitness.db")
+
+
+class _Graph:
+    def __init__(self):
+        self.edges = {}     # friend_id -> (requester_id, recipient_id, status)
+        self.by_pair = {}   # (requester_id, recipient_id) -> friend_id
+        self.friends = {}   # user_id -> {friend_user_id: friend_id}, accepted only
+
+    def apply(self, friend_id, requester_id, recipient_id, status):
+        old = self.edges.get(friend_id)
+        if old is not None and old[2] == "accepted":
+            self.friends.get(old[0], {}).pop(old[1], None)
+            self.friends.get(old[1], {}).pop(old[0], None)
+
+        self.edges[friend_id] = (requester_id, recipient_id, status)
+        self.by_pair[(requester_id, recipient_id)] = friend_id
+        if status == "accepted":
+            self.friends.setdefault(requester_id, {})[recipient_id] = friend_id
+            self.friends.setdefault(recipient_id, {})[requester_id] = friend_id
+
+
+class FriendGraph:
+    # Seconds before a failed background reload is tried again
+    RETRY_AFTER = 30
+
+    def __init__(self, reload_interval=FRIEND_GRAPH_RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+        self._graph = _Graph()
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()   # one reload at a time
+        self._background = None                # background reload thread
+        self._retry_at = 0.0
+        self._replay = None                    # applies made while a reload reads the table
+
+    @staticmethod
+    def _read_table():
+        connection = pool.connect()
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT friend_id, requester_id, recipient_id, status FROM friendships")
+            graph = _Graph()
+            for row in cursor.fetchall():
+                graph.apply(*row)
+            return graph
+        finally:
+            cursor.close()
+            connection.close()
+
+    def load(self):
+        """Rebuild the graph from the table and swap it in atomically."""
+        with self._reload_lock:
+            self._load()
+
+    def _load(self):
+        with self._lock:
+            self._replay = []
+        try:
+            graph = self._read_table()
+        except Exception:
+            with self._lock:
+                self._replay = None
+            raise
+        with self._lock:
+            # The read may have missed rows committed after it started; apply
+            # is idempotent, so replaying ones it did see is harmless
+            for change in self._replay:
+                graph.apply(*change)
+            self._replay = None
+            self._graph = graph
+            self._loaded_at = time.monotonic()
+
+    def ensure_fresh(self):
+        if self._loaded_at is None:
+            # Nothing to serve yet: one thread loads, the others wait for it
+            with self._reload_lock:
+                if self._loaded_at is None:
+                    self._load()
+        elif time.monotonic() - self._loaded_at > self.reload_interval:
+            self._reload_in_background()
+
+    def _reload_in_background(self):
+        with self._lock:
+            if self._background is not None or time.monotonic() < self._retry_at:
+                return
+            self._background = threading.Thread(target=self._background_reload,
+                                                name="friend-graph-reload", daemon=True)
+            self._background.start()
+
+    def _background_reload(self):
+        try:
+            self.load()
+        except Exception as err:
+            logger.error("Reloading the friend graph failed: %s", err)
+            with self._lock:
+                self._retry_at = time.monotonic() + self.RETRY_AFTER
+        finally:
+            with self._lock:
+                self._background = None
+
+    def apply(self, friend_id, requester_id, recipient_id, status):
+        with self._lock:
+            self._graph.apply(friend_id, requester_id, recipient_id, status)
+            if self._replay is not None:
+                self._replay.append((friend_id, requester_id, recipient_id, status))
+
+    def edge(self, requester_id, recipient_id):
+        """(friend_id, status) of the request from requester to recipient, or None."""
+        with self._lock:
+            friend_id = self._graph.by_pair.get((requester_id, recipient_id))
+            if friend_id is None:
+                return None
+            return friend_id, self._graph.edges[friend_id][2]
+
+    def endpoints(self, friend_id):
+        """(requester_id, recipient_id) of a friendship row, or None if unknown."""
+        with self._lock:
+            edge = self._graph.edges.get(friend_id)
+            return edge[:2] if edge else None
+
+    def friends_of(self, user_id):
+        """{friend_user_id: friend_id} for the user's accepted friendships."""
+        with self._lock:
+            return dict(self._graph.friends.get(user_id, {}))
+
+    def check_consistency(self):
+        """
+        Compare the in-memory graph with the friendships table. Returns the
+        friend_ids that are missing, extra or different in memory.
+        """
+        table = self._read_table()
+        with self._lock:
+            memory = dict(self._graph.edges)
+        return {
+            "missing": sorted(set(table.edges) - set(memory)),
+            "extra": sorted(set(memory) - set(table.edges)),
+            "different": sorted(
+                friend_id for friend_id in set(table.edges) & set(memory)
+                if table.edges[friend_id] != memory[friend_id]
+            ),
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "edges": len(self._graph.edges),
+                "users_with_friends": sum(1 for friends in self._graph.friends.values() if friends),
+                "age_seconds": time.monotonic() - self._loaded_at if self._loaded_at else None,
+            }
+
+
+friend_graph = FriendGraph()
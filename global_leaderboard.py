@@ -0,0 +1,531 @@
+"""
+Global step leaderboards: today (daily), this week, this month and all time.
+
+Each board keeps every user with steps in the period in an indexable skip
+list ordered by steps (descending, ties by user_id), so the top N, a user's
+rank and percentile and the users ranked around them are O(log n) lookups
+instead of a sort of `steps` per request.
+
+Boards are loaded from steps / the rollup tables and kept current by
+update_steps and update_steps_batch, which commit through commit_steps() so
+their step deltas are applied right after the commit. A full reload every
+GLOBAL_LEADERBOARD_RELOAD_INTERVAL seconds picks up writes made by other
+workers and rollup rebuilds. It runs in a background thread while requests
+keep reading the old boards; only the first load and the switch to a new
+day, week or month make requests wait, for a single reload.
+
+A reload reads from one consistent snapshot. Commits in this process are
+held back for the moment the snapshot is taken, and the deltas of commits
+after it are applied again to the new boards, so no write is lost or
+counted twice.
+
+For fast restarts the boards are written to GLOBAL_LEADERBOARD_SNAPSHOT (in
+the temp directory by default) after every reload and on shutdown. load()
+starts from that file instead of the database if it is for the current
+periods and younger than GLOBAL_LEADERBOARD_SNAPSHOT_MAX_AGE. An empty path
+turns snapshots off.
+"""
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+
+from db_pool import pool
+from rollups import month_start, week_start
+
+
+GLOBAL_LEADERBOARD_RELOAD_INTERVAL = float(os.getenv("GLOBAL_LEADERBOARD_RELOAD_INTERVAL", "300"))
+# Outside the app directory, which App Service shares between instances
+GLOBAL_LEADERBOARD_SNAPSHOT = os.getenv(
+    "GLOBAL_LEADERBOARD_SNAPSHOT", os.path.join(tempfile.gettempdir(), "fitness_global_leaderboard.json")
+)
+GLOBAL_LEADERBOARD_SNAPSHOT_MAX_AGE = float(os.getenv("GLOBAL_LEADERBOARD_SNAPSHOT_MAX_AGE", "900"))
+
+PERIODS = ("daily", "weekly", "monthly", "all_time")
+
+# (table, index name, columns, unique) for the board loads; created by migrations.py
+LEADERBOARD_INDEXES = [
+    ("steps", "idx_steps_date_count", "date, daily_step_count", False),
+    ("step_rollups_weekly", "idx_rollups_weekly_start", "week_start, total_steps", False),
+    ("step_rollups_monthly", "idx_rollups_monthly_start", "month_start, total_steps", False),
+]
+
+# Period -> query returning (user_id, steps) for the period starting at %s
+LOAD_QUERIES = {
+    "daily": "SELECT user_id, daily_step_count FROM steps WHERE date = %s AND daily_step_count > 0",
+    "weekly": "SELECT user_id, total_steps FROM step_rollups_weekly WHERE week_start = %s AND total_steps > 0",
+    "monthly": "SELECT user_id, total_steps FROM step_rollups_monthly WHERE month_start = %s AND total_steps > 0",
+    "all_time": "SELECT user_id, total_steps FROM step_totals WHERE total_steps > 0",
+}
+
+logger = logging.getLogger("fitness.db")
+
+
+def period_start(period, day):
+    if period == "daily":
+        return day
+    if period == "weekly":
+        return week_start(day)
+    if period == "monthly":
+        return month_start(day)
+    return None
+
+
+class _Node:
+    __slots__ = ("key", "next", "span")
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        self.span = [0] * level   # positions skipped by next[i]
+
+
+class IndexableSkipList:
+    """
+    Sorted keys with O(log n) insert, remove, rank and access by position
+    (the span bookkeeping of Redis sorted sets).
+    """
+
+    MAX_LEVEL = 32
+    P = 0.25
+
+    def __init__(self):
+        self.head = _Node(None, self.MAX_LEVEL)
+        self.level = 1
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _random_level(self):
+        level = 1
+        while level < self.MAX_LEVEL and random.random() < self.P:
+            level += 1
+        return level
+
+    @classmethod
+    def from_sorted(cls, keys):
+        """Build from already sorted keys in O(n)."""
+        skiplist = cls()
+        last = [skiplist.head] * cls.MAX_LEVEL
+        last_position = [0] * cls.MAX_LEVEL
+        position = 0
+        for position, key in enumerate(keys, 1):
+            level = skiplist._random_level()
+            node = _Node(key, level)
+            for i in range(level):
+                last[i].next[i] = node
+                last[i].span[i] = position - last_position[i]
+                last[i] = node
+                last_position[i] = position
+            skiplist.level = max(skiplist.level, level)
+        for i in range(cls.MAX_LEVEL):
+            last[i].span[i] = position - last_position[i]
+        skiplist.size = position
+        return skiplist
+
+    def insert(self, key):
+        update = [None] * self.MAX_LEVEL
+        rank = [0] * self.MAX_LEVEL
+        node = self.head
+        for i in reversed(range(self.level)):
+            rank[i] = rank[i + 1] if i + 1 < self.level else 0
+            while node.next[i] is not None and node.next[i].key < key:
+                rank[i] += node.span[i]
+                node = node.next[i]
+            update[i] = node
+
+        level = self._random_level()
+        if level > self.level:
+            for i in range(self.level, level):
+                rank[i] = 0
+                update[i] = self.head
+                self.head.span[i] = self.size
+            self.level = level
+
+        new = _Node(key, level)
+        for i in range(level):
+            new.next[i] = update[i].next[i]
+            update[i].next[i] = new
+            new.span[i] = update[i].span[i] - (rank[0] - rank[i])
+            update[i].span[i] = rank[0] - rank[i] + 1
+        for i in range(level, self.level):
+            update[i].span[i] += 1
+        self.size += 1
+
+    def remove(self, key):
+        update = [None] * self.MAX_LEVEL
+        node = self.head
+        for i in reversed(range(self.level)):
+            while node.next[i] is not None and node.next[i].key < key:
+                node = node.next[i]
+            update[i] = node
+
+        target = node.next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        for i in range(self.level):
+            if update[i].next[i] is target:
+                update[i].span[i] += target.span[i] - 1
+                update[i].next[i] = target.next[i]
+            else:
+                update[i].span[i] -= 1
+        while self.level > 1 and self.head.next[self.level - 1] is None:
+            self.level -= 1
+        self.size -= 1
+
+    def count_below(self, key):
+        """Number of keys smaller than key."""
+        count = 0
+        node = self.head
+        for i in reversed(range(self.level)):
+            while node.next[i] is not None and node.next[i].key < key:
+                count += node.span[i]
+                node = node.next[i]
+        return count
+
+    def _node_at(self, index):
+        traversed = 0
+        node = self.head
+        for i in reversed(range(self.level)):
+            while node.next[i] is not None and traversed + node.span[i] <= index + 1:
+                traversed += node.span[i]
+                node = node.next[i]
+            if traversed == index + 1:
+                return node
+        raise IndexError(index)
+
+    def slice(self, start, stop):
+        """Keys at positions start..stop-1."""
+        start = max(0, start)
+        stop = min(self.size, stop)
+        if start >= stop:
+            return []
+        node = self._node_at(start)
+        keys = []
+        while node is not None and len(keys) < stop - start:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+    def __iter__(self):
+        node = self.head.next[0]
+        while node is not None:
+            yield node.key
+            node = node.next[0]
+
+
+class Board:
+    """Users ranked by steps, highest first. Users with no steps are not on the board."""
+
+    def __init__(self, scores=None):
+        scores = {user_id: steps for user_id, steps in (scores or {}).items() if steps > 0}
+        self._scores = scores
+        self._list = IndexableSkipList.from_sorted(sorted((-steps, user_id) for user_id, steps in scores.items()))
+
+    @classmethod
+    def from_ranked(cls, items):
+        """Build from [(user_id, steps)] already in board order, as items() returns them."""
+        board = cls()
+        board._scores = dict(items)
+        board._list = IndexableSkipList.from_sorted((-steps, user_id) for user_id, steps in items)
+        return board
+
+    def __len__(self):
+        return len(self._scores)
+
+    def set(self, user_id, steps):
+        old = self._scores.pop(user_id, None)
+        if old is not None:
+            self._list.remove((-old, user_id))
+        if steps > 0:
+            self._scores[user_id] = steps
+            self._list.insert((-steps, user_id))
+
+    def add(self, user_id, delta):
+        self.set(user_id, self._scores.get(user_id, 0) + delta)
+
+    def top(self, limit, offset=0):
+        """[(position, user_id, steps)] from position offset + 1 on (positions are 1-based)."""
+        return [
+            (offset + index + 1, user_id, -negative)
+            for index, (negative, user_id) in enumerate(self._list.slice(offset, offset + limit))
+        ]
+
+    def rank(self, user_id):
+        """
+        {"rank", "position", "steps", "percentile"} or None if the user has no steps.
+        Equal steps share a rank; position breaks ties by user_id.
+        """
+        steps = self._scores.get(user_id)
+        if steps is None:
+            return None
+        total = len(self._scores)
+        rank = self._list.count_below((-steps, float("-inf"))) + 1
+        return {
+            "rank": rank,
+            "position": self._list.count_below((-steps, user_id)) + 1,
+            "steps": steps,
+            # Share of ranked users with at most as many steps
+            "percentile": round(100 * (total - rank + 1) / total, 2),
+        }
+
+    def items(self):
+        return [(user_id, -negative) for negative, user_id in self._list]
+
+
+class GlobalLeaderboard:
+    # Seconds before a failed background reload is tried again
+    RETRY_AFTER = 30
+
+    def __init__(self, reload_interval=GLOBAL_LEADERBOARD_RELOAD_INTERVAL,
+                 snapshot_path=GLOBAL_LEADERBOARD_SNAPSHOT, snapshot_max_age=GLOBAL_LEADERBOARD_SNAPSHOT_MAX_AGE):
+        self.reload_interval = reload_interval
+        self.snapshot_path = snapshot_path
+        self.snapshot_max_age = snapshot_max_age
+        self._boards = {}      # period -> (period start, Board)
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._commits_done = threading.Condition(self._lock)
+        self._reload_lock = threading.Lock()   # one reload at a time
+        self._committing = 0          # commit_steps() calls between commit and apply
+        self._holding_commits = False  # set while reload() takes its snapshot
+        self._replay = None           # during a reload: deltas committed after its snapshot
+        self._background = None       # background reload thread
+        self._retry_at = 0.0
+        self._stats = {"reloads": 0, "background_reloads": 0, "reload_failures": 0,
+                       "replayed_deltas": 0, "snapshot_loads": 0, "snapshot_saves": 0}
+
+    @staticmethod
+    def _starts(today=None):
+        today = today or date.today()
+        return {period: period_start(period, today) for period in PERIODS}
+
+    def _read_tables(self, starts):
+        connection = pool.connect()
+        cursor = connection.cursor()
+        try:
+            with self._lock:
+                # Let the commits in flight apply their deltas, and hold back new ones
+                # until the snapshot exists: every commit is then either in the snapshot
+                # or replayed onto the new boards
+                self._holding_commits = True
+                while self._committing:
+                    self._commits_done.wait()
+            try:
+                if pool.dialect == "mysql":
+                    connection.start_transaction(consistent_snapshot=True, isolation_level="REPEATABLE READ")
+                # SQLite lends its single connection to us alone, so nothing commits meanwhile
+            finally:
+                with self._lock:
+                    self._holding_commits = False
+                    self._replay = []
+                    self._commits_done.notify_all()
+
+            boards = {}
+            for period, start in starts.items():
+                cursor.execute(LOAD_QUERIES[period], () if start is None else (start,))
+                boards[period] = (start, Board(dict(cursor.fetchall())))
+            return boards
+        except BaseException:
+            with self._lock:
+                self._holding_commits = False
+                self._replay = None
+                self._commits_done.notify_all()
+            raise
+        finally:
+            cursor.close()
+            connection.close()
+
+    def load(self):
+        """Load the boards, from the snapshot if it is recent enough, else from the database."""
+        with self._reload_lock:
+            if not self._load_snapshot():
+                self._reload()
+
+    def reload(self):
+        """Rebuild every board from the database and swap them in atomically."""
+        with self._reload_lock:
+            self._reload()
+
+    def _reload(self):
+        boards = self._read_tables(self._starts())
+        with self._lock:
+            for deltas in self._replay:
+                self._apply(boards, deltas)
+            self._stats["replayed_deltas"] += len(self._replay)
+            self._replay = None
+            self._boards = boards
+            self._loaded_at = time.monotonic()
+            self._stats["reloads"] += 1
+        self.save_snapshot()
+
+    def _stale(self):
+        """None if the boards are fresh, "reload" if they are old, "invalid" if they can't be served."""
+        with self._lock:
+            loaded_at = self._loaded_at
+            starts = {period: board[0] for period, board in self._boards.items()}
+        if loaded_at is None or starts != self._starts():
+            return "invalid"
+        if time.monotonic() - loaded_at > self.reload_interval:
+            return "reload"
+        return None
+
+    def ensure_fresh(self):
+        stale = self._stale()
+        if stale == "invalid":
+            # Nothing to serve until loaded: one thread reloads, the others wait for it
+            with self._reload_lock:
+                if self._stale() == "invalid":
+                    self._reload()
+        elif stale == "reload":
+            self._reload_in_background()
+
+    def _reload_in_background(self):
+        with self._lock:
+            if self._background is not None or time.monotonic() < self._retry_at:
+                return
+            self._background = threading.Thread(target=self._background_reload,
+                                                name="global-leaderboard-reload", daemon=True)
+            self._background.start()
+
+    def _background_reload(self):
+        try:
+            self.reload()
+            with self._lock:
+                self._stats["background_reloads"] += 1
+        except Exception as err:
+            logger.error("Reloading the global leaderboards failed: %s", err)
+            with self._lock:
+                self._stats["reload_failures"] += 1
+                self._retry_at = time.monotonic() + self.RETRY_AFTER
+        finally:
+            with self._lock:
+                self._background = None
+
+    @staticmethod
+    def _apply(boards, deltas):
+        for period, (start, board) in boards.items():
+            for (user_id, day), delta in deltas.items():
+                if period_start(period, day) == start:
+                    board.add(user_id, delta)
+
+    def apply_deltas(self, deltas):
+        """Apply committed step changes, {(user_id, date): change in daily steps}."""
+        with self._lock:
+            self._apply(self._boards, deltas)
+            if self._replay is not None:
+                self._replay.append(deltas)
+
+    @contextmanager
+    def _commit_scope(self):
+        with self._lock:
+            while self._holding_commits:
+                self._commits_done.wait()
+            self._committing += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._committing -= 1
+                self._commits_done.notify_all()
+
+    def commit_steps(self, connection, *deltas):
+        """
+        Commit a step write and apply its deltas (as returned by _write_step_rows),
+        ordered against reload()'s snapshot.
+        """
+        with self._commit_scope():
+            connection.commit()
+            for changes in deltas:
+                self.apply_deltas(changes)
+
+    def _fresh(self, period):
+        if period not in PERIODS:
+            raise ValueError(f"Unknown period {period!r}; choose from {', '.join(PERIODS)}")
+        self.ensure_fresh()
+
+    def top(self, period, limit, offset=0):
+        """(period start, total ranked users, [(position, user_id, steps)])."""
+        self._fresh(period)
+        with self._lock:
+            start, board = self._boards[period]
+            return start, len(board), board.top(limit, offset)
+
+    def around(self, period, user_id, neighbours):
+        """
+        (period start, total, the user's rank info or None, entries around the user).
+        Entries are the `neighbours` positions above and below the user's own.
+        """
+        self._fresh(period)
+        with self._lock:
+            start, board = self._boards[period]
+            rank = board.rank(user_id)
+            if rank is None:
+                return start, len(board), None, []
+            first = max(0, rank["position"] - 1 - neighbours)
+            return start, len(board), rank, board.top(rank["position"] + neighbours - first, first)
+
+    def save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            boards = {
+                period: {"start": start.isoformat() if start else None, "scores": board.items()}
+                for period, (start, board) in self._boards.items()
+            }
+        snapshot = {"saved_at": time.time(), "boards": boards}
+        # Per process: several workers may share the snapshot path
+        temporary = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary, "w") as f:
+                json.dump(snapshot, f, separators=(",", ":"))
+            os.replace(temporary, self.snapshot_path)
+            with self._lock:
+                self._stats["snapshot_saves"] += 1
+        except OSError as err:
+            logger.warning("Could not write the leaderboard snapshot %s: %s", self.snapshot_path, err)
+
+    def _load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            age = time.time() - snapshot["saved_at"]
+            starts = self._starts()
+            if age > self.snapshot_max_age or age < 0:
+                return False
+            boards = {}
+            for period, start in starts.items():
+                saved = snapshot["boards"][period]
+                if saved["start"] != (start.isoformat() if start else None):
+                    return False
+                # Saved in board order, so the skip list is built without sorting
+                boards[period] = (start, Board.from_ranked([tuple(item) for item in saved["scores"]]))
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            logger.warning("Ignoring the leaderboard snapshot %s: %s", self.snapshot_path, err)
+            return False
+
+        with self._lock:
+            self._boards = boards
+            # Reloaded from the database once the snapshot is as old as a regular load would be
+            self._loaded_at = time.monotonic() - age
+            self._stats["snapshot_loads"] += 1
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            for period, (_, board) in self._boards.items():
+                stats[f"{period}_users"] = len(board)
+            stats["age_seconds"] = time.monotonic() - self._loaded_at if self._loaded_at else None
+        return stats
+
+
+global_leaderboard = GlobalLeaderboard()
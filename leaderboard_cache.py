@@ -0,0 +1,183 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+LEADERBOARD_CACHE_SIZE = int(os.getenv("LEADERBOARD_CACHE_SIZE", "10000"))
+LEADERBOARD_CACHE_TTL = float(os.getenv("LEADERBOARD_CACHE_TTL", "3600"))
+# Set to a redis:// URL to share the cache between workers (needs the redis package)
+LEADERBOARD_CACHE_URL = os.getenv("LEADERBOARD_CACHE_URL")
+
+
+class LocalBackend:
+    """In-process LRU store with per-entry expiry."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def get_counters(self, keys):
+        with self._lock:
+            return [self._counters.get(key, 0) for key in keys]
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def size(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Shared store; LRU eviction is left to the server's maxmemory-policy."""
+
+    def __init__(self, url):
+        import redis  # optional dependency, only needed for the shared cache
+        self._client = redis.Redis.from_url(url)
+        self.evictions = 0
+
+    def get(self, key):
+        raw = self._client.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl):
+        self._client.set(key, json.dumps(value, default=str), ex=max(1, int(ttl)))
+
+    def delete(self, key):
+        self._client.delete(key)
+
+    def get_counters(self, keys):
+        return [int(value or 0) for value in self._client.mget(keys)] if keys else []
+
+    def incr(self, key):
+        self._client.incr(key)
+
+    def size(self):
+        return None
+
+
+class LeaderboardCache:
+    """
+    Per-user cache of the friend leaderboard for a given day.
+
+    Every user has a generation counter. A cached board remembers the
+    generation of each member at the time it was built and is treated as
+    stale as soon as any member's generation moves, so bumping one user
+    invalidates exactly the boards that user appears on. A second counter
+    per user, the friendship version, moves when the user gains or loses a
+    friend, so a board built from an out-of-date member list is not served
+    under generations that are still valid.
+    """
+
+    def __init__(self, backend, ttl=LEADERBOARD_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stale": 0, "invalidations": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    @staticmethod
+    def _board_key(user_id, day):
+        return f"leaderboard:{user_id}:{day}"
+
+    @staticmethod
+    def _generation_key(user_id):
+        return f"leaderboard-gen:{user_id}"
+
+    @staticmethod
+    def _friends_key(user_id):
+        return f"leaderboard-friends:{user_id}"
+
+    def get(self, user_id, day):
+        entry = self.backend.get(self._board_key(user_id, day))
+        if entry is None:
+            self._count("misses")
+            return None
+
+        members = entry["members"]
+        current = self.backend.get_counters(
+            [self._generation_key(member) for member in members] + [self._friends_key(user_id)]
+        )
+        if current != entry["generations"] + [entry.get("friends_version")]:
+            self.backend.delete(self._board_key(user_id, day))
+            self._count("stale")
+            self._count("misses")
+            return None
+
+        self._count("hits")
+        return entry["rows"]
+
+    def generations(self, members):
+        return self.backend.get_counters([self._generation_key(member) for member in members])
+
+    def friends_version(self, user_id):
+        return self.backend.get_counters([self._friends_key(user_id)])[0]
+
+    def put(self, user_id, day, rows, generations, friends_version):
+        # generations and friends_version must be read *before* the member and
+        # leaderboard queries ran, otherwise a write landing in between could be
+        # cached as current
+        self.backend.set(self._board_key(user_id, day), {
+            "members": [row["user_id"] for row in rows],
+            "generations": generations,
+            "friends_version": friends_version,
+            "rows": rows,
+        }, self.ttl)
+
+    def invalidate(self, *user_ids):
+        for user_id in user_ids:
+            self.backend.incr(self._generation_key(user_id))
+            self._count("invalidations")
+
+    def change_friends(self, *user_ids):
+        """Call after committing a change to these users' accepted friendships."""
+        for user_id in user_ids:
+            self.backend.incr(self._friends_key(user_id))
+            self._count("invalidations")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        stats["evictions"] = self.backend.evictions
+        stats["size"] = self.backend.size()
+        return stats
+
+
+if LEADERBOARD_CACHE_URL:
+    leaderboard_cache = LeaderboardCache(RedisBackend(LEADERBOARD_CACHE_URL))
+else:
+    leaderboard_cache = LeaderboardCache(LocalBackend(LEADERBOARD_CACHE_SIZE))
@@ -0,0 +1,163 @@
+"""
+Credit ledger.
+
+Every row in `transactions` is an "earn" or a "spend". users.credit_balance is
+the running balance and is moved in the same DB transaction that appends the
+ledger row, so /get-balance stays a primary-key read. reconcile_balances()
+checks the stored balances against the ledger in bulk.
+
+Balances recorded before the ledger maintained them are reset to the ledger
+sums by migration 7 (backfill_balances), so the overdraft check never runs
+against a stale balance. A drift found later can be corrected with:
+
+    python ledger.py reconcile --fix
+"""
+import argparse
+import logging
+import os
+from decimal import Decimal, InvalidOperation
+
+from fastapi import HTTPException
+
+import data_versions
+from db_pool import pool
+
+
+TRANSACTION_TYPES = ("earn", "spend")
+# Seconds between background reconciliation runs in the API process (0 disables)
+RECONCILE_INTERVAL = float(os.getenv("LEDGER_RECONCILE_INTERVAL", "3600"))
+RECONCILE_BATCH_SIZE = int(os.getenv("LEDGER_RECONCILE_BATCH_SIZE", "1000"))
+
+LEDGER_SUM = "SUM(CASE WHEN transaction_type = 'spend' THEN -amount ELSE amount END)"
+
+
+def parse_amount(amount):
+    try:
+        amount = Decimal(str(amount))
+    except InvalidOperation:
+        raise HTTPException(status_code=400, detail="Amount must be a number")
+    if not amount.is_finite() or amount <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be positive")
+    return amount
+
+
+def post_transaction(cursor, user_id, transaction_type, activity_type, amount):
+    """
+    Append a ledger row and move the user's balance, in the caller's transaction.
+    A "spend" larger than the current balance is rejected.
+    """
+    if transaction_type not in TRANSACTION_TYPES:
+        raise HTTPException(status_code=400, detail=f"transaction_type must be one of {TRANSACTION_TYPES}")
+    amount = parse_amount(amount)
+
+    # Row lock on the user serializes concurrent earns/spends for the same balance
+    cursor.execute("SELECT credit_balance FROM users WHERE user_id = %s FOR UPDATE", (user_id,))
+    row = cursor.fetchone()
+    if row is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    balance = Decimal(row[0] or 0)
+    if transaction_type == "spend" and balance < amount:
+        raise HTTPException(status_code=400, detail="Insufficient credit balance")
+
+    cursor.execute("""
+        INSERT INTO transactions (
+            user_id, transaction_type, activity_type, amount
+        ) VALUES (%s, %s, %s, %s)
+    """, (user_id, transaction_type, activity_type, amount))
+
+    change = amount if transaction_type == "earn" else -amount
+    cursor.execute(
+        "UPDATE users SET credit_balance = credit_balance + %s WHERE user_id = %s",
+        (change, user_id)
+    )
+    data_versions.bump(cursor, "balance", [user_id])
+    return balance + change
+
+
+def backfill_balances(cursor):
+    """Set every stored balance to its ledger sum, in the caller's transaction."""
+    cursor.execute(f"""
+        UPDATE users SET credit_balance = COALESCE((
+            SELECT {LEDGER_SUM} FROM transactions WHERE transactions.user_id = users.user_id
+        ), 0)
+    """)
+    data_versions.bump_all(cursor, "balance")
+
+
+def reconcile_balances(fix=False, batch_size=RECONCILE_BATCH_SIZE):
+    """
+    Compare users.credit_balance with the ledger sum for every user, one
+    user_id range at a time. Returns the mismatches found; with fix=True the
+    stored balance is reset to the ledger value under a row lock.
+    """
+    connection = pool.connect()
+    cursor = connection.cursor(dictionary=True)
+    mismatches = []
+    last_user_id = 0
+
+    try:
+        while True:
+            cursor.execute(f"""
+                SELECT user_id, credit_balance FROM users
+                WHERE user_id > %s
+                ORDER BY user_id
+                LIMIT %s
+                {"FOR UPDATE" if fix else ""}
+            """, (last_user_id, batch_size))
+            users = cursor.fetchall()
+            if not users:
+                break
+
+            cursor.execute(f"""
+                SELECT user_id, {LEDGER_SUM} AS total
+                FROM transactions
+                WHERE user_id > %s AND user_id <= %s
+                GROUP BY user_id
+            """, (last_user_id, users[-1]["user_id"]))
+            # str() first: SQLite returns the sum as a float
+            ledger = {row["user_id"]: Decimal(str(row["total"] or 0)) for row in cursor.fetchall()}
+
+            batch = []
+            for user in users:
+                ledger_balance = ledger.get(user["user_id"], Decimal(0))
+                if Decimal(user["credit_balance"] or 0) != ledger_balance:
+                    batch.append({
+                        "user_id": user["user_id"],
+                        "credit_balance": user["credit_balance"],
+                        "ledger_balance": ledger_balance,
+                    })
+            if fix and batch:
+                cursor.executemany(
+                    "UPDATE users SET credit_balance = %s WHERE user_id = %s",
+                    [(row["ledger_balance"], row["user_id"]) for row in batch]
+                )
+                data_versions.bump(cursor, "balance", [row["user_id"] for row in batch])
+            connection.commit()
+
+            mismatches.extend(batch)
+            last_user_id = users[-1]["user_id"]
+
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+        connection.close()
+
+    for row in mismatches:
+        logging.warning(
+            "Credit balance mismatch for user %s: stored %s, ledger %s%s",
+            row["user_id"], row["credit_balance"], row["ledger_balance"], " (fixed)" if fix else ""
+        )
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Credit ledger maintenance")
+    parser.add_argument("command", choices=["reconcile"])
+    parser.add_argument("--fix", action="store_true", help="reset mismatched balances to the ledger sum")
+    args = parser.parse_args()
+
+    found = reconcile_balances(fix=args.fix)
+    print(f"{len(found)} mismatched balance(s)" + (" fixed" if args.fix and found else ""))
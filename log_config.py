@@ -0,0 +1,167 @@
+"""
+Logging setup for the API.
+
+Request handlers only put records on a queue; a QueueListener thread
+formats and writes them, so a slow stdout never blocks a request and the
+message (msg % args) and traceback are built off the request thread.
+Arguments are formatted when the listener gets to the record, so don't log
+objects that are changed right after the call. Before a record is queued:
+
+- RedactingFilter masks sensitive fields (passwords, tokens, contact details)
+  in dict arguments and `extra` fields,
+- SamplingFilter keeps only a fraction of INFO/DEBUG records from noisy
+  loggers, e.g. LOG_SAMPLE_RATES="fitness.steps=0.01". Warnings and errors
+  are never sampled.
+
+LOG_FORMAT=json (default) writes one JSON object per line, LOG_FORMAT=text
+the old "time - level - message" lines.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# "logger=rate,logger=rate"; a rate applies to the logger and its children
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "fitness.steps=0.01")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+REDACTED = "[REDACTED]"
+REDACT_FIELDS = {"password", "new_password", "token", "access_token", "refresh_token",
+                 "authorization", "phone_number", "email"}
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def parse_sample_rates(text):
+    rates = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+def redact(value):
+    """Copy of value with sensitive keys masked, recursing into dicts and lists."""
+    if isinstance(value, dict):
+        return {key: REDACTED if str(key).lower() in REDACT_FIELDS else redact(item)
+                for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(redact(item) for item in value)
+    return value
+
+
+class RedactingFilter(logging.Filter):
+    def filter(self, record):
+        if isinstance(record.args, dict):
+            record.args = redact(record.args)
+        elif isinstance(record.args, tuple) and any(isinstance(arg, (dict, list)) for arg in record.args):
+            record.args = redact(record.args)
+        for key in set(vars(record)) - _RECORD_ATTRIBUTES:
+            if key.lower() in REDACT_FIELDS:
+                setattr(record, key, REDACTED)
+            else:
+                setattr(record, key, redact(getattr(record, key)))
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self._cache = {}   # logger name -> resolved rate
+
+    def _rate(self, name):
+        rate = self._cache.get(name)
+        if rate is None:
+            rate = 1.0
+            # Most specific configured ancestor wins
+            for prefix, value in sorted(self.rates.items(), key=lambda item: -len(item[0])):
+                if name == prefix or name.startswith(prefix + "."):
+                    rate = value
+                    break
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key in set(vars(record)) - _RECORD_ATTRIBUTES:
+            entry[key] = getattr(record, key)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # QueueHandler.prepare() formats msg % args and the traceback here on the
+        # request thread. The queue never leaves the process, so a shallow copy is
+        # enough and the listener's formatter does the work.
+        return copy.copy(record)
+
+    # Drop the record instead of blocking the request when the writer falls behind
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+_listener = None
+
+
+def setup_logging():
+    """Route the root logger through the queue. Safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+
+    handler = _DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(SamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES)))
+    handler.addFilter(RedactingFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
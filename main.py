@@ -1,13 +1,116 @@
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import FileResponse, HTMLResponse
-import logging
+import asyncio
+import calendar
+
+from datetime import date, datetime
+from typing import Optional
 
-from DB_Interface import generate_qr, get_all_users, post_feedback_to_db, check_account, fetch_activities, fetch_transactions, get_longest_streak, get_pending_friend_requests, get_total_steps_for_user, get_total_steps_previous_day, get_user_credit_balance, get_user_monthly_steps, get_weekly_statistics, insert_activity_data, insert_transaction_data, leaderboard_data, list_friends, login_user, register_user, respond_friend_request, search_users_by_name, send_friend_request, update_steps, update_user
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
+import csv
+import io
+import json
+import logging
+import os
+
+from db_executor import run_db, shutdown_executor
+from db_router import router
+from friend_graph import friend_graph
+from global_leaderboard import global_leaderboard
+import metrics
+from log_config import setup_logging, shutdown_logging
+from ledger import RECONCILE_INTERVAL, reconcile_balances
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER
+from password_hashing import prewarm_hashing, shutdown_hashing
+from session_tokens import ADMIN_API_KEY, AUTH_MODE, SessionMiddleware, issue_token, refresh_token, revocations, revoke_token
+from step_buffer import STEP_WRITE_BEHIND
+from user_search import SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT, user_search_index
+from DB_Interface import get_global_leaderboard, get_global_leaderboard_stats, get_global_rank, prewarm_qr, get_router_stats, check_voucher, voucher_filename, buffer_steps, step_buffer, get_step_buffer_stats, generate_qr, get_qr_cache_stats, iter_qr_zip, get_all_users, get_cache_stats, get_data_versions, get_search_index_stats, get_friend_graph_stats, check_friend_graph, get_dashboard, DASHBOARD_PARTS, iter_all_users, ADMIN_USER_COLUMNS, get_pool_stats, post_feedback_to_db, check_account, fetch_activities, fetch_transactions, get_longest_streak, get_pending_friend_requests, get_step_rollups, get_total_steps_for_user, get_total_steps_previous_day, get_user_credit_balance, get_user_monthly_steps, get_weekly_statistics, insert_activity_data, insert_transaction_data, leaderboard_data, list_friends, login_user, register_user, respond_friend_request, search_users_by_name, send_friend_request, search_users as search_users_admin, update_steps, update_steps_batch, update_user
 
 app = FastAPI()
 
-# Logging configuration
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+# Reachable without a session token when AUTH_MODE=required
+PUBLIC_PATHS = {"/", "/test", "/register", "/login", "/check-user", "/metrics"}
+PUBLIC_PREFIXES = ("/docs", "/openapi.json")
+# Used by the admin GUI, which has no user account: these need ADMIN_API_KEY instead
+ADMIN_PATHS = {"/generate-qr", "/generate-qr/batch"}
+ADMIN_PREFIXES = ("/admin/",)
+# Query parameter naming the acting user, where it is not "id"
+SESSION_USER_PARAMS = {"/send-request": "req_id", "/respond-request": None}
+
+if AUTH_MODE != "off" or ADMIN_API_KEY:
+    app.add_middleware(SessionMiddleware, public_paths=PUBLIC_PATHS, public_prefixes=PUBLIC_PREFIXES,
+                       user_params=SESSION_USER_PARAMS, admin_paths=ADMIN_PATHS, admin_prefixes=ADMIN_PREFIXES)
+# Added last so it is the outermost middleware and also times rejected requests
+app.add_middleware(metrics.MetricsMiddleware)
+
+metrics.register_gauges("db_pool", get_pool_stats)
+metrics.register_gauges("db_router", get_router_stats)
+for index, replica in enumerate(router.replicas):
+    metrics.register_gauges(f"db_replica{index}_pool", replica.stats)
+metrics.register_gauges("leaderboard_cache", lambda: get_cache_stats()["leaderboard"])
+metrics.register_gauges("user_search_index", get_search_index_stats)
+metrics.register_gauges("friend_graph", get_friend_graph_stats)
+metrics.register_gauges("qr_cache", get_qr_cache_stats)
+metrics.register_gauges("step_buffer", get_step_buffer_stats)
+metrics.register_gauges("session_revocations", revocations.stats)
+metrics.register_gauges("global_leaderboard", get_global_leaderboard_stats)
+
+# Logging goes through a background queue; see log_config for sampling and redaction
+setup_logging()
+logger = logging.getLogger("fitness.api")
+# High-frequency step sync events, sampled via LOG_SAMPLE_RATES
+steps_logger = logging.getLogger("fitness.steps")
+
+async def reconcile_ledger_periodically():
+    while True:
+        await asyncio.sleep(RECONCILE_INTERVAL)
+        try:
+            mismatches = await run_db(reconcile_balances)
+            logger.info("Ledger reconciliation finished: %s mismatched balance(s)", len(mismatches))
+        except Exception as e:
+            logger.error("Ledger reconciliation failed: %s", e)
+
+# Loaded before the worker takes traffic; everything else loads on first use.
+# Comma-separated names from PREWARM_STEPS, empty for the fastest boot.
+STARTUP_PREWARM = [name.strip() for name in os.getenv("STARTUP_PREWARM", "search_index,friend_graph,global_leaderboard").split(",") if name.strip()]
+
+PREWARM_STEPS = {
+    "search_index": user_search_index.load,
+    "friend_graph": friend_graph.load,
+    "global_leaderboard": global_leaderboard.load,   # from its snapshot when recent enough
+    "pool": router.prewarm,          # idle connections on the primary and replicas
+    "hashing": prewarm_hashing,      # bcrypt worker processes, for the first logins
+    "qr": prewarm_qr,                # qrcode / PIL imports, for the first voucher
+}
+
+@app.on_event("startup")
+async def startup():
+    # If the DB is not reachable yet, the indexes load on first use instead
+    for name in STARTUP_PREWARM:
+        step = PREWARM_STEPS.get(name)
+        if step is None:
+            logger.warning("Unknown STARTUP_PREWARM step %r; choose from %s", name, sorted(PREWARM_STEPS))
+            continue
+        try:
+            await run_db(step)
+        except Exception as e:
+            logger.warning("%s not prewarmed at startup: %s", name, e)
+    if RECONCILE_INTERVAL > 0:
+        app.state.reconcile_task = asyncio.create_task(reconcile_ledger_periodically())
+    if STEP_WRITE_BEHIND:
+        step_buffer.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    if getattr(app.state, "reconcile_task", None):
+        app.state.reconcile_task.cancel()
+    # Drain buffered step records while the pool is still open
+    step_buffer.stop()
+    global_leaderboard.save_snapshot()
+    shutdown_executor()
+    shutdown_hashing()
+    router.dispose()
+    shutdown_logging()
 
 @app.post("/", response_class=HTMLResponse)
 async def fastapi_home():
@@ -26,96 +129,197 @@ async def fastapi_home():
 async def register(request: Request):
     try:
         user_data = await request.json()
-        print("Received user data:", user_data)  # Debugging
-        register_user(user_data)
-        logging.info("Received user data : %s", user_data)  # Debugging
+        await run_db(register_user, user_data)
+        logger.info("User registered", extra={"username": user_data.get("username")})
         return {"message": "User registered successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
-        print("Error:", str(e))  # Debugging
-        logging.error("Received Error data : ", str(e))  # Debugging
+        logger.error("Registration failed: %s", e)
         raise HTTPException(status_code=400, detail=f"Bad request: {str(e)}")
 
 @app.post("/login")
 async def login(request: Request):
     user_data = await request.json()
-    response = login_user(user_data)
+    response = await run_db(login_user, user_data)
+    token, claims = issue_token(response)
+    response.update({"token": token, "token_type": "bearer", "expires_at": claims["exp"]})
     return response
 
+def current_session(request: Request):
+    session = getattr(request.state, "session", None)
+    if session is None:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    return session
+
+def check_session_user(request: Request, user_id):
+    # With a token, a request body may only act for the token's own user
+    session = getattr(request.state, "session", None)
+    if session is not None and str(user_id) != str(session["sub"]):
+        raise HTTPException(status_code=403, detail="Token does not belong to this user")
+
+@app.post("/refresh-token")
+async def refreshToken(request: Request):
+    token, claims = refresh_token(current_session(request))
+    return {"token": token, "token_type": "bearer", "expires_at": claims["exp"]}
+
+@app.post("/logout")
+async def logout(request: Request):
+    revoke_token(current_session(request))
+    return {"message": "Logged out"}
+
 @app.post("/update-steps")
 async def stepCount(request: Request):
     step_data = await request.json()
-    logging.info("%s, %s, %s, %s", step_data['user_id'], 
-            step_data['date'], 
-            step_data['steps'], 
-            step_data['midnight_step_count'])
-    update_steps(step_data)
-    logging.info("Updated step data: %s", step_data)  # Debugging
+    check_session_user(request, step_data.get("user_id"))
+    if STEP_WRITE_BEHIND:
+        # Only replaces the pending record for (user_id, date); written by step_buffer
+        buffer_steps(step_data)
+    else:
+        await run_db(update_steps, step_data)
+    steps_logger.info("Steps updated", extra={"user_id": step_data.get("user_id"), "date": step_data.get("date")})
     return {"status": "success", "message": "Steps updated successfully"}
 
+# Largest number of day records accepted by /update-steps/batch in one call
+MAX_STEP_BATCH = 5000
+
+@app.post("/update-steps/batch")
+async def stepCountBatch(request: Request):
+    body = await request.json()
+    records = body.get("records") if isinstance(body, dict) else body
+    if not isinstance(records, list) or not records:
+        raise HTTPException(status_code=400, detail="Expected a non-empty 'records' list.")
+    if len(records) > MAX_STEP_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_STEP_BATCH} records per batch.")
+    for record in records:
+        check_session_user(request, record.get("user_id") if isinstance(record, dict) else None)
+
+    results = await run_db(update_steps_batch, records)
+    failed = sum(1 for result in results if result["status"] != "ok")
+    steps_logger.info("Batch step update: %s records, %s failed", len(records), failed)
+    return {
+        "status": "success" if not failed else "partial",
+        "written": len(records) - failed,
+        "failed": failed,
+        "results": results,
+    }
+
 @app.get("/test")
 async def test():
-    logging.info("Test...")  # Debugging
     return {"Test": "Working"}
 
 @app.get("/weekly-steps")
-async def weeklySteps(id: int):
-    return get_weekly_statistics(id)
+async def weeklySteps(request: Request, response: Response, id: int):
+    cached = await not_modified(request, response, id, "steps")
+    if cached:
+        return cached
+    return await run_db(get_weekly_statistics, id)
 
 @app.post("/store-activity")
 async def register(request: Request):
     try:
         user_data = await request.json()
-        print("Received user data:", user_data)  # Debugging
-        insert_activity_data(user_data)
+        check_session_user(request, user_data.get("user_id"))
+        await run_db(insert_activity_data, user_data)
         return {"message": "Activity Noted successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
-        print("Error:", str(e))  # Debugging
+        logger.error("Storing activity failed: %s", e)
         raise HTTPException(status_code=400, detail=f"Bad request: {str(e)}")
 
+def set_next_cursor(response: Response, next_cursor):
+    # Pages keep the plain list body; the cursor for the next page travels in a header
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+# The app revalidates the statistics screens every time they open
+STATS_CACHE_CONTROL = "private, no-cache"
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+async def not_modified(request: Request, response: Response, user_id: int, kind, dated: bool = True):
+    """
+    ETag check for one user's `kind` data (see data_versions), or for a tuple of
+    kinds when a view combines them. Views relative to today also carry the
+    date, since they change at midnight without a write.
+    Returns a 304 response if the client's copy is current; otherwise sets the
+    ETag / Cache-Control headers on `response` and returns None.
+    """
+    versions = await run_db(get_data_versions, user_id)
+    kinds = (kind,) if isinstance(kind, str) else tuple(kind)
+    version = ".".join(str(versions[name]) for name in kinds)
+    etag = f'W/"{"+".join(kinds)}-{user_id}-{version}' + (f'-{date.today().isoformat()}' if dated else "") + '"'
+    headers = {"ETag": etag, "Cache-Control": STATS_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
 @app.get("/fetch-activities")
-async def getActivites(id: int):
-    logging.info("Get Activities for ID: %s", id)  # Debugging with proper formatting
-    return fetch_activities(id)
+async def getActivites(response: Response, id: int, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None):
+    logger.debug("Get Activities for ID: %s", id)
+    activities, next_cursor = await run_db(fetch_activities, id, limit, cursor)
+    set_next_cursor(response, next_cursor)
+    return activities
 
 @app.post("/update-user")
 async def update_profile_endpoint(request: Request):
     try:
         user_data = await request.json()
-        logging.info("Received profile data: ", user_data)  # Debugging
-        
-        result = update_user(user_data)
-        
+        check_session_user(request, user_data.get("user_id"))
+        result = await run_db(update_user, user_data)
         return result
-    
+
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error("Error:", str(e))  # Debugging
+        logger.error("Profile update failed: %s", e)
         raise HTTPException(status_code=400, detail=f"Bad request: {str(e)}")
 
 @app.get("/get-friends")
 async def friendList(id: int):
-    logging.info("Get Friends for ID: %s", id)  # Debugging with proper formatting
-    return list_friends(id)
+    logger.debug("Get Friends for ID: %s", id)
+    return await run_db(list_friends, id)
 
 @app.get("/send-request")
 async def sendRequest(req_id: int, rec_id: int):
-    return send_friend_request(req_id, rec_id)
+    return await run_db(send_friend_request, req_id, rec_id)
 
 @app.get("/respond-request")
-async def respondRequest(id: int, status: str):
-    return respond_friend_request(id, status)
+async def respondRequest(request: Request, id: int, status: str):
+    # id is the friendship, so the caller is checked against its recipient instead
+    session = getattr(request.state, "session", None)
+    return await run_db(respond_friend_request, id, status, session["sub"] if session else None)
 
 @app.get("/get-pending-requests")
 async def getPending(id: int):
-    return get_pending_friend_requests(id)
+    return await run_db(get_pending_friend_requests, id)
 
 @app.get("/get-leaderboard")
 async def leaderboardData(id: int):
-    return leaderboard_data(id)
+    return await run_db(leaderboard_data, id)
+
+@app.get("/global-leaderboard")
+async def globalLeaderboard(period: str = "weekly", limit: int = Query(10, ge=1, le=100), offset: int = Query(0, ge=0)):
+    return await run_db(get_global_leaderboard, period, limit, offset)
+
+@app.get("/global-leaderboard/rank")
+async def globalRank(id: int, period: str = "weekly", neighbours: int = Query(5, ge=0, le=50)):
+    return await run_db(get_global_rank, id, period, neighbours)
 
 @app.get("/users/search/")
-def search_users(name: str):
+async def search_users(name: str, id: Optional[int] = None, limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT)):
     try:
-        users = search_users_by_name(name)  # Call the function to search users by name
+        # id is the searching user: they and their friends are left out
+        users = await run_db(search_users_by_name, name, id, limit)
         return users
     except Exception as err:
         raise HTTPException(status_code=500, detail=f"Error searching users: {err}")
@@ -124,106 +328,200 @@ def search_users(name: str):
 async def checkAccount(request: Request):
     try:
         user_data = await request.json()
-        logging.info("Received profile data:", user_data)  # Debugging
-        result = check_account(user_data)
+        result = await run_db(check_account, user_data)
         return result
     
     except Exception as e:
-        logging.error("Error:", str(e))  # Debugging
+        logger.error("Account check failed: %s", e)
         raise HTTPException(status_code=400, detail=f"Bad request: {str(e)}")
 
+def monthly_steps_by_day(steps):
+    """{"1": steps, ..., "31": steps} for the current month, 0 for days without data."""
+    # Day numbers without the leading zero, to match the keys below
+    formatted_steps = {str(int(item["step_date"].split("-")[2])): item["total_steps"] for item in steps}
+
+    # Get the current year and month
+    now = datetime.now()
+
+    # Find the number of days in the current month
+    _, num_days = calendar.monthrange(now.year, now.month)
+
+    # Create a complete dictionary for the month
+    return {str(day): formatted_steps.get(str(day), 0) for day in range(1, num_days + 1)}
+
 @app.get("/monthly-steps")
-async def get_monthly_steps(id: int):
+async def get_monthly_steps(request: Request, response: Response, id: int):
     """
     Endpoint to fetch monthly steps for a specific user_id, formatted as { "day": "steps" }.
     """
     try:
-        # Fetch data from the database
-        steps = get_user_monthly_steps(id)
-
-        # Format the result into the desired format
-        formatted_steps = {item["step_date"].split("-")[2]: item["total_steps"] for item in steps}
-
-        # Ensure all days of the month are present with default 0 for missing days
-        from datetime import datetime
-        import calendar
+        cached = await not_modified(request, response, id, "steps")
+        if cached:
+            return cached
 
-        # Get the current year and month
-        now = datetime.now()
-        year = now.year
-        month = now.month
-
-        # Find the number of days in the current month
-        _, num_days = calendar.monthrange(year, month)
-
-        # Create a complete dictionary for the month
-        complete_steps = {str(day): formatted_steps.get(str(day), 0) for day in range(1, num_days + 1)}
-
-        return complete_steps
+        # Fetch data from the database
+        steps = await run_db(get_user_monthly_steps, id)
+        return monthly_steps_by_day(steps)
 
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail="An unexpected error occurred.")
 
+# data_versions kind behind each dashboard part; every other part derives from steps
+DASHBOARD_VERSION_KINDS = {"balance": "balance"}
+
+@app.get("/dashboard")
+async def dashboard(request: Request, response: Response, id: int, fields: Optional[str] = None):
+    """
+    Everything the home screen shows in one call, read on one DB connection.
+    `fields` is a comma separated subset of the DASHBOARD_PARTS keys.
+    """
+    selected = [field.strip() for field in fields.split(",") if field.strip()] if fields else list(DASHBOARD_PARTS)
+    unknown = [field for field in selected if field not in DASHBOARD_PARTS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields {unknown}; choose from {list(DASHBOARD_PARTS)}")
+
+    kinds = tuple(sorted({DASHBOARD_VERSION_KINDS.get(field, "steps") for field in selected}))
+    cached = await not_modified(request, response, id, kinds, dated="steps" in kinds)
+    if cached:
+        return cached
+
+    data = await run_db(get_dashboard, id, selected)
+    if data.get("monthly_steps") is not None:
+        data["monthly_steps"] = monthly_steps_by_day(data["monthly_steps"])
+    return data
+
 @app.get("/get-streaks")
-async def Streaks(id: int):
-    logging.info("Get Streaks for ID: %s", id)  # Debugging with proper formatting
-    return get_longest_streak(id)
+async def Streaks(request: Request, response: Response, id: int):
+    logger.debug("Get Streaks for ID: %s", id)
+    cached = await not_modified(request, response, id, "steps")
+    if cached:
+        return cached
+    return await run_db(get_longest_streak, id)
 
 @app.get("/get-total-steps")
-async def totalSteps(id: int):
-    logging.info("Get Total Steps for ID: %s", id)  # Debugging with proper formatting
-    return get_total_steps_for_user(id)
+async def totalSteps(request: Request, response: Response, id: int):
+    logger.debug("Get Total Steps for ID: %s", id)
+    cached = await not_modified(request, response, id, "steps", dated=False)
+    if cached:
+        return cached
+    return await run_db(get_total_steps_for_user, id)
+
+@app.get("/step-rollups")
+async def stepRollups(id: int):
+    return await run_db(get_step_rollups, id)
 
 @app.get("/get-total-sensor-steps")
 async def get_total_sensor_steps(id: int):
-    logging.info("Get Total Sensor Steps for ID: %s", id)  # Debugging with proper formatting
-    return get_total_steps_previous_day(id)
+    logger.debug("Get Total Sensor Steps for ID: %s", id)
+    return await run_db(get_total_steps_previous_day, id)
 
 @app.post("/feedback")
 async def post_feedback(request: Request):
     try:
         feedback = await request.json()
-        post_feedback_to_db(feedback)
+        check_session_user(request, feedback.get("user_id"))
+        await run_db(post_feedback_to_db, feedback)
 
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error("Error:", str(e))  # Debugging
+        logger.error("Storing feedback failed: %s", e)
         raise HTTPException(status_code=400, detail=f"Bad request: {str(e)}") 
 
 @app.post("/new-transaction")
 async def register(request: Request):
     try:
         user_data = await request.json()
-        print("Received user data:", user_data)  # Debugging
-        insert_transaction_data(user_data)
-        return {"message": "Transaction Noted successfully"}
+        check_session_user(request, user_data.get("user_id"))
+        balance = await run_db(insert_transaction_data, user_data)
+        return {"message": "Transaction Noted successfully", "credit_balance": balance}
+    except HTTPException:
+        raise
     except Exception as e:
-        print("Error:", str(e))  # Debugging
+        logger.error("Transaction failed: %s", e)
         raise HTTPException(status_code=400, detail=f"Bad request: {str(e)}")
     
 @app.get("/get-transaction")
-async def getTransaction(id: int):
-    logging.info("Get Transaction for ID: %s", id)  # Debugging with proper formatting
-    return fetch_transactions(id)
+async def getTransaction(response: Response, id: int, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None):
+    logger.debug("Get Transaction for ID: %s", id)
+    transactions, next_cursor = await run_db(fetch_transactions, id, limit, cursor)
+    set_next_cursor(response, next_cursor)
+    return transactions
 
 @app.get("/get-balance")
-async def getBalance(id: int):
-    logging.info("Get Balance for ID: %s", id)  # Debugging with proper formatting
-    return get_user_credit_balance(id)
+async def getBalance(request: Request, response: Response, id: int):
+    logger.debug("Get Balance for ID: %s", id)
+    cached = await not_modified(request, response, id, "balance", dated=False)
+    if cached:
+        return cached
+    return await run_db(get_user_credit_balance, id)
 
 @app.get("/admin/get-users")
-async def getUsers():
+async def getUsers(response: Response, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None):
     try:
-        users = get_all_users()  # Call the function to search users by name
+        users, next_cursor = await run_db(get_all_users, limit, cursor)
+        set_next_cursor(response, next_cursor)
         return users
+    except HTTPException:
+        raise
     except Exception as err:
         raise HTTPException(status_code=500, detail=f"Error searching users: {err}")
     
+def export_users_ndjson():
+    for rows in iter_all_users():
+        yield "".join(json.dumps(row, default=str) + "\n" for row in rows).encode()
+
+def export_users_csv():
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=ADMIN_USER_COLUMNS)
+    writer.writeheader()
+    for rows in iter_all_users():
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+@app.get("/admin/export-users")
+async def exportUsers(format: str = Query("ndjson", regex="^(ndjson|csv)$")):
+    # Streams the whole user table chunk by chunk instead of building one big list
+    if format == "csv":
+        return StreamingResponse(export_users_csv(), media_type="text/csv",
+                                 headers={"Content-Disposition": "attachment; filename=users.csv"})
+    return StreamingResponse(export_users_ndjson(), media_type="application/x-ndjson")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metricsEndpoint():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/pool-stats")
+async def poolStats():
+    return get_pool_stats()
+
+@app.get("/admin/cache-stats")
+async def cacheStats():
+    return get_cache_stats()
+
+@app.get("/admin/search-index-stats")
+async def searchIndexStats():
+    return get_search_index_stats()
+
+@app.get("/admin/friend-graph")
+async def friendGraphStats():
+    return get_friend_graph_stats()
+
+@app.get("/admin/friend-graph/check")
+async def friendGraphCheck(reload: bool = False):
+    return await run_db(check_friend_graph, reload)
+
 @app.get("/admin/search-users")
-async def admin_search_users(query: str):
+async def admin_search_users(query: str = Query(..., min_length=1)):
     try:
-        users = search_users(query)  # Call the function to search users by name
+        users = await run_db(search_users_admin, query)  # Call the function to search users by name
         return users
     except Exception as err:
         raise HTTPException(status_code=500, detail=f"Error searching users: {err}")
@@ -237,20 +535,53 @@ async def generate_qr_endpoint(request: Request):
 
         if not name or amount is None:
             raise ValueError("Missing 'name' or 'amount' in request body.")
+        check_voucher(name, amount)
 
-        # Save to unique filename
-        filename = f"{name}.png"
-        generate_qr(name, amount, filename)
+        # Rendered in memory (and cached), nothing is written to disk
+        png = await run_db(generate_qr, name, amount)
+        filename = voucher_filename(name)
 
-        return FileResponse(
-            path=filename,
-            filename=filename,
+        return Response(
+            content=png,
             media_type='image/png',
             headers={"Content-Disposition": f"attachment; filename={filename}"}
         )
 
     except Exception as e:
-        logging.error("QR Generation Error: %s", str(e))
+        logger.error("QR Generation Error: %s", str(e))
         raise HTTPException(status_code=400, detail=f"Bad request: {str(e)}")
- 
+
+# Most vouchers accepted by /generate-qr/batch in one call
+MAX_QR_BATCH = 500
+
+@app.post("/generate-qr/batch")
+async def generate_qr_batch_endpoint(request: Request):
+    body = await request.json()
+    vouchers = body.get("vouchers") if isinstance(body, dict) else body
+    if not isinstance(vouchers, list) or not vouchers:
+        raise HTTPException(status_code=400, detail="Expected a non-empty 'vouchers' list.")
+    if len(vouchers) > MAX_QR_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_QR_BATCH} vouchers per batch.")
+
+    # All checked before the stream starts: a bad voucher can't cut the ZIP off halfway
+    pairs = []
+    for index, voucher in enumerate(vouchers):
+        if not isinstance(voucher, dict):
+            raise HTTPException(status_code=400, detail=f"Voucher {index} needs a 'name' and a numeric 'amount'.")
+        try:
+            check_voucher(voucher.get("name"), voucher.get("amount"))
+        except ValueError as err:
+            raise HTTPException(status_code=400, detail=f"Voucher {index}: {err}")
+        pairs.append((voucher["name"], voucher["amount"]))
+
+    return StreamingResponse(
+        iter_qr_zip(pairs),
+        media_type="application/zip",
+        headers={"Content-Disposition": "attachment; filename=vouchers.zip"}
+    )
+
+@app.get("/admin/qr-cache-stats")
+async def qrCacheStats():
+    return get_qr_cache_stats()
+
 # Run the application with: uvicorn main:app --reload
\ No newline at end of file
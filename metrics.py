@@ -0,0 +1,266 @@
+"""
+Latency metrics in Prometheus text format.
+
+- MetricsMiddleware times every request, labelled by route template, method
+  and status.
+- instrument_db marks a DB_Interface function; while it runs, connections
+  from get_db_connection (wrapped in InstrumentedConnection) record
+  connection checkout, query execution and row fetch time separately,
+  labelled with that function's name.
+- register_gauges adds point-in-time values (pool, caches) to the output.
+
+render() produces the text served on /metrics.
+"""
+import bisect
+import contextvars
+import functools
+import threading
+import time
+
+
+# Seconds; covers cache hits up to slow aggregate queries
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Name of the instrumented DB function running in this thread / task
+current_db_function = contextvars.ContextVar("current_db_function", default="other")
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}   # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                labels = _label_text(self.labels + ("le",), label_values + (_number(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_text(self.labels + ("le",), label_values + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {values[-1]}")
+            labels = _label_text(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_number(values[-2])}")
+            lines.append(f"{self.name}_count{labels} {values[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_label_text(self.labels, label_values)} {_number(value)}")
+        return lines
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time to serve a request, including streaming the body.",
+    ("method", "route", "status"),
+)
+DB_CALL_SECONDS = Histogram(
+    "db_call_duration_seconds", "Total time spent in a DB_Interface function.", ("function", "outcome"),
+)
+DB_CHECKOUT_SECONDS = Histogram(
+    "db_checkout_duration_seconds", "Time waiting for a pooled connection.", ("function",),
+)
+DB_EXECUTE_SECONDS = Histogram(
+    "db_execute_duration_seconds", "Time in cursor.execute / executemany.", ("function",),
+)
+DB_FETCH_SECONDS = Histogram(
+    "db_fetch_duration_seconds", "Time in cursor.fetch*.", ("function",),
+)
+DB_QUERIES = Counter("db_queries_total", "Statements executed.", ("function",))
+
+METRICS = [HTTP_REQUEST_SECONDS, DB_CALL_SECONDS, DB_CHECKOUT_SECONDS, DB_EXECUTE_SECONDS,
+           DB_FETCH_SECONDS, DB_QUERIES]
+
+_gauge_sources = []   # (prefix, function returning a dict)
+
+
+def register_gauges(prefix, stats):
+    """Export every numeric value of stats() as a gauge named <prefix>_<key>."""
+    _gauge_sources.append((prefix, stats))
+
+
+def _collect_gauges():
+    lines = []
+    for prefix, stats in _gauge_sources:
+        try:
+            values = stats()
+        except Exception:
+            continue  # a broken source must not break the whole scrape
+        for key, value in sorted(values.items()):
+            if isinstance(value, bool):
+                value = int(value)
+            if not isinstance(value, (int, float)):
+                continue
+            name = f"{prefix}_{key}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_number(value)}")
+    return lines
+
+
+def render():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.collect())
+    lines.extend(_collect_gauges())
+    return "\n".join(lines) + "\n"
+
+
+def instrument_db(func):
+    """Time a DB_Interface function and label its checkout/execute/fetch timings with its name."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = current_db_function.set(name)
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = func(*args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            DB_CALL_SECONDS.observe(time.perf_counter() - started, name, outcome)
+            current_db_function.reset(token)
+    return wrapper
+
+
+def timed_checkout(connect):
+    started = time.perf_counter()
+    connection = connect()
+    DB_CHECKOUT_SECONDS.observe(time.perf_counter() - started, current_db_function.get())
+    return InstrumentedConnection(connection)
+
+
+class InstrumentedCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def _timed(self, histogram, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            histogram.observe(time.perf_counter() - started, current_db_function.get())
+
+    def execute(self, operation, params=None, multi=False):
+        DB_QUERIES.inc(current_db_function.get())
+        return self._timed(DB_EXECUTE_SECONDS, self._cursor.execute, operation, params, multi)
+
+    def executemany(self, operation, seq_params):
+        DB_QUERIES.inc(current_db_function.get())
+        return self._timed(DB_EXECUTE_SECONDS, self._cursor.executemany, operation, seq_params)
+
+    def fetchone(self):
+        return self._timed(DB_FETCH_SECONDS, self._cursor.fetchone)
+
+    def fetchmany(self, size=1):
+        return self._timed(DB_FETCH_SECONDS, self._cursor.fetchmany, size)
+
+    def fetchall(self):
+        return self._timed(DB_FETCH_SECONDS, self._cursor.fetchall)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    def __init__(self, connection):
+        self._connection = connection
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._connection.cursor(*args, **kwargs))
+
+    def close(self):
+        self._connection.close()
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording http_request_duration_seconds."""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def _route_template(self, scope):
+        # The router stores the matched endpoint in the scope; map it back to its path template
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._routes is None:
+            self._routes = {
+                route.endpoint: route.path
+                for route in scope["app"].routes if hasattr(route, "endpoint")
+            }
+        return self._routes.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started, scope["method"], self._route_template(scope), str(status)
+            )
@@ -0,0 +1,222 @@
+"""
+Versioned schema migrations.
+
+Each migration is applied once, in order, and recorded in schema_migrations.
+Index migrations check information_schema first, so they can also be run
+against databases whose tables were created by hand before this module existed.
+The migrations are MySQL only; the SQLite backends create their schema themselves.
+
+    python migrations.py status
+    python migrations.py upgrade
+"""
+import argparse
+
+import mysql.connector
+
+import data_versions
+import global_leaderboard
+import ledger
+import rollups
+import streaks
+from db_pool import pool
+
+
+BASE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        username VARCHAR(100) NOT NULL,
+        phone_number VARCHAR(20) NOT NULL,
+        email VARCHAR(255) NOT NULL,
+        DOB DATE,
+        height FLOAT,
+        weight FLOAT,
+        blood_group VARCHAR(5),
+        gender VARCHAR(20),
+        experience VARCHAR(50),
+        stepgoal INT,
+        caloriegoal INT,
+        password VARCHAR(255) NOT NULL,
+        credit_balance DECIMAL(12, 2) NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS steps (
+        user_id INT NOT NULL,
+        date DATE NOT NULL,
+        daily_step_count INT NOT NULL DEFAULT 0,
+        midnight_step_count INT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, date)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS activities (
+        activity_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        activity VARCHAR(100) NOT NULL,
+        duration INT,
+        user_id INT NOT NULL,
+        activity_date DATETIME NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS friendships (
+        friend_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        requester_id INT NOT NULL,
+        recipient_id INT NOT NULL,
+        status VARCHAR(20) NOT NULL DEFAULT 'pending'
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS transactions (
+        transaction_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        transaction_type VARCHAR(20) NOT NULL,
+        activity_type VARCHAR(50),
+        amount DECIMAL(12, 2) NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS feedback (
+        feedback_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        description TEXT,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+]
+
+# (table, index name, columns, unique) for the access paths DB_Interface relies on
+QUERY_INDEXES = [
+    # login_user, check_account
+    ("users", "idx_users_phone_number", "phone_number", False),
+    ("users", "idx_users_email", "email", False),
+    # update_steps upserts and every per-user date range read
+    ("steps", "uq_steps_user_date", "user_id, date", True),
+    # fetch_activities keyset pages
+    ("activities", "idx_activities_user_date", "user_id, activity_date, activity_id", False),
+    # pending requests for a recipient, friendships by either side, one row per direction
+    ("friendships", "idx_friendships_recipient_status", "recipient_id, status", False),
+    ("friendships", "idx_friendships_requester_status", "requester_id, status", False),
+    ("friendships", "uq_friendships_pair", "requester_id, recipient_id", True),
+    # fetch_transactions keyset pages and the ledger reconciliation
+    ("transactions", "idx_transactions_user_created", "user_id, created_at, transaction_id", False),
+]
+
+
+def _run_all(statements):
+    def run(cursor):
+        for statement in statements:
+            cursor.execute(statement)
+    return run
+
+
+def index_exists(cursor, table, columns):
+    """True if `table` already has an index starting with exactly these columns."""
+    cursor.execute("""
+        SELECT index_name, GROUP_CONCAT(column_name ORDER BY seq_in_index) AS columns
+        FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s
+        GROUP BY index_name
+    """, (table,))
+    wanted = ",".join(column.strip() for column in columns.split(","))
+    return any(row[1] == wanted for row in cursor.fetchall())
+
+
+def _create_indexes(indexes):
+    def create(cursor):
+        for table, name, columns, unique in indexes:
+            if index_exists(cursor, table, columns):
+                continue
+            cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({columns})")
+    return create
+
+
+_create_query_indexes = _create_indexes(QUERY_INDEXES)
+
+
+# (version, description, function(cursor)); append only, never edit an applied entry
+MIGRATIONS = [
+    (1, "base tables", _run_all(BASE_TABLES)),
+    (2, "indexes for DB_Interface query patterns", _create_query_indexes),
+    (3, "step rollup tables", _run_all(rollups.ROLLUP_TABLES)),
+    (4, "streak tables", _run_all(streaks.STREAK_TABLES)),
+    (5, "per-user data versions for ETags", _run_all(data_versions.VERSION_TABLES)),
+    (6, "indexes for the global leaderboard loads", _create_indexes(global_leaderboard.LEADERBOARD_INDEXES)),
+    (7, "credit balances from the transaction ledger", ledger.backfill_balances),
+]
+
+
+def _ensure_version_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT NOT NULL PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def applied_versions(cursor):
+    _ensure_version_table(cursor)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def upgrade(connection=None):
+    """Apply every pending migration. Returns the versions that were applied."""
+    if pool.dialect != "mysql":
+        return []
+    own_connection = connection is None
+    connection = connection or pool.connect()
+    cursor = connection.cursor()
+    applied = []
+
+    try:
+        done = applied_versions(cursor)
+        for version, description, migrate in MIGRATIONS:
+            if version in done:
+                continue
+            # MySQL commits DDL implicitly, so each migration is recorded right after it ran
+            migrate(cursor)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                (version, description)
+            )
+            connection.commit()
+            applied.append(version)
+    except mysql.connector.Error:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+        if own_connection:
+            connection.close()
+    return applied
+
+
+def status():
+    if pool.dialect != "mysql":
+        return [(version, description, True) for version, description, _ in MIGRATIONS]
+    connection = pool.connect()
+    cursor = connection.cursor()
+    try:
+        done = applied_versions(cursor)
+        return [(version, description, version in done) for version, description, _ in MIGRATIONS]
+    finally:
+        cursor.close()
+        connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Database schema migrations")
+    parser.add_argument("command", choices=["status", "upgrade"])
+    args = parser.parse_args()
+
+    if args.command == "upgrade":
+        applied = upgrade()
+        print("Applied migrations:", applied or "none, schema is up to date")
+    else:
+        for version, description, done in status():
+            print(f"{version:>4}  {'applied' if done else 'pending':<8} {description}")
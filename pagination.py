@@ -0,0 +1,56 @@
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Response header carrying the token for the next page; absent on the last page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(values):
+    """Opaque token for the sort key of the last row on a page."""
+    raw = json.dumps([str(value) if not isinstance(value, (int, float)) else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _coerce(value, kind):
+    if kind is int:
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise TypeError(f"expected an integer, got {value!r}")
+        return value
+    if kind is datetime:
+        return datetime.fromisoformat(value)
+    raise TypeError(f"unsupported cursor type {kind!r}")
+
+
+def decode_cursor(token, types):
+    """
+    Sort key values from a cursor made by encode_cursor, converted to `types`
+    (int or datetime, one per value). Raises a 400 for anything else.
+    """
+    if token is None:
+        return None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError("wrong number of values")
+        return [_coerce(value, kind) for value, kind in zip(values, types)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def paginate(rows, limit, key):
+    """
+    Split the limit + 1 rows fetched by a keyset query into the page and the
+    cursor for the next one (None when this is the last page).
+    """
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    return page, encode_cursor(key(page[-1]))
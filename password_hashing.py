@@ -0,0 +1,96 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+# bcrypt cost factor. Hashes below it are upgraded the next time the user logs in.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Worker processes doing bcrypt work, and how many hash/verify calls may wait for them
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(HASH_WORKERS * 8)))
+HASH_QUEUE_TIMEOUT = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", "5"))
+
+_pwd_context = None
+_executor = None
+_executor_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(HASH_MAX_PENDING)
+
+
+def _context():
+    # Hashing only happens in the worker processes, so passlib is imported there, on first use
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=BCRYPT_ROUNDS,
+            bcrypt__min_rounds=BCRYPT_ROUNDS,
+        )
+    return _pwd_context
+
+
+def _hash(password):
+    return _context().hash(password)
+
+
+def _verify_and_update(plain_password, hashed_password):
+    return _context().verify_and_update(plain_password, hashed_password)
+
+
+def _warm(_=None):
+    _context()
+    return os.getpid()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # spawn, not fork: the server process already runs threads
+                _executor = ProcessPoolExecutor(
+                    max_workers=HASH_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _executor
+
+
+def _run(func, *args):
+    # Imported here: the hashing workers import this module too and never need FastAPI
+    from fastapi import HTTPException
+    if not _pending.acquire(timeout=HASH_QUEUE_TIMEOUT):
+        raise HTTPException(status_code=503, detail="Server busy, please try again.")
+    try:
+        return _get_executor().submit(func, *args).result()
+    finally:
+        _pending.release()
+
+
+def hash_password(password: str):
+    return _run(_hash, password)
+
+
+def verify_and_update_password(plain_password, hashed_password):
+    """
+    Returns (valid, new_hash). new_hash is only set when the stored hash was
+    made with outdated parameters and should be replaced.
+    """
+    return _run(_verify_and_update, plain_password, hashed_password)
+
+
+def verify_password(plain_password, hashed_password):
+    return verify_and_update_password(plain_password, hashed_password)[0]
+
+
+def prewarm_hashing():
+    """Start every hashing worker and load passlib in it, so the first logins skip that."""
+    executor = _get_executor()
+    # Each call keeps a worker busy for a moment, so the pool starts all of them
+    list(executor.map(_warm, range(HASH_WORKERS)))
+
+
+def shutdown_hashing():
+    if _executor is not None:
+        _executor.shutdown(wait=True)
@@ -0,0 +1,172 @@
+"""
+Pre-aggregated step totals per user: weekly (Monday based), monthly and lifetime.
+
+update_steps / update_steps_batch keep them current by applying the change in
+daily_step_count inside the same transaction as the steps upsert. The tables
+are created by migrations.py; existing data has to be loaded once with:
+
+    python rollups.py rebuild [--user-id ID]
+"""
+import argparse
+from collections import defaultdict
+from datetime import timedelta
+
+import data_versions
+from db_pool import pool
+
+
+ROLLUP_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS step_rollups_weekly (
+        user_id INT NOT NULL,
+        week_start DATE NOT NULL,
+        total_steps BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, week_start)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS step_rollups_monthly (
+        user_id INT NOT NULL,
+        month_start DATE NOT NULL,
+        total_steps BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, month_start)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS step_totals (
+        user_id INT NOT NULL PRIMARY KEY,
+        total_steps BIGINT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    )
+    """,
+]
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def lock_current_steps(cursor, rows):
+    """
+    Read (and row-lock) the stored daily_step_count for the (user_id, date)
+    keys about to be upserted. Returns {(user_id, date): steps}.
+
+    For keys with no row yet MySQL takes gap locks, so two transactions doing a
+    first write of the same day can deadlock; the step writers retry on that.
+    """
+    keys = list({(row[0], row[1]) for row in rows})
+    if not keys:
+        return {}
+    placeholders = ", ".join(["(%s, %s)"] * len(keys))
+    cursor.execute(f"""
+        SELECT user_id, date, daily_step_count
+        FROM steps
+        WHERE (user_id, date) IN ({placeholders})
+        FOR UPDATE
+    """, [value for key in keys for value in key])
+    return {(user_id, day): steps or 0 for user_id, day, steps in cursor.fetchall()}
+
+
+def step_deltas(rows, previous):
+    """
+    Net change in daily_step_count per (user_id, date) once `rows` are applied
+    in order on top of `previous`. Later rows for the same key win, like the upsert.
+    """
+    current = dict(previous)
+    deltas = defaultdict(int)
+    for user_id, day, steps, _ in rows:
+        key = (user_id, day)
+        deltas[key] += steps - current.get(key, 0)
+        current[key] = steps
+    return {key: delta for key, delta in deltas.items() if delta}
+
+
+def apply_step_deltas(cursor, deltas):
+    weekly = defaultdict(int)
+    monthly = defaultdict(int)
+    totals = defaultdict(int)
+    for (user_id, day), delta in deltas.items():
+        weekly[(user_id, week_start(day))] += delta
+        monthly[(user_id, month_start(day))] += delta
+        totals[user_id] += delta
+
+    _add_totals(cursor, "step_rollups_weekly", "user_id, week_start", weekly)
+    _add_totals(cursor, "step_rollups_monthly", "user_id, month_start", monthly)
+    _add_totals(cursor, "step_totals", "user_id", {(user_id,): delta for user_id, delta in totals.items()})
+
+
+# week_start / month_start of steps.date in SQL, per backend (pool.dialect)
+PERIOD_START_SQL = {
+    "mysql": {
+        "week": "DATE_SUB(date, INTERVAL WEEKDAY(date) DAY)",
+        "month": "DATE_SUB(date, INTERVAL DAYOFMONTH(date) - 1 DAY)",
+    },
+    "sqlite": {
+        # %w is 0 for Sunday; Monday based like week_start
+        "week": "date(date, '-' || ((strftime('%w', date) + 6) % 7) || ' days')",
+        "month": "date(date, 'start of month')",
+    },
+}
+
+
+def _add_totals(cursor, table, key_columns, deltas):
+    deltas = [key + (delta,) for key, delta in deltas.items() if delta]
+    if not deltas:
+        return
+    row_placeholder = "(" + ", ".join(["%s"] * len(deltas[0])) + ")"
+    cursor.execute(f"""
+        INSERT INTO {table} ({key_columns}, total_steps)
+        VALUES {", ".join([row_placeholder] * len(deltas))}
+        ON DUPLICATE KEY UPDATE total_steps = total_steps + VALUES(total_steps)
+    """, [value for row in deltas for value in row])
+
+
+def rebuild(user_id=None):
+    """Recompute every rollup (or one user's) from the raw steps table."""
+    connection = pool.connect()
+    cursor = connection.cursor()
+    where = "WHERE user_id = %s" if user_id is not None else ""
+    params = (user_id,) if user_id is not None else ()
+
+    try:
+        for table in ("step_rollups_weekly", "step_rollups_monthly", "step_totals"):
+            cursor.execute(f"DELETE FROM {table} {where}", params)
+
+        # Aggregated by the database, so a full rebuild never pulls `steps` into Python
+        bucket = PERIOD_START_SQL[pool.dialect]
+        for table, column, period in (("step_rollups_weekly", "week_start", "week"),
+                                      ("step_rollups_monthly", "month_start", "month")):
+            cursor.execute(f"""
+                INSERT INTO {table} (user_id, {column}, total_steps)
+                SELECT user_id, {bucket[period]}, SUM(daily_step_count)
+                FROM steps {where}
+                GROUP BY user_id, {bucket[period]}
+            """, params)
+        cursor.execute(f"""
+            INSERT INTO step_totals (user_id, total_steps)
+            SELECT user_id, SUM(daily_step_count)
+            FROM steps {where}
+            GROUP BY user_id
+        """, params)
+        data_versions.bump_all(cursor, "steps", user_id)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+        connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the step rollup tables")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--user-id", type=int)
+    args = parser.parse_args()
+
+    rebuild(args.user_id)
+    print("Rollups rebuilt", f"for user {args.user_id}" if args.user_id is not None else "for all users")
@@ -0,0 +1,97 @@
+"""
+Synthetic data for scratch databases used by the EXPLAIN check and the load
+benchmark. Never point it at the production database.
+
+Seeded users are user0..userN with phone number 9000000000 + i and the
+password SEED_PASSWORD, so benchmarks can log in as any of them.
+"""
+import random
+import sys
+from datetime import date, datetime, timedelta
+
+import mysql.connector
+
+import db_pool
+import rollups
+import streaks
+from password_hashing import hash_password
+
+
+SEED_PASSWORD = "password"
+SEED_DAYS = 60
+
+
+def seed_phone_number(index):
+    return f"9{index:09d}"
+
+
+def create_database():
+    if db_pool.pool.dialect != "mysql":
+        return  # SQLite creates the file / in-memory database on first connect
+    config = dict(db_pool.DB_CONFIG)
+    name = config.pop("database")
+    if name == "fitness":
+        sys.exit("Refusing to seed the 'fitness' database; set DB_NAME to a scratch database.")
+    connection = mysql.connector.connect(**config)
+    cursor = connection.cursor()
+    cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{name}`")
+    cursor.close()
+    connection.close()
+
+
+def seed(users):
+    """Seed `users` users (if not already there). Returns the seeded user_ids."""
+    connection = db_pool.pool.connect()
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT MIN(user_id), COUNT(*) FROM users")
+        first, count = cursor.fetchone()
+        if count >= users:
+            return list(range(first, first + users))
+
+        rng = random.Random(7)
+        today = date.today()
+        # One hash for everyone, bcrypt per user would dominate the seeding time
+        password = hash_password(SEED_PASSWORD)
+        cursor.executemany(
+            """INSERT INTO users (username, phone_number, email, DOB, height, weight, blood_group, gender,
+                                  experience, stepgoal, caloriegoal, password)
+               VALUES (%s, %s, %s, '1995-01-01', 170, 70, 'O+', 'male', 'beginner', 8000, 2000, %s)""",
+            [(f"user{i}", seed_phone_number(i), f"user{i}@example.com", password) for i in range(count, users)]
+        )
+        cursor.execute("SELECT MIN(user_id) FROM users")
+        first = cursor.fetchone()[0]
+        ids = list(range(first, first + users))
+
+        for user_id in ids[count:]:
+            cursor.executemany(
+                "INSERT IGNORE INTO steps (user_id, date, daily_step_count, midnight_step_count) VALUES (%s, %s, %s, %s)",
+                [(user_id, today - timedelta(days=d), rng.randint(0, 15000), rng.randint(0, 15000)) for d in range(SEED_DAYS)]
+            )
+            cursor.executemany(
+                "INSERT INTO activities (activity, duration, user_id, activity_date) VALUES (%s, %s, %s, %s)",
+                [("walk", 30, user_id, datetime.now() - timedelta(days=d)) for d in range(10)]
+            )
+            cursor.executemany(
+                "INSERT INTO transactions (user_id, transaction_type, activity_type, amount) VALUES (%s, 'earn', 'steps', 5)",
+                [(user_id,) for _ in range(10)]
+            )
+            cursor.execute("UPDATE users SET credit_balance = 50 WHERE user_id = %s", (user_id,))
+            friends = rng.sample(ids, 5)
+            cursor.executemany(
+                "INSERT IGNORE INTO friendships (requester_id, recipient_id, status) VALUES (%s, %s, %s)",
+                [(user_id, friend, rng.choice(["accepted", "pending"])) for friend in friends if friend != user_id]
+            )
+        connection.commit()
+
+        for table in ("users", "steps", "activities", "transactions", "friendships"):
+            cursor.execute(f"ANALYZE TABLE {table}")
+            cursor.fetchall()
+    finally:
+        cursor.close()
+        connection.close()
+
+    # Derived tables are filled by their own full rebuilds
+    rollups.rebuild()
+    streaks.rebuild()
+    return ids
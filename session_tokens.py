@@ -0,0 +1,243 @@
+"""
+Signed, expiring session tokens issued by /login.
+
+A token is base64url(JSON claims) + "." + base64url(HMAC-SHA256 of that part)
+keyed with SESSION_SECRET. The claims carry the user_id ("sub"), a few profile
+fields, the expiry ("exp") and a token id ("jti"). Verifying one is an HMAC
+check plus a lookup in the in-memory revocation cache, without a DB round trip.
+
+SessionMiddleware reads "Authorization: Bearer <token>" and puts the claims on
+request.state.session. With AUTH_MODE:
+    off       - no middleware, requests are trusted as before
+    optional  - (default) tokens are checked when sent; requests without one still pass
+    required  - every path outside the public ones needs a valid token
+A request with a token may only name its own user in the user query parameter,
+and may name it only once.
+
+The admin endpoints (the admin GUI's user export, stats and QR vouchers) are
+not covered by user tokens. They need "X-Admin-Key: <ADMIN_API_KEY>" whenever
+ADMIN_API_KEY is set, and are closed entirely under AUTH_MODE=required
+without it. A valid admin key is accepted on every path, without a user.
+
+Revocations (/logout, /refresh-token) are kept per process until the token
+would have expired anyway. With several workers, a revoked token stays valid
+on the other workers until its expiry, so keep SESSION_TOKEN_TTL short.
+Without SESSION_SECRET a random secret is generated, so tokens do not survive
+a restart or work across workers. Set it in production.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from urllib.parse import parse_qs
+
+from starlette.responses import JSONResponse
+
+
+AUTH_MODE = os.getenv("AUTH_MODE", "optional")
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY", "")
+SESSION_TOKEN_TTL = int(os.getenv("SESSION_TOKEN_TTL", "3600"))
+SESSION_REVOCATION_CACHE_SIZE = int(os.getenv("SESSION_REVOCATION_CACHE_SIZE", "100000"))
+
+logger = logging.getLogger("fitness.api")
+
+_secret = os.getenv("SESSION_SECRET")
+if not _secret:
+    _secret = secrets.token_urlsafe(32)
+    if AUTH_MODE != "off":
+        logger.warning("SESSION_SECRET is not set; session tokens only work in this process until it restarts")
+SESSION_SECRET = _secret.encode()
+if AUTH_MODE == "required" and not ADMIN_API_KEY:
+    logger.warning("ADMIN_API_KEY is not set; the admin endpoints are closed with AUTH_MODE=required")
+
+# Profile fields copied into the token at login
+PROFILE_CLAIMS = ("username", "experience", "stepgoal", "caloriegoal")
+
+
+class TokenError(ValueError):
+    """The token is malformed, forged, expired or revoked."""
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload):
+    return hmac.new(SESSION_SECRET, payload.encode(), hashlib.sha256).digest()
+
+
+class RevocationCache:
+    """Revoked token ids, each kept until its token would have expired anyway."""
+
+    def __init__(self, maxsize=SESSION_REVOCATION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._revoked = {}   # jti -> exp
+        self._lock = threading.Lock()
+
+    def revoke(self, jti, exp):
+        now = time.time()
+        with self._lock:
+            self._revoked[jti] = exp
+            if len(self._revoked) > self.maxsize:
+                self._revoked = {key: until for key, until in self._revoked.items() if until > now}
+            while len(self._revoked) > self.maxsize:
+                # Still full of live entries: drop the ones expiring first
+                del self._revoked[min(self._revoked, key=self._revoked.get)]
+
+    def is_revoked(self, jti):
+        return jti in self._revoked
+
+    def stats(self):
+        return {"revoked": len(self._revoked), "maxsize": self.maxsize}
+
+
+revocations = RevocationCache()
+
+
+def issue_token(profile, ttl=SESSION_TOKEN_TTL):
+    """Returns (token, claims) for a user profile as returned by login_user."""
+    now = int(time.time())
+    claims = {"sub": int(profile["user_id"]), "iat": now, "exp": now + ttl, "jti": secrets.token_urlsafe(12)}
+    claims.update({name: profile.get(name) for name in PROFILE_CLAIMS})
+    payload = _b64encode(json.dumps(claims, separators=(",", ":"), default=str).encode())
+    return f"{payload}.{_b64encode(_sign(payload))}", claims
+
+
+def verify_token(token):
+    """The token's claims; raises TokenError if it is not valid right now."""
+    try:
+        payload, signature = token.split(".")
+        valid = hmac.compare_digest(_b64decode(signature), _sign(payload))
+    except (ValueError, TypeError):
+        raise TokenError("Malformed token")
+    if not valid:
+        raise TokenError("Invalid token signature")
+    try:
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        raise TokenError("Malformed token")
+    if claims["exp"] <= time.time():
+        raise TokenError("Token expired")
+    if revocations.is_revoked(claims["jti"]):
+        raise TokenError("Token revoked")
+    return claims
+
+
+def revoke_token(claims):
+    revocations.revoke(claims["jti"], claims["exp"])
+
+
+def refresh_token(claims):
+    """A new token with the same claims and a fresh expiry; the old one is revoked."""
+    profile = {name: claims.get(name) for name in PROFILE_CLAIMS}
+    profile["user_id"] = claims["sub"]
+    revoke_token(claims)
+    return issue_token(profile)
+
+
+def bearer_token(scope):
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token.strip():
+                return token.strip()
+    return None
+
+
+def has_admin_key(scope, admin_key):
+    if not admin_key:
+        return False
+    for name, value in scope["headers"]:
+        if name == b"x-admin-key":
+            return hmac.compare_digest(value, admin_key.encode())
+    return False
+
+
+class SessionMiddleware:
+    """
+    ASGI middleware verifying bearer tokens (see the module docstring).
+
+    public_paths never need a token; public_prefixes likewise. admin_paths and
+    admin_prefixes need admin_key instead of a token. user_params maps a path
+    to the query parameter naming the acting user ("id" when not listed, None
+    for paths whose id is something else). With mode "off" only the admin
+    paths are checked.
+    """
+
+    def __init__(self, app, mode=AUTH_MODE, public_paths=(), public_prefixes=(), user_params=None,
+                 admin_paths=(), admin_prefixes=(), admin_key=ADMIN_API_KEY):
+        self.app = app
+        self.mode = mode
+        self.public_paths = set(public_paths)
+        self.public_prefixes = tuple(public_prefixes)
+        self.user_params = user_params or {}
+        self.admin_paths = set(admin_paths)
+        self.admin_prefixes = tuple(admin_prefixes)
+        self.admin_key = admin_key
+
+    async def _reject(self, scope, receive, send, status, detail):
+        response = JSONResponse({"detail": detail}, status_code=status,
+                                headers={"WWW-Authenticate": "Bearer"} if status == 401 else None)
+        await response(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        if has_admin_key(scope, self.admin_key):
+            scope.setdefault("state", {})["admin"] = True
+            await self.app(scope, receive, send)
+            return
+        if path in self.admin_paths or path.startswith(self.admin_prefixes):
+            if self.admin_key or self.mode == "required":
+                await self._reject(scope, receive, send, 401, "Admin key required")
+                return
+            await self.app(scope, receive, send)
+            return
+        if self.mode == "off":
+            await self.app(scope, receive, send)
+            return
+
+        public = path in self.public_paths or path.startswith(self.public_prefixes)
+        token = bearer_token(scope)
+        if token is None:
+            if self.mode == "required" and not public:
+                await self._reject(scope, receive, send, 401, "Not authenticated")
+                return
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            claims = verify_token(token)
+        except TokenError as err:
+            if public:
+                # e.g. an expired token still sent along with /login
+                await self.app(scope, receive, send)
+                return
+            await self._reject(scope, receive, send, 401, str(err))
+            return
+
+        param = self.user_params.get(path, "id")
+        if param:
+            # Parsed like Starlette does; FastAPI binds the last value of a repeated parameter
+            values = parse_qs(scope["query_string"].decode("latin-1"), keep_blank_values=True).get(param, [])
+            if len(values) > 1:
+                await self._reject(scope, receive, send, 400, f"Query parameter {param!r} given more than once")
+                return
+            if values and values[0] != str(claims["sub"]):
+                await self._reject(scope, receive, send, 403, "Token does not belong to this user")
+                return
+
+        scope.setdefault("state", {})["session"] = claims
+        await self.app(scope, receive, send)
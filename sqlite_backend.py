@@ -0,0 +1,335 @@
+"""
+SQLite storage backend, selected with DB_BACKEND=sqlite (a file, DB_SQLITE_PATH)
+or DB_BACKEND=memory (a private in-memory database).
+
+It stands in for db_pool.ConnectionPool: connect() hands out a connection
+object with the subset of the mysql.connector API the app uses (dictionary
+cursors, lastrowid, rowcount, commit/rollback, savepoints), so DB_Interface
+runs unchanged and endpoints, benchmarks and profiling work without a MySQL
+server. The few MySQL-only statements the app sends are rewritten by
+translate(); errors are re-raised as mysql.connector errors so the existing
+`except mysql.connector.Error` handling applies.
+
+SQLite has one writer at a time, so the backend keeps a single connection and
+lends it to one caller at a time.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+
+import mysql.connector.errors
+
+from db_pool import POOL_MAX_OVERFLOW, POOL_SIZE, POOL_TIMEOUT, PoolTimeout
+
+
+SQLITE_PATH = os.getenv("DB_SQLITE_PATH", "fitness.sqlite3")
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    phone_number TEXT NOT NULL,
+    email TEXT NOT NULL,
+    DOB DATE,
+    height FLOAT,
+    weight FLOAT,
+    blood_group TEXT,
+    gender TEXT,
+    experience TEXT,
+    stepgoal INT,
+    caloriegoal INT,
+    password TEXT NOT NULL,
+    credit_balance DECIMAL(12, 2) NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_users_phone_number ON users (phone_number);
+CREATE INDEX IF NOT EXISTS idx_users_email ON users (email);
+
+CREATE TABLE IF NOT EXISTS steps (
+    user_id INT NOT NULL,
+    date DATE NOT NULL,
+    daily_step_count INT NOT NULL DEFAULT 0,
+    midnight_step_count INT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, date)
+);
+CREATE INDEX IF NOT EXISTS idx_steps_date_count ON steps (date, daily_step_count);
+
+CREATE TABLE IF NOT EXISTS activities (
+    activity_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    activity TEXT NOT NULL,
+    duration INT,
+    user_id INT NOT NULL,
+    activity_date DATETIME NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_activities_user_date ON activities (user_id, activity_date, activity_id);
+
+CREATE TABLE IF NOT EXISTS friendships (
+    friend_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    requester_id INT NOT NULL,
+    recipient_id INT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending'
+);
+CREATE INDEX IF NOT EXISTS idx_friendships_recipient_status ON friendships (recipient_id, status);
+CREATE INDEX IF NOT EXISTS idx_friendships_requester_status ON friendships (requester_id, status);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_friendships_pair ON friendships (requester_id, recipient_id);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INT NOT NULL,
+    transaction_type TEXT NOT NULL,
+    activity_type TEXT,
+    amount DECIMAL(12, 2) NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_user_created ON transactions (user_id, created_at, transaction_id);
+
+CREATE TABLE IF NOT EXISTS feedback (
+    feedback_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INT NOT NULL,
+    description TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS step_rollups_weekly (
+    user_id INT NOT NULL,
+    week_start DATE NOT NULL,
+    total_steps BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, week_start)
+);
+CREATE INDEX IF NOT EXISTS idx_rollups_weekly_start ON step_rollups_weekly (week_start, total_steps);
+CREATE TABLE IF NOT EXISTS step_rollups_monthly (
+    user_id INT NOT NULL,
+    month_start DATE NOT NULL,
+    total_steps BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, month_start)
+);
+CREATE INDEX IF NOT EXISTS idx_rollups_monthly_start ON step_rollups_monthly (month_start, total_steps);
+CREATE TABLE IF NOT EXISTS step_totals (
+    user_id INT NOT NULL PRIMARY KEY,
+    total_steps BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS streak_runs (
+    user_id INT NOT NULL,
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL,
+    PRIMARY KEY (user_id, start_date)
+);
+CREATE INDEX IF NOT EXISTS idx_streak_runs_end ON streak_runs (user_id, end_date);
+CREATE TABLE IF NOT EXISTS user_streaks (
+    user_id INT NOT NULL PRIMARY KEY,
+    longest_streak INT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS user_data_versions (
+    user_id INT NOT NULL PRIMARY KEY,
+    steps_version BIGINT NOT NULL DEFAULT 0,
+    balance_version BIGINT NOT NULL DEFAULT 0
+);
+"""
+
+# Values come back as the same Python types mysql.connector returns
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_converter("DATE", lambda raw: date.fromisoformat(raw.decode()))
+sqlite3.register_converter("DATETIME", lambda raw: datetime.fromisoformat(raw.decode()))
+sqlite3.register_converter("TIMESTAMP", lambda raw: datetime.fromisoformat(raw.decode()))
+sqlite3.register_converter("DECIMAL", lambda raw: Decimal(raw.decode()))
+
+
+@lru_cache(maxsize=1024)
+def translate(sql):
+    """Rewrite the MySQL-specific bits of a statement for SQLite."""
+    sql = sql.replace("%s", "?")
+    sql = re.sub(r"\bFOR UPDATE\b", "", sql)
+    sql = re.sub(r"\bINSERT IGNORE\b", "INSERT OR IGNORE", sql)
+    sql = re.sub(r"\bANALYZE TABLE\b", "ANALYZE", sql)
+    head, found, tail = sql.partition("ON DUPLICATE KEY UPDATE")
+    if found:
+        sql = head + "ON CONFLICT DO UPDATE SET" + re.sub(r"\bVALUES\((\w+)\)", r"excluded.\1", tail)
+    return sql
+
+
+def _mysql_error(err):
+    if isinstance(err, sqlite3.IntegrityError):
+        return mysql.connector.errors.IntegrityError(msg=str(err))
+    if isinstance(err, sqlite3.OperationalError):
+        return mysql.connector.errors.OperationalError(msg=str(err))
+    return mysql.connector.errors.DatabaseError(msg=str(err))
+
+
+class SQLiteCursor:
+    def __init__(self, connection, dictionary=False):
+        self._connection = connection
+        self._cursor = connection._raw.cursor()
+        self._dictionary = dictionary
+
+    def _run(self, method, operation, params):
+        self._connection._begin()
+        try:
+            method(translate(operation), params)
+        except sqlite3.Error as err:
+            raise _mysql_error(err) from err
+
+    def execute(self, operation, params=(), multi=False):
+        self._run(self._cursor.execute, operation, tuple(params or ()))
+
+    def executemany(self, operation, seq_params):
+        self._run(self._cursor.executemany, operation, [tuple(params) for params in seq_params])
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return dict(zip((column[0] for column in self._cursor.description), row))
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    def __init__(self, backend, raw):
+        self._backend = backend
+        self._raw = raw
+        self._returned = False
+
+    def cursor(self, dictionary=False, buffered=None):
+        return SQLiteCursor(self, dictionary)
+
+    def _begin(self):
+        # Like MySQL with autocommit off: every statement runs inside a transaction
+        if not self._raw.in_transaction:
+            self._raw.execute("BEGIN")
+
+    @property
+    def in_transaction(self):
+        return self._raw.in_transaction
+
+    unread_result = False
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        if self._returned:
+            return
+        self._returned = True
+        self._backend._release()
+
+
+class SQLiteBackend:
+    dialect = "sqlite"
+
+    def __init__(self, path, timeout=POOL_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        # Sizes the DB executor (db_executor); callers queue on the lock below
+        self.pool_size = POOL_SIZE
+        self.max_overflow = POOL_MAX_OVERFLOW
+        self._raw = None
+        self._lock = threading.Lock()
+        self._owner = None
+        self._depth = 0
+        self._stats = {"checkouts": 0, "checkout_timeouts": 0, "total_wait_seconds": 0.0, "max_wait_seconds": 0.0}
+
+    def _open(self):
+        raw = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+        )
+        if self.path != ":memory:":
+            raw.execute("PRAGMA journal_mode = WAL")
+        raw.executescript(SQLITE_SCHEMA)
+        return raw
+
+    def connect(self):
+        me = threading.get_ident()
+        if self._owner == me:
+            # Nested checkout on the same thread shares the connection
+            self._depth += 1
+            return SQLiteConnection(self, self._raw)
+
+        started = time.monotonic()
+        if not self._lock.acquire(timeout=self.timeout):
+            self._stats["checkout_timeouts"] += 1
+            raise PoolTimeout(f"Timed out after {self.timeout}s waiting for the SQLite database")
+        self._owner = me
+        self._depth = 1
+
+        try:
+            if self._raw is None:
+                self._raw = self._open()
+        except Exception:
+            self._release()
+            raise
+
+        waited = time.monotonic() - started
+        self._stats["checkouts"] += 1
+        self._stats["total_wait_seconds"] += waited
+        self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], waited)
+        return SQLiteConnection(self, self._raw)
+
+    def _release(self):
+        self._depth -= 1
+        if self._depth > 0:
+            return
+        if self._raw is not None and self._raw.in_transaction:
+            self._raw.rollback()
+        self._owner = None
+        self._lock.release()
+
+    def prewarm(self, count=None):
+        # One connection; opening it creates the schema
+        self.connect().close()
+
+    def dispose(self):
+        # An in-memory database lives as long as its connection, so only files are closed
+        if self.path != ":memory:" and self._raw is not None and self._lock.acquire(timeout=self.timeout):
+            try:
+                self._raw.close()
+                self._raw = None
+            finally:
+                self._lock.release()
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats.update({
+            "backend": "memory" if self.path == ":memory:" else "sqlite",
+            "open": int(self._raw is not None),
+            "in_use": int(self._owner is not None),
+        })
+        stats["avg_wait_seconds"] = stats["total_wait_seconds"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        return stats
@@ -0,0 +1,191 @@
+"""
+Write-behind buffer for /update-steps (enabled with STEP_WRITE_BEHIND=1).
+
+Phones push the cumulative count for the same (user_id, date) many times a
+day and every push but the last is overwritten anyway. In write-behind mode a
+push only replaces the pending record for its key; a background thread hands
+all pending records to update_steps_batch every STEP_BUFFER_FLUSH_INTERVAL
+seconds, or as soon as STEP_BUFFER_MAX_PENDING keys are waiting.
+
+Reads of a user's steps flush that user's pending records first
+(flush(user_ids=...)), so they never see an older value than the one the
+phone last sent. Records the database refuses stay pending and are retried
+on the next flush. stop() drains everything on shutdown. Records still pending
+when the process dies are lost; the phone sends its full count again on the
+next sync.
+
+The buffer lives in one process, and only reads served by that process flush
+it. Run write-behind mode with a single worker: start() takes an exclusive
+lock on STEP_BUFFER_LOCK_FILE and refuses to start if another worker on the
+host holds it. Behind a load balancer that routes every request of a user to
+the same worker, set STEP_BUFFER_STICKY_ROUTING=1 to skip that check.
+"""
+import logging
+import os
+import tempfile
+import threading
+from collections import defaultdict
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, the single worker check is skipped
+    fcntl = None
+
+
+STEP_WRITE_BEHIND = os.getenv("STEP_WRITE_BEHIND", "0") == "1"
+STEP_BUFFER_FLUSH_INTERVAL = float(os.getenv("STEP_BUFFER_FLUSH_INTERVAL", "2"))
+STEP_BUFFER_MAX_PENDING = int(os.getenv("STEP_BUFFER_MAX_PENDING", "5000"))
+STEP_BUFFER_LOCK_FILE = os.getenv("STEP_BUFFER_LOCK_FILE", os.path.join(tempfile.gettempdir(), "fitness_step_buffer.lock"))
+STEP_BUFFER_STICKY_ROUTING = os.getenv("STEP_BUFFER_STICKY_ROUTING", "0") == "1"
+
+logger = logging.getLogger("fitness.steps")
+
+
+class StepBuffer:
+    def __init__(self, writer, flush_interval=STEP_BUFFER_FLUSH_INTERVAL, max_pending=STEP_BUFFER_MAX_PENDING,
+                 lock_file=STEP_BUFFER_LOCK_FILE, sticky_routing=STEP_BUFFER_STICKY_ROUTING):
+        # writer(records) -> per-record results, like update_steps_batch; callers of add()
+        # validate records first, so a failed result is always worth retrying
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.lock_file = lock_file
+        self.sticky_routing = sticky_routing
+        self._lock_handle = None
+
+        self._pending = {}                 # (user_id, date) -> latest record
+        self._by_user = defaultdict(set)   # user_id -> dates with a pending record
+        self._lock = threading.Lock()
+        # One flush at a time, so an older value can never be written after a newer one
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._stats = {"received": 0, "coalesced": 0, "flushes": 0, "written": 0, "failed": 0}
+
+    def add(self, user_id, day, record):
+        with self._lock:
+            key = (user_id, day)
+            if key in self._pending:
+                self._stats["coalesced"] += 1
+            self._pending[key] = record
+            self._by_user[user_id].add(day)
+            self._stats["received"] += 1
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._wake.set()
+
+    def has_pending(self, user_ids=None):
+        with self._lock:
+            if user_ids is None:
+                return bool(self._pending)
+            return any(user_id in self._by_user for user_id in user_ids)
+
+    def _take(self, user_ids=None):
+        with self._lock:
+            if user_ids is None:
+                taken, self._pending = self._pending, {}
+                self._by_user = defaultdict(set)
+                return taken
+            taken = {}
+            for user_id in user_ids:
+                for day in self._by_user.pop(user_id, ()):
+                    taken[(user_id, day)] = self._pending.pop((user_id, day))
+            return taken
+
+    def _restore(self, taken):
+        # Put back what could not be written, unless a newer value arrived meanwhile
+        with self._lock:
+            for key, record in taken.items():
+                if key not in self._pending:
+                    self._pending[key] = record
+                    self._by_user[key[0]].add(key[1])
+
+    def flush(self, user_ids=None):
+        """Write pending records (all, or only these users'). Returns how many were written."""
+        with self._flush_lock:
+            taken = self._take(user_ids)
+            if not taken:
+                return 0
+            keys = list(taken)
+            try:
+                results = self.writer([taken[key] for key in keys])
+            except Exception:
+                self._restore(taken)
+                raise
+
+            # add() only takes validated records, so these are database errors: retry them
+            failed = {key: result for key, result in zip(keys, results) if result["status"] != "ok"}
+            self._restore({key: taken[key] for key in failed})
+            with self._lock:
+                self._stats["flushes"] += 1
+                self._stats["written"] += len(taken) - len(failed)
+                self._stats["failed"] += len(failed)
+            if failed:
+                logger.warning("%s buffered step record(s) kept for the next flush: %s",
+                               len(failed), next(iter(failed.values())).get("detail"))
+            return len(taken) - len(failed)
+
+    def flush_quietly(self, user_ids=None):
+        # For read paths: a failed flush keeps the records pending and the read goes ahead
+        try:
+            self.flush(user_ids)
+        except Exception as err:
+            logger.error("Flushing buffered steps failed: %s", err)
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush_quietly()
+
+    def _claim_single_worker(self):
+        if self.sticky_routing or fcntl is None or not self.lock_file:
+            return
+        handle = open(self.lock_file, "a")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            raise RuntimeError(
+                "STEP_WRITE_BEHIND=1 needs a single worker: another process holds "
+                f"{self.lock_file}. Run one worker, or set STEP_BUFFER_STICKY_ROUTING=1 "
+                "if each user's requests always reach the same worker."
+            )
+        self._lock_handle = handle
+
+    def _release_single_worker(self):
+        if self._lock_handle is not None:
+            self._lock_handle.close()   # closing the file drops the flock
+            self._lock_handle = None
+
+    def start(self):
+        if self._thread is None:
+            self._claim_single_worker()
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="step-buffer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the flusher and drain everything still pending."""
+        if self._thread is not None:
+            self._stopping = True
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as err:
+            logger.error("Could not drain %s buffered step record(s) on shutdown: %s", len(self._pending), err)
+        else:
+            if self._pending:
+                logger.error("Could not drain %s buffered step record(s) on shutdown", len(self._pending))
+        finally:
+            self._release_single_worker()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+        stats["enabled"] = self._thread is not None
+        return stats
@@ -0,0 +1,209 @@
+"""
+Streak state maintained incrementally from step writes.
+
+A day counts towards a streak when daily_step_count is above STREAK_MIN_STEPS.
+Every maximal run of consecutive qualifying days is stored in streak_runs, and
+user_streaks keeps the longest run length. When a day starts or stops
+qualifying (including backfilled or out-of-order days), only the runs next to
+it are merged or split, so a write never rescans a user's history.
+
+The tables are created by migrations.py; existing data has to be loaded once with:
+
+    python streaks.py rebuild [--user-id ID]
+"""
+import argparse
+from datetime import timedelta
+
+import data_versions
+from db_pool import pool
+
+
+STREAK_MIN_STEPS = 1000
+
+STREAK_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS streak_runs (
+        user_id INT NOT NULL,
+        start_date DATE NOT NULL,
+        end_date DATE NOT NULL,
+        PRIMARY KEY (user_id, start_date),
+        KEY idx_streak_runs_end (user_id, end_date)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_streaks (
+        user_id INT NOT NULL PRIMARY KEY,
+        longest_streak INT NOT NULL DEFAULT 0
+    )
+    """,
+]
+
+
+def qualifies(steps):
+    return steps is not None and steps > STREAK_MIN_STEPS
+
+
+def apply_step_changes(cursor, rows, previous):
+    """
+    Update streak runs for the (user_id, date) keys in `rows` whose
+    qualification changed compared to `previous` ({(user_id, date): steps}).
+    """
+    final = dict(previous)
+    for user_id, day, steps, _ in rows:
+        final[(user_id, day)] = steps
+
+    flips = sorted(
+        key for key, steps in final.items()
+        if qualifies(steps) != qualifies(previous.get(key))
+    )
+    locked = set()
+    for user_id, day in flips:
+        if user_id not in locked:
+            _lock_user(cursor, user_id)
+            locked.add(user_id)
+        if qualifies(final[(user_id, day)]):
+            _add_day(cursor, user_id, day)
+        else:
+            _remove_day(cursor, user_id, day)
+
+
+def _lock_user(cursor, user_id):
+    # Serializes streak maintenance per user across concurrent transactions
+    cursor.execute("""
+        INSERT INTO user_streaks (user_id, longest_streak) VALUES (%s, 0)
+        ON DUPLICATE KEY UPDATE user_id = user_id
+    """, (user_id,))
+    cursor.execute("SELECT longest_streak FROM user_streaks WHERE user_id = %s FOR UPDATE", (user_id,))
+    cursor.fetchall()
+
+
+def _add_day(cursor, user_id, day):
+    cursor.execute(
+        "SELECT start_date FROM streak_runs WHERE user_id = %s AND end_date = %s",
+        (user_id, day - timedelta(days=1))
+    )
+    left = cursor.fetchone()
+    cursor.execute(
+        "SELECT end_date FROM streak_runs WHERE user_id = %s AND start_date = %s",
+        (user_id, day + timedelta(days=1))
+    )
+    right = cursor.fetchone()
+
+    start = left[0] if left else day
+    end = right[0] if right else day
+    cursor.execute(
+        "DELETE FROM streak_runs WHERE user_id = %s AND start_date IN (%s, %s)",
+        (user_id, start, day + timedelta(days=1))
+    )
+    cursor.execute(
+        "INSERT INTO streak_runs (user_id, start_date, end_date) VALUES (%s, %s, %s)",
+        (user_id, start, end)
+    )
+    length = (end - start).days + 1
+    cursor.execute(
+        "UPDATE user_streaks SET longest_streak = %s WHERE user_id = %s AND longest_streak < %s",
+        (length, user_id, length)
+    )
+
+
+def _remove_day(cursor, user_id, day):
+    cursor.execute("""
+        SELECT start_date, end_date FROM streak_runs
+        WHERE user_id = %s AND start_date <= %s
+        ORDER BY start_date DESC
+        LIMIT 1
+    """, (user_id, day))
+    run = cursor.fetchone()
+    if not run or run[1] < day:
+        return
+
+    start, end = run
+    cursor.execute("DELETE FROM streak_runs WHERE user_id = %s AND start_date = %s", (user_id, start))
+    pieces = []
+    if start < day:
+        pieces.append((user_id, start, day - timedelta(days=1)))
+    if end > day:
+        pieces.append((user_id, day + timedelta(days=1), end))
+    if pieces:
+        cursor.execute(
+            "INSERT INTO streak_runs (user_id, start_date, end_date) VALUES "
+            + ", ".join(["(%s, %s, %s)"] * len(pieces)),
+            [value for piece in pieces for value in piece]
+        )
+
+    # Splitting the longest run is the only case where the maximum can drop
+    cursor.execute("SELECT longest_streak FROM user_streaks WHERE user_id = %s", (user_id,))
+    if cursor.fetchone()[0] <= (end - start).days + 1:
+        cursor.execute("SELECT start_date, end_date FROM streak_runs WHERE user_id = %s", (user_id,))
+        longest = max(((run_end - run_start).days + 1 for run_start, run_end in cursor.fetchall()), default=0)
+        cursor.execute("UPDATE user_streaks SET longest_streak = %s WHERE user_id = %s", (longest, user_id))
+
+
+def _extend_runs(runs, day):
+    # runs: [[start, end], ...] of earlier days; day comes after all of them
+    if runs and runs[-1][1] == day - timedelta(days=1):
+        runs[-1][1] = day
+    else:
+        runs.append([day, day])
+
+
+# Rows fetched at a time by rebuild()
+REBUILD_FETCH_SIZE = 10000
+
+
+def rebuild(user_id=None):
+    """Recompute streak runs (for every user, or one) from the raw steps table."""
+    connection = pool.connect()
+    cursor = connection.cursor()
+    where = "AND user_id = %s" if user_id is not None else ""
+    params = (STREAK_MIN_STEPS, user_id) if user_id is not None else (STREAK_MIN_STEPS,)
+
+    try:
+        cursor.execute(f"""
+            SELECT user_id, date FROM steps
+            WHERE daily_step_count > %s {where}
+            ORDER BY user_id, date
+        """, params)
+        # Streamed and folded into runs as they arrive, so only the runs are held in memory
+        runs_by_user = {}
+        while True:
+            rows = cursor.fetchmany(REBUILD_FETCH_SIZE)
+            if not rows:
+                break
+            for row_user_id, day in rows:
+                _extend_runs(runs_by_user.setdefault(row_user_id, []), day)
+
+        if user_id is not None:
+            cursor.execute("DELETE FROM streak_runs WHERE user_id = %s", (user_id,))
+            cursor.execute("DELETE FROM user_streaks WHERE user_id = %s", (user_id,))
+        else:
+            cursor.execute("DELETE FROM streak_runs")
+            cursor.execute("DELETE FROM user_streaks")
+
+        for row_user_id, runs in runs_by_user.items():
+            cursor.executemany(
+                "INSERT INTO streak_runs (user_id, start_date, end_date) VALUES (%s, %s, %s)",
+                [(row_user_id, start, end) for start, end in runs]
+            )
+            cursor.execute(
+                "INSERT INTO user_streaks (user_id, longest_streak) VALUES (%s, %s)",
+                (row_user_id, max((end - start).days + 1 for start, end in runs))
+            )
+        data_versions.bump_all(cursor, "steps", user_id)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+        connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the streak tables")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--user-id", type=int)
+    args = parser.parse_args()
+
+    rebuild(args.user_id)
+    print("Streaks rebuilt", f"for user {args.user_id}" if args.user_id is not None else "for all users")
@@ -0,0 +1,57 @@
+import os
+import sys
+
+# Set before the app modules are imported: they read their configuration at import time
+os.environ.update({
+    "DB_BACKEND": "memory",
+    "AUTH_MODE": "required",
+    "SESSION_SECRET": "test-secret",
+    "ADMIN_API_KEY": "test-admin-key",
+    "BCRYPT_ROUNDS": "4",
+    "STARTUP_PREWARM": "",
+    "GLOBAL_LEADERBOARD_SNAPSHOT": "",
+})
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def users():
+    import seed_data
+    return seed_data.seed(5)
+
+
+@pytest.fixture(scope="session")
+def client(users):
+    # One app lifespan for the whole run: shutdown closes the executors for good
+    import main
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def new_user():
+    """Insert a user with no history and return the user_id."""
+    from db_pool import pool
+
+    def create():
+        connection = pool.connect()
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT COALESCE(MAX(user_id), 0) + 1 FROM users")
+            number = cursor.fetchone()[0]
+            cursor.execute(
+                """INSERT INTO users (username, phone_number, email, DOB, height, weight, blood_group, gender,
+                                      experience, stepgoal, caloriegoal, password)
+                   VALUES (%s, %s, %s, '1995-01-01', 170, 70, 'O+', 'male', 'beginner', 8000, 2000, 'x')""",
+                (f"fresh{number}", f"8{number:09d}", f"fresh{number}@example.com")
+            )
+            connection.commit()
+            return cursor.lastrowid
+        finally:
+            cursor.close()
+            connection.close()
+    return create
@@ -0,0 +1,80 @@
+import calendar
+from datetime import date
+
+import main
+from DB_Interface import DASHBOARD_PARTS
+
+
+ADMIN = {"X-Admin-Key": "test-admin-key"}
+
+
+def get(client, path, **headers):
+    return client.get(path, headers={**ADMIN, **headers})
+
+
+def test_dashboard_returns_every_part_by_default(client, users):
+    response = get(client, f"/dashboard?id={users[0]}")
+    assert response.status_code == 200
+    body = response.json()
+    assert set(body) == set(DASHBOARD_PARTS)
+    # Same values as the single-purpose endpoints
+    assert body["balance"] == get(client, f"/get-balance?id={users[0]}").json()
+    assert body["streaks"] == get(client, f"/get-streaks?id={users[0]}").json()
+    assert body["monthly_steps"] == get(client, f"/monthly-steps?id={users[0]}").json()
+    assert body["total_steps"] == get(client, f"/get-total-steps?id={users[0]}").json()
+
+
+def test_dashboard_returns_only_the_selected_fields(client, users):
+    body = get(client, f"/dashboard?id={users[0]}&fields=balance, streaks,").json()
+    assert set(body) == {"balance", "streaks"}
+
+
+def test_unknown_dashboard_field_is_a_bad_request(client, users):
+    response = get(client, f"/dashboard?id={users[0]}&fields=balance,calories")
+    assert response.status_code == 400
+    assert "calories" in response.json()["detail"]
+
+
+def test_new_user_gets_a_dashboard_with_empty_parts(client, new_user):
+    response = get(client, f"/dashboard?id={new_user()}")
+    assert response.status_code == 200
+    assert set(response.json()) == set(DASHBOARD_PARTS)
+
+
+def test_dashboard_etag_moves_with_the_selected_data(client, new_user):
+    user_id = new_user()
+    steps_view = f"/dashboard?id={user_id}&fields=total_steps,streaks"
+    balance_view = f"/dashboard?id={user_id}&fields=balance"
+    steps_etag = get(client, steps_view).headers["ETag"]
+    balance_etag = get(client, balance_view).headers["ETag"]
+
+    response = get(client, steps_view, **{"If-None-Match": steps_etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == steps_etag
+    assert get(client, balance_view, **{"If-None-Match": balance_etag}).status_code == 304
+
+    # A credit transaction changes the balance view only
+    client.post("/new-transaction", headers=ADMIN, json={
+        "user_id": user_id, "transaction_type": "earn", "activity_type": "swim", "amount": 5,
+    })
+    assert get(client, steps_view, **{"If-None-Match": steps_etag}).status_code == 304
+    response = get(client, balance_view, **{"If-None-Match": balance_etag})
+    assert response.status_code == 200
+    assert response.json()["balance"] == 5
+
+    # A step write changes the steps view
+    client.post("/update-steps", headers=ADMIN, json={
+        "user_id": user_id, "date": date.today().isoformat(), "steps": 4321, "midnight_step_count": None,
+    })
+    response = get(client, steps_view, **{"If-None-Match": steps_etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != steps_etag
+
+
+def test_monthly_steps_by_day_strips_the_leading_zero():
+    today = date.today()
+    steps = [{"step_date": today.replace(day=day).isoformat(), "total_steps": day * 100} for day in (1, 5, 10)]
+    by_day = main.monthly_steps_by_day(steps)
+    assert len(by_day) == calendar.monthrange(today.year, today.month)[1]
+    assert (by_day["1"], by_day["5"], by_day["10"], by_day["2"]) == (100, 500, 1000, 0)
+    assert "05" not in by_day
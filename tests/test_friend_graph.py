@@ -0,0 +1,76 @@
+import pytest
+
+import seed_data
+from DB_Interface import leaderboard_data
+from db_pool import pool
+from friend_graph import FriendGraph, friend_graph
+from leaderboard_cache import leaderboard_cache
+
+
+def test_apply_during_a_reload_survives_the_swap(users):
+    graph = FriendGraph()
+    graph.load()
+    requester, recipient = users[0], users[1]
+    read_table = graph._read_table
+
+    def read_then_commit():
+        # The reload's read has finished; this request is committed and applied before the swap
+        table = read_table()
+        graph.apply(999001, requester, recipient, "accepted")
+        return table
+
+    graph._read_table = read_then_commit
+    graph.load()
+    assert graph.friends_of(requester)[recipient] == 999001
+    assert graph.edge(requester, recipient) == (999001, "accepted")
+
+    # Nothing is replayed once the reload is done
+    del graph._read_table
+    graph.load()
+    assert graph.edge(requester, recipient) != (999001, "accepted")
+
+
+def test_failed_reload_keeps_the_old_graph(users):
+    graph = FriendGraph()
+    graph.load()
+    edges = graph.stats()["edges"]
+
+    def fail():
+        raise RuntimeError("connection lost")
+
+    graph._read_table = fail
+    with pytest.raises(RuntimeError):
+        graph.load()
+    graph.apply(999002, users[0], users[2], "pending")
+    assert graph.stats()["edges"] == edges + 1
+    assert graph._replay is None
+
+
+def execute(sql, params=()):
+    connection = pool.connect()
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        connection.commit()
+        return cursor.lastrowid
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def test_friend_accepted_on_another_worker_reaches_the_cached_leaderboard(users):
+    requester, recipient = users[3], users[4]
+    execute("DELETE FROM friendships WHERE requester_id IN (%s, %s) AND recipient_id IN (%s, %s)",
+            (requester, recipient, requester, recipient))
+    friend_id = execute("INSERT INTO friendships (requester_id, recipient_id, status) VALUES (%s, %s, 'pending')",
+                        (requester, recipient))
+    friend_graph.load()
+    assert recipient not in [entry["user_id"] for entry in leaderboard_data(requester)]
+
+    # Another worker accepts: the row and the shared counters change, this worker's graph does not
+    execute("UPDATE friendships SET status = 'accepted' WHERE friend_id = %s", (friend_id,))
+    leaderboard_cache.change_friends(requester, recipient)
+    assert recipient not in friend_graph.friends_of(requester)
+
+    assert recipient in [entry["user_id"] for entry in leaderboard_data(requester)]
+    assert requester in [entry["user_id"] for entry in leaderboard_data(recipient)]
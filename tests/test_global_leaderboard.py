@@ -0,0 +1,153 @@
+import random
+import threading
+import time
+from datetime import date
+
+import pytest
+
+from db_pool import pool
+from global_leaderboard import Board, GlobalLeaderboard, IndexableSkipList
+
+
+ADMIN = {"X-Admin-Key": "test-admin-key"}
+
+
+def daily_steps():
+    connection = pool.connect()
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT user_id, daily_step_count FROM steps WHERE date = %s AND daily_step_count > 0",
+                       (date.today(),))
+        return dict(cursor.fetchall())
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def test_skip_list_matches_a_sorted_list():
+    rng = random.Random(3)
+    skiplist, expected = IndexableSkipList(), []
+    for _ in range(2000):
+        key = rng.randrange(500)
+        if key in expected and rng.random() < 0.5:
+            skiplist.remove(key)
+            expected.remove(key)
+        elif key not in expected:
+            skiplist.insert(key)
+            expected.append(key)
+        expected.sort()
+    assert list(skiplist) == expected
+    assert len(skiplist) == len(expected)
+    for start in range(0, len(expected) + 5, 7):
+        assert skiplist.slice(start, start + 10) == expected[start:start + 10]
+    for key in range(0, 500, 13):
+        assert skiplist.count_below(key) == sum(1 for k in expected if k < key)
+    with pytest.raises(KeyError):
+        skiplist.remove(-1)
+
+
+def test_board_slices_after_inserts_and_removals():
+    board = Board({1: 100, 2: 300, 3: 200})
+    board.set(4, 250)
+    board.add(2, -290)      # drops from first to last
+    board.set(3, 0)         # no steps: off the board
+    board.add(5, 50)
+    assert board.top(10) == [(1, 4, 250), (2, 1, 100), (3, 5, 50), (4, 2, 10)]
+    assert board.top(2, 1) == [(2, 1, 100), (3, 5, 50)]
+    assert board.top(5, 10) == []
+    assert Board.from_ranked(board.items()).top(10) == board.top(10)
+
+
+def test_board_rank_and_percentile():
+    board = Board({1: 500, 2: 300, 3: 300, 4: 100})
+    assert board.rank(1) == {"rank": 1, "position": 1, "steps": 500, "percentile": 100.0}
+    # Equal steps share a rank, the position breaks the tie by user_id
+    assert board.rank(3) == {"rank": 2, "position": 3, "steps": 300, "percentile": 75.0}
+    assert board.rank(4)["percentile"] == 25.0
+    assert board.rank(5) is None
+
+
+def test_rank_endpoint_matches_the_steps_table(client, users):
+    today = date.today().isoformat()
+    for user_id, steps in zip(users, (12000, 40000, 12000)):
+        response = client.post("/update-steps", headers=ADMIN, json={
+            "user_id": user_id, "date": today, "steps": steps, "midnight_step_count": None,
+        })
+        assert response.status_code == 200
+
+    scores = daily_steps()
+    for user_id in users:
+        response = client.get("/global-leaderboard/rank", headers=ADMIN,
+                              params={"id": user_id, "period": "daily", "neighbours": 1})
+        assert response.status_code == 200
+        body = response.json()
+        rank = 1 + sum(1 for steps in scores.values() if steps > scores[user_id])
+        assert body["total_users"] == len(scores)
+        assert body["rank"] == rank
+        assert body["step_count"] == scores[user_id]
+        assert body["percentile"] == round(100 * (len(scores) - rank + 1) / len(scores), 2)
+        assert user_id in [entry["user_id"] for entry in body["neighbours"]]
+
+    top = client.get("/global-leaderboard", headers=ADMIN, params={"period": "daily", "limit": 100}).json()
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    assert [(entry["user_id"], entry["step_count"]) for entry in top["entries"]] == ranked
+
+
+class FakeConnection:
+    def __init__(self, on_commit=None):
+        self.on_commit = on_commit
+
+    def commit(self):
+        if self.on_commit:
+            self.on_commit()
+
+
+def test_commit_during_a_reload_survives_the_swap(users):
+    leaderboard = GlobalLeaderboard(snapshot_path="")
+    leaderboard.reload()
+    user_id, today = users[4], date.today()
+    before = daily_steps().get(user_id, 0)
+    read_tables = leaderboard._read_tables
+
+    def read_then_commit(starts):
+        # The snapshot has been read; this write commits before the new boards are swapped in
+        boards = read_tables(starts)
+        leaderboard.commit_steps(FakeConnection(), {(user_id, today): 777})
+        return boards
+
+    leaderboard._read_tables = read_then_commit
+    leaderboard.reload()
+    _, _, rank, _ = leaderboard.around("daily", user_id, 0)
+    assert rank["steps"] == before + 777
+    assert leaderboard.stats()["replayed_deltas"] == 1
+
+    # Not replayed again by the next reload
+    del leaderboard._read_tables
+    leaderboard.reload()
+    _, _, rank, _ = leaderboard.around("daily", user_id, 0)
+    assert (rank["steps"] if rank else 0) == before
+
+
+def test_reload_waits_for_a_commit_in_flight(users):
+    leaderboard = GlobalLeaderboard(snapshot_path="")
+    leaderboard.reload()
+    committing, release = threading.Event(), threading.Event()
+
+    def slow_commit():
+        committing.set()
+        release.wait(5)
+
+    writer = threading.Thread(target=leaderboard.commit_steps,
+                              args=(FakeConnection(slow_commit), {(users[4], date.today()): 1}))
+    writer.start()
+    assert committing.wait(5)
+    reloader = threading.Thread(target=leaderboard.reload)
+    reloader.start()
+    time.sleep(0.2)
+    assert reloader.is_alive()   # held until the commit has applied its delta
+    release.set()
+    writer.join(5)
+    reloader.join(5)
+    assert not reloader.is_alive()
+    # Committed before the snapshot: part of the table, not replayed
+    assert leaderboard.stats()["replayed_deltas"] == 0
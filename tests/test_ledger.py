@@ -0,0 +1,93 @@
+from decimal import Decimal
+
+import ledger
+from db_pool import pool
+
+
+ADMIN = {"X-Admin-Key": "test-admin-key"}
+
+
+def execute(sql, params=()):
+    connection = pool.connect()
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall() if cursor.description else None
+        connection.commit()
+        return rows
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def post(client, user_id, transaction_type, amount):
+    return client.post("/new-transaction", headers=ADMIN, json={
+        "user_id": user_id, "transaction_type": transaction_type, "activity_type": "swim", "amount": amount,
+    })
+
+
+def balance(client, user_id):
+    return client.get(f"/get-balance?id={user_id}", headers=ADMIN).json()
+
+
+def ledger_rows(user_id):
+    return execute("SELECT COUNT(*) FROM transactions WHERE user_id = %s", (user_id,))[0][0]
+
+
+def test_spend_above_the_balance_is_rejected(client, new_user):
+    user_id = new_user()
+    response = post(client, user_id, "spend", 1)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Insufficient credit balance"
+
+    assert post(client, user_id, "earn", 10).json()["credit_balance"] == 10
+    assert post(client, user_id, "spend", 4).json()["credit_balance"] == 6
+    response = post(client, user_id, "spend", 6.01)
+    assert response.status_code == 400
+    # Nothing of the rejected spend was written
+    assert ledger_rows(user_id) == 2
+    assert balance(client, user_id) == 6
+    assert post(client, user_id, "spend", 6).json()["credit_balance"] == 0
+
+
+def test_invalid_transactions_are_rejected(client, new_user):
+    user_id = new_user()
+    for transaction_type, amount in (("earn", 0), ("earn", -5), ("earn", "lots"), ("refund", 5)):
+        assert post(client, user_id, transaction_type, amount).status_code == 400
+    assert ledger_rows(user_id) == 0
+
+
+def test_reconcile_finds_and_fixes_a_drift(client, new_user):
+    user_id = new_user()
+    post(client, user_id, "earn", 25)
+    post(client, user_id, "spend", 5)
+    execute("UPDATE users SET credit_balance = 70 WHERE user_id = %s", (user_id,))
+
+    found = [row for row in ledger.reconcile_balances() if row["user_id"] == user_id]
+    assert len(found) == 1
+    assert Decimal(str(found[0]["credit_balance"])) == 70
+    assert found[0]["ledger_balance"] == 20
+    assert balance(client, user_id) == 70   # only reported
+
+    ledger.reconcile_balances(fix=True, batch_size=2)
+    assert balance(client, user_id) == 20
+    assert not [row for row in ledger.reconcile_balances() if row["user_id"] == user_id]
+
+
+def test_backfill_sets_every_balance_to_the_ledger_sum(client, users, new_user):
+    user_id = new_user()
+    post(client, user_id, "earn", 8)
+    execute("UPDATE users SET credit_balance = 0 WHERE user_id = %s", (user_id,))
+    execute("UPDATE users SET credit_balance = 1000 WHERE user_id = %s", (users[0],))
+
+    connection = pool.connect()
+    cursor = connection.cursor()
+    try:
+        ledger.backfill_balances(cursor)
+        connection.commit()
+    finally:
+        cursor.close()
+        connection.close()
+
+    assert balance(client, user_id) == 8
+    assert ledger.reconcile_balances() == []
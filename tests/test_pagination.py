@@ -0,0 +1,50 @@
+import base64
+import json
+
+import pytest
+
+
+ADMIN = {"X-Admin-Key": "test-admin-key"}
+
+
+def cursor_of(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def pages(client, path):
+    rows, cursor = [], None
+    while True:
+        params = {"limit": 3} if cursor is None else {"limit": 3, "cursor": cursor}
+        response = client.get(path, params=params, headers=ADMIN)
+        assert response.status_code == 200
+        rows += response.json()
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return rows
+
+
+@pytest.mark.parametrize("path, key", [
+    ("/fetch-activities?id={user}", "activity_id"),
+    ("/get-transaction?id={user}", "transaction_id"),
+    ("/admin/get-users", "user_id"),
+])
+def test_pages_cover_every_row_once(client, users, path, key):
+    rows = pages(client, path.format(user=users[0]))
+    ids = [row[key] for row in rows]
+    assert len(ids) > 3
+    assert len(set(ids)) == len(ids)
+    if key == "user_id":
+        assert set(users) <= set(ids)
+
+
+@pytest.mark.parametrize("path", ["/fetch-activities?id={user}", "/get-transaction?id={user}", "/admin/get-users"])
+@pytest.mark.parametrize("cursor", [
+    "not base64!", cursor_of({"a": 1}), cursor_of(["a"]), cursor_of([1.5]), cursor_of([True]),
+    cursor_of(["yesterday", 1]), cursor_of([1, 1]), cursor_of(["2026-01-01 00:00:00", "1"]),
+    cursor_of(["2026-01-01 00:00:00", 1, 2]),
+])
+def test_malformed_cursor_is_a_bad_request(client, users, path, cursor):
+    response = client.get(path.format(user=users[0]), params={"cursor": cursor}, headers=ADMIN)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
@@ -0,0 +1,33 @@
+from fastapi import HTTPException
+
+import DB_Interface
+import seed_data
+from db_pool import pool
+
+
+def test_login_releases_its_connection_before_verifying(users, monkeypatch):
+    verify = DB_Interface.verify_and_update_password
+    in_use = []
+
+    def checked_verify(plain_password, hashed_password):
+        in_use.append(pool.stats()["in_use"])
+        return verify(plain_password, hashed_password)
+
+    monkeypatch.setattr(DB_Interface, "verify_and_update_password", checked_verify)
+    profile = DB_Interface.login_user({"phone_number": seed_data.seed_phone_number(0),
+                                       "password": seed_data.SEED_PASSWORD})
+    assert profile["user_id"] == users[0]
+    assert in_use == [0]
+
+
+def test_register_passes_the_hashing_pool_503_through(client, monkeypatch):
+    def busy(password):
+        raise HTTPException(status_code=503, detail="Server busy, please try again.")
+
+    monkeypatch.setattr(DB_Interface, "hash_password", busy)
+    response = client.post("/register", json={
+        "username": "busy", "phone_number": "7000000001", "email": "busy@example.com", "DOB": "1990-01-01",
+        "height": 180, "weight": 75, "blood": "A+", "gender": "female", "experience": "beginner",
+        "stepgoal": 8000, "caloriegoal": 2000, "password": "secret",
+    })
+    assert response.status_code == 503
@@ -0,0 +1,27 @@
+import io
+import zipfile
+
+import pytest
+
+
+ADMIN = {"X-Admin-Key": "test-admin-key"}
+
+
+def batch(client, vouchers):
+    return client.post("/generate-qr/batch", headers=ADMIN, json={"vouchers": vouchers})
+
+
+def test_batch_names_are_unique(client):
+    # "a_1" and "a/1" both map to a_1.png, which the second "a" already took
+    response = batch(client, [{"name": name, "amount": 5} for name in ("a", "a", "a_1", "a/1")])
+    assert response.status_code == 200
+    names = zipfile.ZipFile(io.BytesIO(response.content)).namelist()
+    assert names == ["a.png", "a_1.png", "a_1_1.png", "a_1_2.png"]
+
+
+@pytest.mark.parametrize("voucher", [{"name": ["a"], "amount": 1}, {"name": "", "amount": 1},
+                                     {"name": "a", "amount": "1"}, {"name": "a"}, "a"])
+def test_bad_voucher_is_rejected_before_streaming(client, voucher):
+    response = batch(client, [{"name": "ok", "amount": 1}, voucher])
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Voucher 1")
@@ -0,0 +1,81 @@
+import random
+from datetime import date, timedelta
+
+import rollups
+import streaks
+from DB_Interface import update_steps, update_steps_batch
+from db_pool import pool
+
+
+TODAY = date.today()
+
+DERIVED_QUERIES = {
+    "weekly": "SELECT user_id, week_start, total_steps FROM step_rollups_weekly WHERE total_steps <> 0",
+    "monthly": "SELECT user_id, month_start, total_steps FROM step_rollups_monthly WHERE total_steps <> 0",
+    "totals": "SELECT user_id, total_steps FROM step_totals WHERE total_steps <> 0",
+    "runs": "SELECT user_id, start_date, end_date FROM streak_runs",
+    "longest": "SELECT user_id, longest_streak FROM user_streaks WHERE longest_streak > 0",
+}
+
+
+def derived_tables():
+    connection = pool.connect()
+    cursor = connection.cursor()
+    try:
+        tables = {}
+        for name, query in DERIVED_QUERIES.items():
+            cursor.execute(query)
+            tables[name] = sorted(tuple(row) for row in cursor.fetchall())
+        return tables
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def test_full_rebuilds_match_the_incremental_tables(users, new_user):
+    # Incremental writes across week and month boundaries, with overwrites and edits to zero
+    rng = random.Random(5)
+    written = users + [new_user(), new_user()]
+    for _ in range(40):
+        user_id = rng.choice(written)
+        records = [
+            {"user_id": user_id, "date": (TODAY - timedelta(days=rng.randrange(70))).isoformat(),
+             "steps": rng.choice([0, 800, 4000, 12000]), "midnight_step_count": None}
+            for _ in range(rng.randrange(1, 4))
+        ]
+        if len(records) == 1:
+            update_steps(records[0])
+        else:
+            update_steps_batch(records)
+
+    incremental = derived_tables()
+    assert incremental["runs"] and incremental["weekly"]
+    rollups.rebuild()
+    streaks.rebuild()
+    assert derived_tables() == incremental
+
+
+def test_rebuild_period_starts_match_python(new_user):
+    # Every weekday and a few month and year boundaries through the SQL bucketing
+    user_id = new_user()
+    start = date(2023, 12, 20)
+    update_steps_batch([
+        {"user_id": user_id, "date": (start + timedelta(days=offset)).isoformat(), "steps": 100 + offset,
+         "midnight_step_count": None}
+        for offset in range(80)
+    ])
+    incremental = derived_tables()
+    rollups.rebuild(user_id)
+    assert derived_tables() == incremental
+
+    connection = pool.connect()
+    cursor = connection.cursor()
+    try:
+        bucket = rollups.PERIOD_START_SQL[pool.dialect]
+        cursor.execute(f"SELECT date, {bucket['week']}, {bucket['month']} FROM steps WHERE user_id = %s", (user_id,))
+        for day, week, month in cursor.fetchall():
+            assert str(week) == rollups.week_start(day).isoformat()
+            assert str(month) == rollups.month_start(day).isoformat()
+    finally:
+        cursor.close()
+        connection.close()
@@ -0,0 +1,107 @@
+from collections import defaultdict
+from datetime import date, timedelta
+
+import mysql.connector
+
+import DB_Interface
+import rollups
+from DB_Interface import update_steps, update_steps_batch
+from db_pool import pool
+from rollups import month_start, week_start
+
+
+TODAY = date.today()
+
+
+def rows(sql, params=()):
+    connection = pool.connect()
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def stored_rollups(user_id):
+    return (
+        dict(rows("SELECT week_start, total_steps FROM step_rollups_weekly WHERE user_id = %s AND total_steps <> 0", (user_id,))),
+        dict(rows("SELECT month_start, total_steps FROM step_rollups_monthly WHERE user_id = %s AND total_steps <> 0", (user_id,))),
+        rows("SELECT COALESCE(SUM(total_steps), 0) FROM step_totals WHERE user_id = %s", (user_id,))[0][0],
+    )
+
+
+def recomputed_rollups(user_id):
+    weekly, monthly, total = defaultdict(int), defaultdict(int), 0
+    for day, steps in rows("SELECT date, daily_step_count FROM steps WHERE user_id = %s", (user_id,)):
+        weekly[week_start(day)] += steps
+        monthly[month_start(day)] += steps
+        total += steps
+    return (
+        {start: steps for start, steps in weekly.items() if steps},
+        {start: steps for start, steps in monthly.items() if steps},
+        total,
+    )
+
+
+def record(user_id, days_ago, steps):
+    return {"user_id": user_id, "date": (TODAY - timedelta(days=days_ago)).isoformat(),
+            "steps": steps, "midnight_step_count": None}
+
+
+def test_rollups_match_a_recompute_after_overwrites_batches_and_backfills(new_user):
+    user_id = new_user()
+    update_steps(record(user_id, 0, 4000))
+    update_steps(record(user_id, 0, 6500))      # overwrite of the same day
+    update_steps(record(user_id, 0, 1200))
+    assert stored_rollups(user_id) == recomputed_rollups(user_id)
+    assert stored_rollups(user_id)[2] == 1200
+
+    # Batch with a repeated key: the later record wins, like the upsert
+    results = update_steps_batch([record(user_id, 1, 3000), record(user_id, 2, 8000), record(user_id, 1, 500)])
+    assert [result["status"] for result in results] == ["ok"] * 3
+    assert stored_rollups(user_id) == recomputed_rollups(user_id)
+
+    # Backfill of days weeks and months back, then an edit of one of them
+    update_steps_batch([record(user_id, days_ago, 1000 + days_ago) for days_ago in range(30, 75, 3)])
+    update_steps(record(user_id, 45, 0))
+    assert stored_rollups(user_id) == recomputed_rollups(user_id)
+
+    # The full rebuild produces the same tables
+    expected = stored_rollups(user_id)
+    rollups.rebuild(user_id)
+    assert stored_rollups(user_id) == expected
+
+
+def deadlock_once(monkeypatch):
+    lock_current_steps = rollups.lock_current_steps
+    calls = []
+
+    def flaky(cursor, step_rows):
+        calls.append(len(step_rows))
+        if len(calls) == 1:
+            raise mysql.connector.errors.DatabaseError(msg="Deadlock found", errno=DB_Interface.ER_LOCK_DEADLOCK)
+        return lock_current_steps(cursor, step_rows)
+
+    monkeypatch.setattr(rollups, "lock_current_steps", flaky)
+    return calls
+
+
+def test_deadlocked_step_write_is_retried(new_user, monkeypatch):
+    user_id = new_user()
+    calls = deadlock_once(monkeypatch)
+    update_steps(record(user_id, 0, 2500))
+    assert calls == [1, 1]
+    assert stored_rollups(user_id)[2] == 2500
+
+
+def test_deadlocked_batch_is_retried_whole(new_user, monkeypatch):
+    user_id = new_user()
+    calls = deadlock_once(monkeypatch)
+    results = update_steps_batch([record(user_id, 1, 2000), record(user_id, 2, 3000)])
+    # Retried as one chunk, not row by row against a rolled back transaction
+    assert calls == [2, 2]
+    assert [result["status"] for result in results] == ["ok", "ok"]
+    assert stored_rollups(user_id) == recomputed_rollups(user_id)
+    assert stored_rollups(user_id)[2] == 5000
@@ -0,0 +1,169 @@
+import time
+
+import pytest
+
+import seed_data
+from db_pool import pool
+from session_tokens import TokenError, _b64decode, _b64encode, issue_token, revoke_token, verify_token
+
+
+PROFILE = {"user_id": 7, "username": "walker", "experience": 10, "stepgoal": 8000, "caloriegoal": 400}
+
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def login(client, index):
+    response = client.post("/login", json={
+        "phone_number": seed_data.seed_phone_number(index), "password": seed_data.SEED_PASSWORD,
+    })
+    assert response.status_code == 200
+    return response.json()["token"]
+
+
+def test_issued_token_verifies():
+    token, claims = issue_token(PROFILE)
+    verified = verify_token(token)
+    assert verified == claims
+    assert verified["sub"] == 7
+    assert verified["username"] == "walker"
+
+
+def test_forged_signature_is_rejected():
+    token, _ = issue_token(PROFILE)
+    payload, _ = token.split(".")
+    with pytest.raises(TokenError, match="signature"):
+        verify_token(payload + "." + _b64encode(b"x" * 32))
+
+
+def test_changed_claims_are_rejected():
+    token, _ = issue_token(PROFILE)
+    payload, signature = token.split(".")
+    claims = _b64decode(payload).replace(b'"sub":7', b'"sub":8')
+    with pytest.raises(TokenError, match="signature"):
+        verify_token(_b64encode(claims) + "." + signature)
+
+
+@pytest.mark.parametrize("token", ["", "abc", "a.b.c", "!!!.???"])
+def test_malformed_token_is_rejected(token):
+    with pytest.raises(TokenError):
+        verify_token(token)
+
+
+def test_expired_token_is_rejected():
+    token, _ = issue_token(PROFILE, ttl=-1)
+    with pytest.raises(TokenError, match="expired"):
+        verify_token(token)
+
+
+def test_revoked_token_is_rejected():
+    token, claims = issue_token(PROFILE)
+    revoke_token(claims)
+    with pytest.raises(TokenError, match="revoked"):
+        verify_token(token)
+
+
+def test_request_without_token_is_rejected(client, users):
+    response = client.get(f"/get-balance?id={users[0]}")
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"] == "Bearer"
+
+
+def test_public_paths_need_no_token(client):
+    assert client.get("/test").status_code == 200
+
+
+def test_token_for_own_user_is_accepted(client, users):
+    token = login(client, 0)
+    assert client.get(f"/get-balance?id={users[0]}", headers=bearer(token)).status_code == 200
+
+
+def test_token_for_another_user_is_rejected(client, users):
+    token = login(client, 0)
+    assert client.get(f"/get-balance?id={users[1]}", headers=bearer(token)).status_code == 403
+    response = client.post("/store-activity", headers=bearer(token), json={
+        "user_id": users[1], "activity": "walk", "duration": 1, "activity_date": "2026-01-01 00:00:00",
+    })
+    assert response.status_code == 403
+
+
+def test_repeated_user_parameter_is_rejected(client, users):
+    token = login(client, 0)
+    for query in (f"id={users[0]}&id={users[1]}", f"id={users[1]}&id={users[0]}", f"id={users[0]}&id={users[0]}"):
+        assert client.get(f"/get-balance?{query}", headers=bearer(token)).status_code == 400
+
+
+def test_forged_token_is_rejected_by_middleware(client, users):
+    token = login(client, 0)
+    payload, _ = token.split(".")
+    forged = payload + "." + _b64encode(b"x" * 32)
+    assert client.get(f"/get-balance?id={users[0]}", headers=bearer(forged)).status_code == 401
+
+
+def test_expired_token_is_rejected_by_middleware(client, users):
+    token, _ = issue_token({"user_id": users[0]}, ttl=-1)
+    response = client.get(f"/get-balance?id={users[0]}", headers=bearer(token))
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Token expired"
+
+
+def test_logout_revokes_the_token(client, users):
+    token = login(client, 0)
+    assert client.post("/logout", headers=bearer(token)).status_code == 200
+    response = client.get(f"/get-balance?id={users[0]}", headers=bearer(token))
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Token revoked"
+
+
+def test_refresh_revokes_the_old_token(client, users):
+    token = login(client, 0)
+    refreshed = client.post("/refresh-token", headers=bearer(token)).json()["token"]
+    assert client.get(f"/get-balance?id={users[0]}", headers=bearer(token)).status_code == 401
+    assert client.get(f"/get-balance?id={users[0]}", headers=bearer(refreshed)).status_code == 200
+
+
+def test_login_ignores_a_stale_token(client):
+    token, _ = issue_token(PROFILE, ttl=-1)
+    response = client.post("/login", headers=bearer(token), json={
+        "phone_number": seed_data.seed_phone_number(0), "password": seed_data.SEED_PASSWORD,
+    })
+    assert response.status_code == 200
+    assert verify_token(response.json()["token"])["exp"] > time.time()
+
+
+def test_only_the_recipient_answers_a_friend_request(client, users):
+    connection = pool.connect()
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT friend_id, requester_id, recipient_id FROM friendships ORDER BY friend_id LIMIT 1")
+        friend_id, requester, recipient = cursor.fetchone()
+    finally:
+        cursor.close()
+        connection.close()
+    bystander = next(user for user in users if user not in (requester, recipient))
+
+    for user in (requester, bystander):
+        token = login(client, users.index(user))
+        response = client.get(f"/respond-request?id={friend_id}&status=accepted", headers=bearer(token))
+        assert response.status_code == 403
+    token = login(client, users.index(recipient))
+    response = client.get(f"/respond-request?id={friend_id}&status=accepted", headers=bearer(token))
+    assert response.status_code == 200
+
+
+def test_unknown_friend_request_is_not_found(client):
+    response = client.get("/respond-request?id=999999&status=accepted", headers=bearer(login(client, 0)))
+    assert response.status_code == 404
+
+
+def test_admin_paths_need_the_admin_key(client, users):
+    token = login(client, 0)
+    assert client.get("/admin/pool-stats").status_code == 401
+    assert client.get("/admin/pool-stats", headers=bearer(token)).status_code == 401
+    assert client.get("/admin/pool-stats", headers={"X-Admin-Key": "wrong"}).status_code == 401
+    assert client.post("/generate-qr", json={"name": "a", "amount": 1}).status_code == 401
+    assert client.get("/admin/pool-stats", headers={"X-Admin-Key": "test-admin-key"}).status_code == 200
+    # The admin GUI reads any user's transactions
+    response = client.get(f"/get-transaction?id={users[1]}", headers={"X-Admin-Key": "test-admin-key"})
+    assert response.status_code == 200
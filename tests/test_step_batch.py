@@ -0,0 +1,66 @@
+from datetime import date, timedelta
+
+import pytest
+
+from DB_Interface import update_steps_batch
+from db_pool import pool
+
+
+TODAY = date.today()
+BAD_STEPS = 666666
+
+
+def execute(sql, params=()):
+    connection = pool.connect()
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall() if cursor.description else None
+        connection.commit()
+        return rows
+    finally:
+        cursor.close()
+        connection.close()
+
+
+@pytest.fixture
+def refuse_bad_rows():
+    # The database itself refuses one value, after the records passed validation
+    execute(f"""
+        CREATE TRIGGER refuse_bad_steps BEFORE INSERT ON steps
+        WHEN NEW.daily_step_count = {BAD_STEPS}
+        BEGIN SELECT RAISE(ABORT, 'refused by trigger'); END
+    """)
+    yield
+    execute("DROP TRIGGER refuse_bad_steps")
+
+
+def record(user_id, days_ago, steps):
+    return {"user_id": user_id, "date": (TODAY - timedelta(days=days_ago)).isoformat(),
+            "steps": steps, "midnight_step_count": None}
+
+
+def test_bad_record_rolls_back_only_its_own_savepoint(new_user, refuse_bad_rows):
+    user_id = new_user()
+    records = [record(user_id, 1, 1000), record(user_id, 2, BAD_STEPS), record(user_id, 3, 3000),
+               {"user_id": user_id, "date": "not a date", "steps": 1, "midnight_step_count": None}]
+    results = update_steps_batch(records)
+
+    assert [result["status"] for result in results] == ["ok", "error", "ok", "error"]
+    assert [result["index"] for result in results] == [0, 1, 2, 3]
+    assert "refused by trigger" in results[1]["detail"]
+    assert results[3]["detail"].startswith("Invalid record")
+
+    stored = dict(execute("SELECT date, daily_step_count FROM steps WHERE user_id = %s", (user_id,)))
+    assert stored == {TODAY - timedelta(days=1): 1000, TODAY - timedelta(days=3): 3000}
+    # The derived tables only saw the committed rows
+    assert execute("SELECT total_steps FROM step_totals WHERE user_id = %s", (user_id,)) == [(4000,)]
+
+
+def test_batch_through_the_endpoint_reports_partial_success(client, new_user, refuse_bad_rows):
+    user_id = new_user()
+    response = client.post("/update-steps/batch", headers={"X-Admin-Key": "test-admin-key"},
+                           json={"records": [record(user_id, 1, 500), record(user_id, 2, BAD_STEPS)]})
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["status"], body["written"], body["failed"]) == ("partial", 1, 1)
@@ -0,0 +1,105 @@
+from datetime import date, timedelta
+
+import pytest
+
+from DB_Interface import flush_buffered_steps
+from db_pool import pool
+from step_buffer import StepBuffer
+
+
+TODAY = date.today()
+
+
+def scalar(sql, params):
+    connection = pool.connect()
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def total_steps(user_id):
+    return scalar("SELECT COALESCE(SUM(total_steps), 0) FROM step_totals WHERE user_id = %s", (user_id,))
+
+
+def stored_steps(user_id):
+    return scalar("SELECT COALESCE(SUM(daily_step_count), 0) FROM steps WHERE user_id = %s", (user_id,))
+
+
+def add(buffer, user_id, days_ago, steps):
+    day = TODAY - timedelta(days=days_ago)
+    buffer.add(user_id, day, {"user_id": user_id, "date": day.isoformat(), "steps": steps, "midnight_step_count": None})
+
+
+def test_failed_flush_rebuffers_without_double_counting(new_user):
+    user_id = new_user()
+    fail = {"after_write": True}
+
+    def writer(records):
+        # Writes and commits, then fails as if the reply was lost: every record is kept
+        results = flush_buffered_steps(records)
+        if fail["after_write"]:
+            raise ConnectionError("reply lost")
+        return results
+
+    buffer = StepBuffer(writer, lock_file="")
+    add(buffer, user_id, 1, 3000)
+    add(buffer, user_id, 2, 4000)
+    with pytest.raises(ConnectionError):
+        buffer.flush()
+    assert buffer.stats()["pending"] == 2
+
+    # A newer value for a key wins over the restored one
+    add(buffer, user_id, 1, 3500)
+    fail["after_write"] = False
+    assert buffer.flush() == 2
+    assert buffer.stats()["pending"] == 0
+    assert stored_steps(user_id) == 7500
+    assert total_steps(user_id) == 7500   # the rewrite of the same values added nothing
+
+
+def test_records_the_database_refuses_stay_pending(new_user):
+    user_id = new_user()
+    refused = {TODAY - timedelta(days=1)}
+
+    def writer(records):
+        ok = [record for record in records if date.fromisoformat(record["date"]) not in refused]
+        flush_buffered_steps(ok)
+        return [
+            {"index": index, "status": "ok" if record in ok else "error", "detail": "Database error: locked"}
+            for index, record in enumerate(records)
+        ]
+
+    buffer = StepBuffer(writer, lock_file="")
+    add(buffer, user_id, 1, 1000)
+    add(buffer, user_id, 2, 2000)
+    assert buffer.flush() == 1
+    assert buffer.stats()["pending"] == 1
+    assert buffer.stats()["failed"] == 1
+    assert total_steps(user_id) == 2000
+
+    refused.clear()
+    assert buffer.flush() == 1
+    assert buffer.stats()["pending"] == 0
+    assert total_steps(user_id) == 3000
+
+
+def test_second_buffer_on_the_host_refuses_to_start(tmp_path):
+    lock_file = str(tmp_path / "step_buffer.lock")
+    first = StepBuffer(lambda records: [], flush_interval=60, lock_file=lock_file)
+    second = StepBuffer(lambda records: [], flush_interval=60, lock_file=lock_file)
+    first.start()
+    try:
+        with pytest.raises(RuntimeError, match="single worker"):
+            second.start()
+        # Declared sticky routing skips the check
+        sticky = StepBuffer(lambda records: [], flush_interval=60, lock_file=lock_file, sticky_routing=True)
+        sticky.start()
+        sticky.stop()
+    finally:
+        first.stop()
+    second.start()   # free again once the first one stopped
+    second.stop()
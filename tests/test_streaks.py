@@ -0,0 +1,110 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+import streaks
+from DB_Interface import get_longest_streak, update_steps, update_steps_batch
+from db_pool import pool
+
+
+TODAY = date.today()
+
+
+def rows(sql, params):
+    connection = pool.connect()
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def recompute(user_id):
+    """(runs, longest, current) straight from the steps table."""
+    days = [day for day, in rows("SELECT date FROM steps WHERE user_id = %s AND daily_step_count > %s ORDER BY date",
+                                 (user_id, streaks.STREAK_MIN_STEPS))]
+    runs = []
+    for day in days:
+        if runs and runs[-1][1] == day - timedelta(days=1):
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    runs = [tuple(run) for run in runs]
+    longest = max(((end - start).days + 1 for start, end in runs), default=0)
+    current = 0
+    if runs and runs[-1][1] >= TODAY - timedelta(days=1):
+        current = (runs[-1][1] - runs[-1][0]).days + 1
+    return runs, longest, current
+
+
+def assert_matches_recompute(user_id):
+    runs, longest, current = recompute(user_id)
+    stored = rows("SELECT start_date, end_date FROM streak_runs WHERE user_id = %s ORDER BY start_date", (user_id,))
+    assert [tuple(run) for run in stored] == runs
+    assert get_longest_streak(user_id) == {"longest_streak": longest, "current_streak": current}
+
+
+def write(user_id, days_ago, steps):
+    update_steps({"user_id": user_id, "date": (TODAY - timedelta(days=days_ago)).isoformat(),
+                  "steps": steps, "midnight_step_count": None})
+
+
+def test_backfilled_day_joins_two_runs(new_user):
+    user_id = new_user()
+    for days_ago in (10, 9, 8, 6, 5, 4):
+        write(user_id, days_ago, 5000)
+    assert get_longest_streak(user_id)["longest_streak"] == 3
+    write(user_id, 7, 5000)
+    assert get_longest_streak(user_id) == {"longest_streak": 7, "current_streak": 0}
+    assert_matches_recompute(user_id)
+
+
+def test_edit_to_zero_splits_a_run(new_user):
+    user_id = new_user()
+    for days_ago in range(6, 0, -1):
+        write(user_id, days_ago, 5000)
+    assert get_longest_streak(user_id) == {"longest_streak": 6, "current_streak": 6}
+    write(user_id, 4, 0)
+    assert get_longest_streak(user_id) == {"longest_streak": 3, "current_streak": 3}
+    assert_matches_recompute(user_id)
+    # Dropping to STREAK_MIN_STEPS or below splits a run too
+    write(user_id, 2, 999)
+    assert get_longest_streak(user_id) == {"longest_streak": 2, "current_streak": 1}
+    assert_matches_recompute(user_id)
+
+
+def test_current_streak_ends_when_yesterday_is_missed(new_user):
+    user_id = new_user()
+    for days_ago in (4, 3, 2):
+        write(user_id, days_ago, 5000)
+    assert get_longest_streak(user_id) == {"longest_streak": 3, "current_streak": 0}
+    write(user_id, 0, 5000)
+    assert get_longest_streak(user_id) == {"longest_streak": 3, "current_streak": 1}
+    write(user_id, 1, 5000)
+    assert get_longest_streak(user_id) == {"longest_streak": 5, "current_streak": 5}
+
+
+@pytest.mark.parametrize("batch", [False, True])
+def test_random_writes_match_a_full_recompute(new_user, batch):
+    user_id = new_user()
+    rng = random.Random(11)
+    for _ in range(60):
+        if batch:
+            records = [
+                {"user_id": user_id, "date": (TODAY - timedelta(days=rng.randrange(20))).isoformat(),
+                 "steps": rng.choice([0, 500, 5000]), "midnight_step_count": None}
+                for _ in range(rng.randrange(1, 6))
+            ]
+            update_steps_batch(records)
+        else:
+            write(user_id, rng.randrange(20), rng.choice([0, 500, 5000]))
+        assert_matches_recompute(user_id)
+
+    # The full rebuild agrees with the incremental state
+    before = rows("SELECT start_date, end_date FROM streak_runs WHERE user_id = %s ORDER BY start_date", (user_id,))
+    streaks.rebuild(user_id)
+    assert rows("SELECT start_date, end_date FROM streak_runs WHERE user_id = %s ORDER BY start_date", (user_id,)) == before
+    assert_matches_recompute(user_id)
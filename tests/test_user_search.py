@@ -0,0 +1,70 @@
+import threading
+import time
+
+from user_search import UserSearchIndex
+
+
+class CountingIndex(UserSearchIndex):
+    def __init__(self, delay=0.0):
+        super().__init__(refresh_interval=60)
+        self.delay = delay
+        self.fetches = 0
+
+    def _fetch(self, after_user_id):
+        self.fetches += 1
+        time.sleep(self.delay)
+        return super()._fetch(after_user_id)
+
+
+def test_search_ranks_exact_prefix_then_substring(users):
+    index = UserSearchIndex()
+    index.load()
+    index.add(990001, "Walker")
+    index.add(990002, "walk")
+    index.add(990003, "moonwalker")
+    index.add(990004, "the_walker_2")
+    found = [user_id for user_id, _ in index.search("walk") if user_id >= 990001]
+    assert found == [990002, 990001, 990004, 990003]
+    assert index.search("walk", exclude={990002})[0][0] == 990001
+    assert index.search("user1") == [(users[1], "user1")]
+
+
+def test_stale_index_refreshes_once_in_the_background(users):
+    index = CountingIndex(delay=0.3)
+    index.load()
+    index._loaded_at -= 120   # past the refresh interval
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=index.ensure_fresh) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Nobody waited for the refresh, and only one ran
+    assert time.monotonic() - started < 0.2
+    background = index._background
+    if background is not None:
+        background.join(5)
+    assert index.fetches == 2   # the load and one refresh
+
+
+def test_first_load_is_single_flight(users):
+    index = CountingIndex(delay=0.1)
+    threads = [threading.Thread(target=index.ensure_fresh) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert index.fetches == 1
+    assert index.username(users[0]) == "user0"
+
+
+def test_queued_refreshes_reuse_the_one_that_ran(users):
+    index = CountingIndex(delay=0.2)
+    index.load()
+    threads = [threading.Thread(target=index.refresh) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert index.fetches == 2
@@ -0,0 +1,184 @@
+"""
+In-process username search index.
+
+Usernames are indexed by their 1-, 2- and 3-character n-grams, so a query
+only looks at users that contain every trigram of it instead of running
+`username LIKE '%x%'` over the whole table. The index is loaded once,
+register_user adds new users to it, and users registered through other
+workers are picked up by an incremental `user_id > last seen` refresh. That
+refresh runs in a background thread while searches keep using the index;
+only the first load makes requests wait, for a single load.
+"""
+import heapq
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+from db_pool import pool
+
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+# Seconds between incremental refreshes from the users table
+SEARCH_REFRESH_INTERVAL = float(os.getenv("USER_SEARCH_REFRESH_INTERVAL", "30"))
+
+logger = logging.getLogger("fitness.db")
+
+
+def _ngrams(text, size):
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class UserSearchIndex:
+    # Seconds before a failed background refresh is tried again
+    RETRY_AFTER = 30
+
+    def __init__(self, refresh_interval=SEARCH_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._names = {}
+        self._grams = defaultdict(set)
+        self._max_user_id = 0
+        self._loaded_at = None
+        self._lock = threading.RLock()
+        self._reload_lock = threading.Lock()   # one load / refresh at a time
+        self._background = None                # background refresh thread
+        self._retry_at = 0.0
+
+    def add(self, user_id, username):
+        username = username or ""
+        key = username.lower()
+        with self._lock:
+            old = self._names.get(user_id)
+            if old is not None:
+                self._unindex(user_id, old.lower())
+            self._names[user_id] = username
+            for size in (1, 2, 3):
+                for gram in _ngrams(key, size):
+                    self._grams[gram].add(user_id)
+            self._max_user_id = max(self._max_user_id, user_id)
+
+    def _unindex(self, user_id, key):
+        for size in (1, 2, 3):
+            for gram in _ngrams(key, size):
+                ids = self._grams.get(gram)
+                if ids is not None:
+                    ids.discard(user_id)
+                    if not ids:
+                        del self._grams[gram]
+
+    def username(self, user_id):
+        return self._names.get(user_id)
+
+    def load(self):
+        """(Re)build the whole index from the users table."""
+        with self._reload_lock:
+            self._load()
+
+    def _load(self):
+        rows = self._fetch(0)
+        with self._lock:
+            self._names = {}
+            self._grams = defaultdict(set)
+            self._max_user_id = 0
+            for user_id, username in rows:
+                self.add(user_id, username)
+            self._loaded_at = time.monotonic()
+
+    def refresh(self):
+        """Pick up users registered since the last load/refresh (e.g. on other workers)."""
+        seen = self._loaded_at
+        with self._reload_lock:
+            # Threads that queued behind a refresh use its result instead of repeating it
+            if self._loaded_at is None or self._loaded_at == seen:
+                self._refresh()
+
+    def _refresh(self):
+        rows = self._fetch(self._max_user_id)
+        with self._lock:
+            for user_id, username in rows:
+                self.add(user_id, username)
+            self._loaded_at = time.monotonic()
+
+    def _fetch(self, after_user_id):
+        connection = pool.connect()
+        cursor = connection.cursor()
+        try:
+            cursor.execute(
+                "SELECT user_id, username FROM users WHERE user_id > %s ORDER BY user_id",
+                (after_user_id,)
+            )
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+            connection.close()
+
+    def ensure_fresh(self):
+        if self._loaded_at is None:
+            # Nothing to search yet: one thread loads, the others wait for it
+            with self._reload_lock:
+                if self._loaded_at is None:
+                    self._load()
+        elif time.monotonic() - self._loaded_at > self.refresh_interval:
+            self._refresh_in_background()
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._background is not None or time.monotonic() < self._retry_at:
+                return
+            self._background = threading.Thread(target=self._background_refresh,
+                                                name="user-search-refresh", daemon=True)
+            self._background.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as err:
+            logger.error("Refreshing the user search index failed: %s", err)
+            with self._lock:
+                self._retry_at = time.monotonic() + self.RETRY_AFTER
+        finally:
+            with self._lock:
+                self._background = None
+
+    def search(self, query, limit=SEARCH_DEFAULT_LIMIT, exclude=()):
+        """
+        Return up to `limit` (user_id, username) pairs whose username contains
+        `query`, ranked: exact match, prefix, word prefix, then any substring;
+        shorter names first within a rank.
+        """
+        needle = query.strip().lower()
+        if not needle:
+            return []
+
+        with self._lock:
+            size = min(len(needle), 3)
+            grams = sorted((self._grams.get(gram, set()) for gram in _ngrams(needle, size)), key=len)
+            candidates = set(grams[0]).intersection(*grams[1:]) if grams else set()
+            names = {user_id: self._names[user_id] for user_id in candidates if user_id not in exclude}
+
+        ranked = []
+        for user_id, username in names.items():
+            key = username.lower()
+            position = key.find(needle)
+            if position < 0:
+                continue  # trigrams matched out of order
+            if key == needle:
+                rank = 0
+            elif position == 0:
+                rank = 1
+            elif not key[position - 1].isalnum():
+                rank = 2
+            else:
+                rank = 3
+            ranked.append((rank, len(key), key, user_id, username))
+
+        return [(user_id, username) for _, _, _, user_id, username in heapq.nsmallest(limit, ranked)]
+
+    def stats(self):
+        with self._lock:
+            return {"users": len(self._names), "ngrams": len(self._grams), "max_user_id": self._max_user_id}
+
+
+user_search_index = UserSearchIndex()